@@ -11,8 +11,22 @@ Config.set('graphics', 'width', '480')
 Config.set('graphics', 'height', '640')
 Config.set('graphics', 'resizable', True)
 
+import asyncio
+
 from kivy.core.window import Window
 
 from .app import DurakFloatApp
 
-DurakFloatApp().run()
+# solo=1 - игра против компьютера, bot_ms - сколько бот думает над ходом,
+# server=адрес:порт - играть через сервер (python -m src.server), lobby=1 - искать соперника через лобби,
+# metrics=1 - собирать метрики (src/metrics.py), journal=путь - записывать партии в журнал (src/logic/gamelog.py)
+server = os.environ.get('server')
+if server:
+    host, _, port = server.rpartition(':')
+    server = (host, int(port))
+
+app = DurakFloatApp(solo=bool(int(os.environ.get('solo', 0))), bot_budget_ms=int(os.environ.get('bot_ms', 150)),
+                    server=server, lobby=bool(int(os.environ.get('lobby', 0))), journal=os.environ.get('journal'))
+
+# Kivy работает внутри цикла asyncio, в нем же обслуживаются игровые сокеты
+asyncio.run(app.async_run(async_lib='asyncio'))
@@ -7,12 +7,20 @@ from kivy.uix.button import Button
 from kivy.uix.floatlayout import FloatLayout
 
 from src.logic.durak import *
+from .gui import atlas
 from .gui.animation import AnimationSystem
 from .gui.card import Card
 from .gui.game_layout import GameLayout
 from .gui.label import GameMessageLabel
+from .logic.bot_game import DurakBotGame
+from .logic.game import DurakGame
+from .logic.gamelog import JournalWriter
 from .logic.net_game import DurakNetGame
+from .logic.server_game import DurakServerGame
+from .network.aio import AsyncNetworking
 from .network.discovery_protocol import DiscoveryProtocol
+from .network.lobby import LobbyClient
+from .network.mux import Multiplexer, CONTROL
 
 PORT_NO = 37020
 PORT_NO_AUX = 37021
@@ -78,7 +86,7 @@ class DurakFloatApp(App):
     def on_disconnect_button(self, *_):
         self.reset()
 
-    def player_take_cards(self, is_me):
+    def player_take_cards(self, is_me, state):
         hand = self.layout.my_cards if is_me else self.layout.opp_cards
         for i, (c1, c2) in enumerate(self.layout.field):
             hand.append(c1)
@@ -88,11 +96,12 @@ class DurakFloatApp(App):
                 c2.opened = is_me
         self.layout.field.clear()
         self.layout.update_field()
-        self.update_hands()
+        self.update_hands(state)
 
-    def update_hands(self):
-        self.layout.update_cards_in_hand(is_my=True, real_cards=self.game.my_cards)
-        self.layout.update_cards_in_hand(is_my=False, real_cards=self.game.opp_cards)
+    def update_hands(self, state):
+        my_index = self.game.my_index
+        self.layout.update_cards_in_hand(is_my=True, real_cards=state.players[my_index].cards)
+        self.layout.update_cards_in_hand(is_my=False, real_cards=state.players[1 - my_index].cards)
 
     def reset(self):
         if self.game:
@@ -117,19 +126,28 @@ class DurakFloatApp(App):
         self.toggle_buttons()
 
     @mainthread
-    def on_game_state_update(self, *_):
+    def on_game_state_update(self, state):
+        # state - копия после этого изменения; живое состояние к этому моменту
+        # могло уйти вперед в потоке бота или сети
+        if self.game is None:
+            return
+        my_index = self.game.my_index
 
         if not self.game_init:
             self.game_init = True
-            self.layout.make_cards(self.game.my_cards, self.game.opp_cards, self.game.state.trump, self.game.state.deck)
+            self.layout.make_cards(state.players[my_index].cards, state.players[1 - my_index].cards,
+                                   state.trump, state.deck)
 
-        if self.game.winner is not None:
+        if state.winner is not None:
             self.show_results()
         else:
-            up = self.game.state.last_update
+            up = state.last_update
 
             print(f'update: {up}')
 
+            for old, new in up.get('relabel', ()):
+                self.layout.relabel(old, new)
+
             action = up.get('action')
             if action == UpdateAction.ATTACK:
                 card = up['card']
@@ -143,12 +161,12 @@ class DurakFloatApp(App):
                     self.layout.throw_away_field()
                 else:
                     me_took = self.game.is_me(up['take_cards']['player'])
-                    self.player_take_cards(me_took)
+                    self.player_take_cards(me_took, state)
 
-                self.layout.give_cards(up['from_deck'], len(self.game.state.deck),
-                                       self.game.my_cards, self.game.opp_cards, self.game.my_index)
+                self.layout.give_cards(up['from_deck'], len(state.deck), state.players[my_index].cards,
+                                       state.players[1 - my_index].cards, my_index)
 
-            self.update_hands()
+            self.update_hands(state)
 
             self.toggle_buttons()
 
@@ -160,13 +178,22 @@ class DurakFloatApp(App):
         self.reset()
 
     @mainthread
-    def on_found_peer(self, addr, peer_id):
-        print(f'Найден соперник {peer_id}@{addr}')
-        self.discovery = None
-
-        self.game = DurakNetGame(self.my_pid, peer_id, addr[0], [PORT_NO, PORT_NO_AUX])
+    def on_connection_changed(self, connected):
+        # партия и карты на столе остаются: DurakNetGame сам продолжит с того же хода
+        if connected:
+            self.game_label.update_message('Связь восстановлена', fade_after=2.0)
+        else:
+            self.show_error('Связь потеряна, переподключаемся...')
+
+    def start_game(self, game: DurakGame, message):
+        self.game = game
+        if self.journal_path:
+            if self.journal is None:
+                self.journal = JournalWriter(self.journal_path)
+            self.game.journal = self.journal
         self.game.on_state_updated = self.on_game_state_update
         self.game.on_opponent_quit = self.on_opponent_quit
+        self.game.on_connection_changed = self.on_connection_changed
         self.game.start()
 
         self.locked_controls = False
@@ -174,26 +201,68 @@ class DurakFloatApp(App):
         self.toggle_button(self.disconnect_button, True)
         self.toggle_button(self.finish_button, True)
 
-        self.game_label.update_message('Соперник найден!', fade_after=2.0)
+        self.game_label.update_message(message, fade_after=2.0)
         self.display_whose_turn()
 
+    @mainthread
+    def on_found_peer(self, addr, peer_id):
+        print(f'Найден соперник {peer_id}@{addr}')
+        self.discovery = None
+
+        self.start_game(DurakNetGame(self.my_pid, peer_id, addr, mux=self.mux), 'Соперник найден!')
+
     def scan(self, *_):
 
+        if self.solo:
+            self.start_game(DurakBotGame(budget_ms=self.bot_budget_ms), 'Игра против компьютера!')
+            return
+
+        if self.server:
+            self.start_game(DurakServerGame(self.my_pid, self.server), 'Игра через сервер!')
+            return
+
+        if not self.mux:
+            # один сокет на поиск соперника и игру; второй порт - для второго клиента на той же машине
+            self.mux = Multiplexer([PORT_NO, PORT_NO_AUX], network_cls=AsyncNetworking)
+
         if not self.discovery:
-            self.discovery = DiscoveryProtocol(self.my_pid, PORT_NO)
+            if self.lobby:
+                self.discovery = LobbyClient(self.my_pid, self.mux.session(CONTROL))
+            else:
+                self.discovery = DiscoveryProtocol(self.my_pid, net=self.mux.session(CONTROL))
             self.discovery.run_in_background(self.on_found_peer)
 
-    def __init__(self, **kwargs):
+    def __init__(self, solo=False, bot_budget_ms=150, server=None, lobby=False, journal=None, **kwargs):
+        """
+        :param server: (адрес, порт) сервера партий; без него соперник ищется в локальной сети
+        :param lobby: искать соперника через лобби (network.lobby) вместо рассылки каждому
+        :param journal: путь к журналу партий (logic.gamelog), None - не записывать
+        """
         super().__init__(**kwargs)
 
+        self.solo = solo
+        self.server = server
+        self.lobby = lobby
+        self.bot_budget_ms = bot_budget_ms
+        self.journal_path = journal
+        self.journal = None
+
         self.locked_controls = False
         self.my_pid = random.getrandbits(64)
 
-        self.game: DurakNetGame | None = None
+        self.game: DurakGame | None = None
         self.game_init = False
         self.discovery = None
+        self.mux = None
         self.selected_card = None
 
+    def on_stop(self):
+        if self.lobby and self.discovery:
+            # уходим из очереди брокера, не дожидаясь, пока он нас забудет
+            self.discovery.stop()
+        if self.journal is not None:
+            self.journal.close()
+
     def build(self):
         Builder.load_file('durak.kv')
         return MainLayout()
@@ -246,6 +315,8 @@ class DurakFloatApp(App):
         self.toggle_buttons()
 
         self.animator = AnimationSystem(self.root)
+        Card.animator = self.animator
+        Card.face_atlas = atlas.load()
         self.animator.run()
 
         self.locked_controls = True
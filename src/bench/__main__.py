@@ -0,0 +1,55 @@
+import argparse
+import json
+import os
+import sys
+
+from .cases import BENCHMARKS, MICRO
+from .runner import run, compare, load, save, THRESHOLD
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m src.bench',
+                                     description='Замеры скорости движка, сериализации и анимации')
+    parser.add_argument('names', nargs='*', help=f"по умолчанию все: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--min-time', type=float, default=0.2, help='секунд на один повтор')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--baseline', default=BASELINE, help='с чем сравнивать')
+    parser.add_argument('--save', action='store_true', help='записать результат как новый базовый')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='во сколько раз (сверх 1) замер может быть медленнее базового')
+    parser.add_argument('--json', action='store_true', help='вывести результат в JSON')
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    baseline = load(args.baseline) if os.path.exists(args.baseline) else None
+
+    def on_result(name, ns):
+        if args.json:
+            return
+        line = f"{'micro' if name in MICRO else 'macro'}  {name:<26} {ns:>14,.0f} ns/op"
+        if baseline and name in baseline['results']:
+            line += f"  {ns / baseline['results'][name]:6.2f}x baseline"
+        print(line)
+
+    report = run(args.names, args.min_time, args.repeat, on_result)
+    regressions = compare(report, baseline, args.threshold) if baseline else {}
+    report['regressions'] = regressions
+
+    if args.save:
+        save({'env': report['env'], 'results': report['results']}, args.baseline)
+
+    if args.json:
+        print(json.dumps(report))
+    elif regressions:
+        print(f"regressions over {args.threshold:.0%}: " +
+              ', '.join(f'{name} ({ratio:.2f}x)' for name, ratio in sorted(regressions.items())))
+    if regressions and not args.save:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
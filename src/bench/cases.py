@@ -0,0 +1,233 @@
+"""
+Замеры. Каждый замер - функция без аргументов, которая готовит данные и возвращает
+(op, n): op() выполняет n одинаковых операций, время делится на n
+"""
+import os
+import random
+
+from ..logic import bitboard
+from ..logic.bitboard import BitDurak
+from ..logic.durak import Durak, Player, DECK, UpdateAction
+from ..logic.serialization import DurakSerialized
+from ..network import codec
+from ..sim.policies import random_policy
+from ..sim.selfplay import play_game
+
+# одна и та же раздача во всех замерах
+SEED = 0
+
+
+def _mid_game(seed=SEED):
+    """
+    Партия в разгаре: на столе несколько карт, одна из них не отбита
+    """
+    rng = random.Random(seed)
+    game = Durak(rng=rng)
+    while not (len(game.field) >= 3 and game.any_unbeaten_cards):
+        actions = game.legal_actions(game.acting_player_index)
+        moves = [a for a in actions if a[0] != UpdateAction.FINISH_TURN]
+        game.apply(rng.choice(moves or actions))
+    return game
+
+
+def can_beat():
+    game = Durak(rng=random.Random(SEED))
+    pairs = [(a, d) for a in DECK for d in DECK if a != d]
+
+    def op():
+        for a, d in pairs:
+            game.can_beat(a, d)
+
+    return op, len(pairs)
+
+
+def can_add_to_field():
+    game = _mid_game()
+
+    def op():
+        for card in DECK:
+            game.can_add_to_field(card)
+
+    return op, len(DECK)
+
+
+def possible_to_beat():
+    game = _mid_game()
+    assert game.field
+
+    def op():
+        return game.possible_to_beat
+
+    return op, 1
+
+
+def bitboard_can_beat():
+    """
+    can_beat на BitDurak, те же пары карт
+    """
+    game = BitDurak(rng=random.Random(SEED))
+    pairs = [(a, d) for a in range(bitboard.N_CARDS) for d in range(bitboard.N_CARDS) if a != d]
+
+    def op():
+        for a, d in pairs:
+            game.can_beat(a, d)
+
+    return op, len(pairs)
+
+
+def bitboard_can_add_to_field():
+    game = BitDurak.from_durak(_mid_game())
+
+    def op():
+        for card in range(bitboard.N_CARDS):
+            game.can_add_to_field(card)
+
+    return op, bitboard.N_CARDS
+
+
+def bitboard_possible_to_beat():
+    game = BitDurak.from_durak(_mid_game())
+    assert game.field
+
+    def op():
+        return game.possible_to_beat
+
+    return op, 1
+
+
+def player_add_cards():
+    rng = random.Random(SEED)
+    deck = list(DECK)
+    rng.shuffle(deck)
+    hand, extra = deck[:6], deck[6:12]
+
+    def op():
+        Player(0, hand).add_cards(extra)
+
+    return op, 1
+
+
+def player_take_field():
+    """
+    Худший случай добавления: защищающийся с полной рукой забирает стол из 12 карт
+    """
+    rng = random.Random(SEED)
+    deck = list(DECK)
+    rng.shuffle(deck)
+    hand, field = deck[:6], deck[6:18]
+
+    def op():
+        Player(0, hand).add_cards(field)
+
+    return op, 1
+
+
+def player_sort_hand():
+    rng = random.Random(SEED)
+    deck = list(DECK)
+    rng.shuffle(deck)
+    hand = deck[:12]
+    player = Player(0, hand)
+
+    def op():
+        player.cards[:] = hand
+        player.sort_hand()
+
+    return op, 1
+
+
+def random_game():
+    policies = [random_policy, random_policy]
+    seeds = iter(range(1 << 30))
+
+    def op():
+        play_game(policies, random.Random(next(seeds)))
+
+    return op, 1
+
+
+def serialized_round_trip():
+    game = DurakSerialized(DurakSerialized.serialized(_mid_game()))
+
+    def op():
+        DurakSerialized(game.serialized())
+
+    return op, 1
+
+
+def state_message_json():
+    message = {'action': 'state', 'seq': 12, 'state': DurakSerialized.serialized(_mid_game())}
+
+    def op():
+        codec.loads(codec.dumps(message))
+
+    return op, 1
+
+
+def state_message_binary():
+    message = {'action': 'state', 'seq': 12, 'state': DurakSerialized.serialized(_mid_game())}
+
+    def op():
+        codec.loads(codec.dumps(message, binary=True))
+
+    return op, 1
+
+
+def animation_update():
+    """
+    Секунда анимации 36 карт при 60 кадрах в секунду, от разлета по столу до остановки
+    """
+    # иначе Kivy примет аргументы python -m src.bench за свои
+    os.environ.setdefault('KIVY_NO_ARGS', '1')
+    from kivy.properties import NumericProperty
+    from kivy.uix.widget import Widget
+
+    from ..gui.animation import AnimationSystem
+
+    class CardWidget(Widget):
+        rotation = NumericProperty(0)
+
+    rng = random.Random(SEED)
+    root = Widget()
+    starts = []
+    for _ in DECK:
+        card = CardWidget(size=(60, 90))
+        card.target_position = (rng.uniform(0, 480), rng.uniform(0, 640))
+        card.target_rotation = rng.uniform(-30, 30)
+        starts.append((rng.uniform(0, 480), rng.uniform(0, 640)))
+        root.add_widget(card)
+    system = AnimationSystem(root)
+    frames = 60
+
+    def op():
+        for card, pos in zip(root.children, starts):
+            card.pos = pos
+            card.rotation = 0
+            system.animate(card)
+        for _ in range(frames):
+            system.update(1 / frames)
+
+    return op, frames
+
+
+MICRO = {
+    'can_beat': can_beat,
+    'can_add_to_field': can_add_to_field,
+    'possible_to_beat': possible_to_beat,
+    'bitboard_can_beat': bitboard_can_beat,
+    'bitboard_can_add_to_field': bitboard_can_add_to_field,
+    'bitboard_possible_to_beat': bitboard_possible_to_beat,
+    'player_add_cards': player_add_cards,
+    'player_take_field': player_take_field,
+    'player_sort_hand': player_sort_hand,
+}
+
+MACRO = {
+    'random_game': random_game,
+    'serialized_round_trip': serialized_round_trip,
+    'state_message_json': state_message_json,
+    'state_message_binary': state_message_binary,
+    'animation_update': animation_update,
+}
+
+BENCHMARKS = {**MICRO, **MACRO}
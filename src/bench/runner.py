@@ -0,0 +1,92 @@
+"""
+Запуск замеров и сравнение с сохраненным базовым результатом
+"""
+import gc
+import json
+import platform
+import sys
+import time
+
+from .cases import BENCHMARKS
+
+# замер медленнее базового больше чем на столько считается регрессией
+THRESHOLD = 0.25
+
+
+def measure(bench, min_time=0.2, repeat=5):
+    """
+    :param bench: функция из cases.BENCHMARKS
+    :param min_time: сколько длится один повтор, секунд
+    :return: наносекунд на операцию - лучший из repeat повторов
+    """
+    op, n = bench()
+    op()
+
+    # подбираем число вызовов на повтор, как timeit.autorange
+    calls = 1
+    while True:
+        t0 = time.perf_counter_ns()
+        for _ in range(calls):
+            op()
+        elapsed = time.perf_counter_ns() - t0
+        if elapsed >= min_time * 1e9 / 10:
+            break
+        calls *= 2
+    calls = max(1, int(calls * min_time * 1e9 / max(elapsed, 1)))
+
+    best = None
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            t0 = time.perf_counter_ns()
+            for _ in range(calls):
+                op()
+            elapsed = time.perf_counter_ns() - t0
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best / (calls * n)
+
+
+def run(names=None, min_time=0.2, repeat=5, on_result=None):
+    """
+    :param names: какие замеры запускать, по умолчанию все
+    :param on_result: on_result(имя, нс на операцию) после каждого замера
+    :return: {'env': ..., 'results': {имя: нс на операцию}}
+    """
+    results = {}
+    for name in names or BENCHMARKS:
+        results[name] = round(measure(BENCHMARKS[name], min_time, repeat), 1)
+        if on_result is not None:
+            on_result(name, results[name])
+    return {'env': environment(), 'results': results}
+
+
+def environment():
+    return {'python': sys.version.split()[0], 'implementation': platform.python_implementation(),
+            'machine': platform.machine(), 'platform': platform.platform()}
+
+
+def compare(report, baseline, threshold=THRESHOLD):
+    """
+    :return: {имя: отношение ко времени в baseline} для замеров, ставших медленнее больше чем на threshold
+    """
+    regressions = {}
+    for name, ns in report['results'].items():
+        base = baseline['results'].get(name)
+        if base and ns / base > 1 + threshold:
+            regressions[name] = ns / base
+    return regressions
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write('\n')
@@ -1,33 +1,168 @@
+import numpy as np
 from kivy.clock import Clock
 from kivy.uix.widget import Widget
 
+from .. import metrics
+
 
 def fast_dist(x1, y1, x2, y2):
     return abs(x1 - x2) + abs(y1 - y2)
 
 
 class AnimationSystem:
-    EXP_ATT = 5.0
+    """
+    Движение виджетов к target_position (центр) и target_rotation.
+    Кадры идут только пока есть движущиеся виджеты: animate() добавляет виджет и при
+    необходимости запускает таймер, а когда все дошли до цели, таймер снимается.
+
+    Начала, цели и текущие значения всех движений лежат в массивах (x, y, угол) по слотам,
+    кадр считается одним векторным шагом, а в виджеты записываются только изменившиеся значения
+    """
+
+    DURATION = 0.5
+    FPS = 60.0
+
+    # ближе этого к цели виджет считается уже на месте
+    EPS = 0.1
+    # изменения меньше этого (в пикселях и градусах) незаметны и в виджет не записываются
+    WRITE_EPS = 0.5
+
+    CAPACITY = 64
+
+    def __init__(self, w: Widget, duration=DURATION):
+        self.widget = w
+        self.duration = duration
+
+        self._start = np.zeros((self.CAPACITY, 3))
+        self._target = np.zeros((self.CAPACITY, 3))
+        self._current = np.zeros((self.CAPACITY, 3))
+        # половина размера: в виджет пишется pos, а не center - одно присваивание вместо двух
+        self._half = np.zeros((self.CAPACITY, 2))
+        self._elapsed = np.zeros(self.CAPACITY)
+        self._active = np.zeros(self.CAPACITY, dtype=bool)
+
+        # слот -> виджет и обратно
+        self._widgets = [None] * self.CAPACITY
+        self._slots = {}
+        self._free = list(range(self.CAPACITY - 1, -1, -1))
+
+        self._event = None
+
+    @property
+    def running(self):
+        return self._event is not None
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _grow(self):
+        n = len(self._widgets)
+        self._start = np.concatenate([self._start, np.zeros((n, 3))])
+        self._target = np.concatenate([self._target, np.zeros((n, 3))])
+        self._current = np.concatenate([self._current, np.zeros((n, 3))])
+        self._half = np.concatenate([self._half, np.zeros((n, 2))])
+        self._elapsed = np.concatenate([self._elapsed, np.zeros(n)])
+        self._active = np.concatenate([self._active, np.zeros(n, dtype=bool)])
+        self._widgets += [None] * n
+        self._free += range(2 * n - 1, n - 1, -1)
+
+    def _release(self, slot):
+        child = self._widgets[slot]
+        self._widgets[slot] = None
+        self._active[slot] = False
+        del self._slots[child]
+        self._free.append(slot)
 
+    def animate(self, child):
+        """
+        Начать движение child к его target_position и target_rotation с текущего места.
+        Вызывается при каждой смене цели
+        """
+        x, y = child.center
+        r = getattr(child, 'rotation', 0.0)
+        tx, ty = child.target_position
+        tr = getattr(child, 'target_rotation', r)
+
+        slot = self._slots.get(child)
+        if fast_dist(x, y, tx, ty) < self.EPS and abs(tr - r) < self.EPS:
+            if slot is not None:
+                self._release(slot)
+            return
+
+        if slot is None:
+            if not self._free:
+                self._grow()
+            slot = self._free.pop()
+            self._slots[child] = slot
+            self._widgets[slot] = child
+        self._start[slot] = self._current[slot] = x, y, r
+        self._target[slot] = tx, ty, tr
+        self._half[slot] = child.width / 2, child.height / 2
+        self._elapsed[slot] = 0.0
+        self._active[slot] = True
+
+        if self._event is None:
+            self._event = Clock.schedule_interval(self.update, 1.0 / self.FPS)
+
+    def cancel(self, child):
+        slot = self._slots.get(child)
+        if slot is not None:
+            self._release(slot)
+
+    @metrics.timed('animation.update')
     def update(self, dt):
-        df = self.EXP_ATT * dt
+        slots = np.flatnonzero(self._active)
+        if not len(slots):
+            self.stop()
+            return
+
+        elapsed = self._elapsed[slots] + dt
+        self._elapsed[slots] = elapsed
+        t = np.minimum(elapsed / self.duration, 1.0)
+        # ease-out cubic
+        k = 1.0 - (1.0 - t) ** 3
+        start = self._start[slots]
+        values = start + (self._target[slots] - start) * k[:, None]
+
+        changed = np.abs(values - self._current[slots]) >= self.WRITE_EPS
+        done = t >= 1.0
+        # в конце движения записываем точную цель, даже если шаг меньше WRITE_EPS
+        changed |= done[:, None] & (values != self._current[slots])
+        moved = changed[:, 0] | changed[:, 1]
+        rotated = changed[:, 2]
+
+        self._current[slots[moved], :2] = values[moved, :2]
+        self._current[slots[rotated], 2] = values[rotated, 2]
+
+        # виджеты Kivy трогаем только там, где значение изменилось
+        widgets = self._widgets
+        slots_list, values_list = slots.tolist(), values.tolist()
+        pos_list = (values[:, :2] - self._half[slots]).tolist()
+        moved_list, rotated_list, done_list = moved.tolist(), rotated.tolist(), done.tolist()
+        for i in np.flatnonzero(moved | rotated | done).tolist():
+            child = widgets[slots_list[i]]
+            if done_list[i]:
+                # размер мог поменяться во время движения: в конце ставим центр точно в цель
+                child.center = values_list[i][:2]
+            elif moved_list[i]:
+                child.pos = pos_list[i]
+            if rotated_list[i]:
+                child.rotation = values_list[i][2]
+
+        for slot in slots[done].tolist():
+            self._release(slot)
+        if not self._active.any():
+            self.stop()
+
+    def run(self):
+        """
+        Досчитать движение виджетов, которые уже получили цели
+        """
         for child in self.widget.children:
             if hasattr(child, 'target_position'):
-                x, y = child.pos
-                x += child.size[0] / 2
-                y += child.size[1] / 2
-                tx, ty = child.target_position
-                if fast_dist(x, y, tx, ty) >= 0.1:
-                    x += (tx - x) * df
-                    y += (ty - y) * df
-                    child.pos = (x - child.size[0] / 2, y - child.size[1] / 2)
-            if hasattr(child, 'target_rotation'):
-                tr, r = child.target_rotation, child.rotation
-                if abs(tr - r) >= 0.1:
-                    child.rotation += (tr - r) * df
-
-    def __init__(self, w: Widget):
-        self.widget = w
+                self.animate(child)
 
-    def run(self):
-        Clock.schedule_interval(self.update, 1.0 / 60.0)
+    def stop(self):
+        if self._event is not None:
+            self._event.cancel()
+            self._event = None
@@ -0,0 +1,125 @@
+"""
+Атлас граней карт: все 36 лиц, рубашка и пустая карта для счетчика колоды
+заранее отрисованы в одну текстуру.
+
+Сборка (нужен OpenGL, один раз после изменения шрифта или фона):
+    python -m src.gui.atlas
+Получаются resources/cards.atlas и resources/cards-0.png в формате kivy.atlas.Atlas,
+грани доступны как atlas://resources/cards/<id>. Без атласа Card рисует текст как раньше.
+"""
+import functools
+import json
+import os
+
+from kivy.cache import Cache
+from kivy.core.text import Label as CoreLabel
+
+from ..logic.durak import DECK, CARD_INDEX, DIAMS, HEARTS
+
+ATLAS = 'resources/cards'
+FONT = 'resources/Arial.ttf'
+BACKGROUND = 'resources/rounded_corners.png'
+
+# грани рисуются в SCALE раз крупнее карты на экране с dp = 1 (64x120, шрифт 32, рамка 24)
+SCALE = 2
+FACE_SIZE = (64 * SCALE, 120 * SCALE)
+FONT_SIZE = 32 * SCALE
+BORDER = 24
+COLUMNS = 8
+
+BACK = 'back'
+BLANK = 'blank'
+
+RED = (0.8, 0, 0, 1)
+BLACK = (0, 0, 0, 1)
+GREEN = (0, 0.5, 0, 1)
+
+
+def face_id(card):
+    """
+    :return: id грани карты в атласе; для карты не из колоды - пустая
+    """
+    index = CARD_INDEX.get(tuple(card))
+    return BLANK if index is None else f'card{index}'
+
+
+def face_label(card):
+    """
+    :return: (текст, цвет) лица карты
+    """
+    n, s = card
+    return f'{s}{n}\n\n{n}{s}', RED if s in (DIAMS, HEARTS) else BLACK
+
+
+def faces():
+    """
+    :return: [(id, текст, цвет)] всех граней атласа
+    """
+    return [(face_id(card), *face_label(card)) for card in DECK] + [(BACK, '?', GREEN), (BLANK, '', BLACK)]
+
+
+def build(path=ATLAS, font=FONT, background=BACKGROUND):
+    """
+    Отрисовать все грани в одну текстуру и сохранить атлас
+    :return: путь к файлу .atlas
+    """
+    from kivy.core.window import Window  # noqa: F401 - Fbo нужен контекст OpenGL
+    from kivy.graphics import Fbo, Color, BorderImage, Rectangle, ClearColor, ClearBuffers
+
+    items = faces()
+    fw, fh = FACE_SIZE
+    rows = (len(items) + COLUMNS - 1) // COLUMNS
+    fbo = Fbo(size=(fw * COLUMNS, fh * rows))
+    regions = {}
+    with fbo:
+        ClearColor(0, 0, 0, 0)
+        ClearBuffers()
+        for i, (key, text, color) in enumerate(items):
+            # атлас Kivy считает y от нижнего края картинки, как и OpenGL
+            x, y = i % COLUMNS * fw, (rows - 1 - i // COLUMNS) * fh
+            regions[key] = [x, y, fw, fh]
+            Color(1, 1, 1, 1)
+            BorderImage(source=background, pos=(x, y), size=FACE_SIZE, border=(BORDER,) * 4,
+                        display_border=(BORDER * SCALE,) * 4)
+            if text:
+                label = CoreLabel(text=text, font_name=font, font_size=FONT_SIZE, halign='center')
+                label.refresh()
+                tw, th = label.texture.size
+                Color(*color)
+                Rectangle(texture=label.texture, pos=(x + (fw - tw) // 2, y + (fh - th) // 2), size=(tw, th))
+    fbo.draw()
+
+    image = f'{os.path.basename(path)}-0.png'
+    fbo.texture.save(os.path.join(os.path.dirname(path), image))
+    with open(f'{path}.atlas', 'w') as f:
+        json.dump({image: regions}, f, indent=1, sort_keys=True)
+    return f'{path}.atlas'
+
+
+def load(path=ATLAS):
+    """
+    Загрузить атлас, если он собран. Текстура загружается один раз
+    и дальше берется из кэша Kivy по адресам atlas://
+    :return: путь для atlas:// или None
+    """
+    if not os.path.exists(f'{path}.atlas'):
+        return None
+    from kivy.atlas import Atlas
+
+    if Cache.get('kv.atlas', path) is None:
+        Cache.append('kv.atlas', path, Atlas(f'{path}.atlas'))
+    return path
+
+
+@functools.lru_cache(maxsize=128)
+def glyph(text, font_size, font_name=FONT):
+    """
+    Текстура надписи. Одинаковые надписи (например, число карт в колоде) верстаются один раз
+    """
+    label = CoreLabel(text=text, font_name=font_name, font_size=font_size)
+    label.refresh()
+    return label.texture
+
+
+if __name__ == '__main__':
+    print(build())
@@ -0,0 +1,117 @@
+from kivy.clock import Clock
+from kivy.graphics import Color, Rectangle
+from kivy.uix.button import Button
+from kivy.properties import StringProperty, BooleanProperty, NumericProperty
+from src.gui import atlas
+from src.logic.durak import DIAMS, HEARTS
+
+PORT_NO = 37020
+PORT_NO_AUX = 37021
+
+
+class Card(Button):
+    nominal = StringProperty()
+    suit = StringProperty()
+    opened = BooleanProperty(True)
+    selected = BooleanProperty(False)
+    counter = NumericProperty(-1)
+    rotation = NumericProperty(0)
+
+    # AnimationSystem, которому сообщать о новых целях
+    animator = None
+
+    # путь atlas.load(): грани берутся из атласа, иначе текст верстается на лету
+    face_atlas = None
+
+    def _update_face(self):
+        if self.counter >= 0:
+            key = atlas.BLANK
+        elif not self.opened:
+            key = atlas.BACK
+        else:
+            key = atlas.face_id(self.as_tuple)
+        self.text = ''
+        self.border = (0, 0, 0, 0)
+        self.background_normal = self.background_down = f'atlas://{self.face_atlas}/{key}'
+
+        if self.counter >= 0:
+            if self._glyph is None:
+                with self.canvas:
+                    Color(0, 0, 0, 1)
+                    self._glyph = Rectangle()
+                self.bind(pos=self._place_glyph, size=self._place_glyph)
+            self._glyph.texture = atlas.glyph(str(int(self.counter)), self.font_size)
+            self._place_glyph()
+        elif self._glyph is not None:
+            self._glyph.texture = None
+            self._glyph.size = (0, 0)
+
+    def _place_glyph(self, *_):
+        texture = self._glyph.texture
+        if texture is not None:
+            self._glyph.size = texture.size
+            self._glyph.pos = (self.center_x - texture.width / 2, self.center_y - texture.height / 2)
+
+    def update_text(self, *_):
+        if self.face_atlas is not None:
+            self._update_face()
+        elif self.counter >= 0:
+            
+            self.text = str(int(self.counter))
+            self.color = (0, 0, 0, 1)
+        elif not self.opened:
+            
+            self.text = '?'
+            self.color = (0, 0.5, 0, 1)
+        else:
+            
+            s, n = self.suit, self.nominal
+            self.text = f'{s}{n}\n\n{n}{s}'
+            self.color = (0.8, 0, 0, 1) if self.suit in (DIAMS, HEARTS) else (0, 0, 0, 1)
+
+    def __init__(self, **kwargs):
+        self._glyph = None
+        super().__init__(**kwargs)
+        self.target_position = (100, 100)
+        self.target_rotation = 0
+        self.bind(counter=self.update_text)
+        self.bind(opened=self.update_text)
+
+    def set_animated_targets(self, x, y, ang):
+        self.target_position = x, y
+        self.target_rotation = ang
+        if self.animator is not None:
+            self.animator.animate(self)
+
+    def set_immeditate_attr(self, x, y, ang):
+        self.pos = x - self.width / 2, y - self.height / 2
+        self.rotation = ang
+        if self.animator is not None:
+            # движение к цели продолжается уже с нового места
+            self.animator.animate(self)
+
+    def bring_to_front(self):
+        parent = self.parent
+        parent.remove_widget(self)
+        parent.add_widget(self)
+
+    @property
+    def as_tuple(self):
+        return self.nominal, self.suit
+
+    def destroy_card_after_delay(self, delay):
+        def finisher(*_):
+            if self and self.parent:
+                self.parent.remove_widget(self)
+
+        Clock.schedule_once(finisher, delay)
+
+    @classmethod
+    def make(cls, card, opened=True):
+        card_widget = Card()
+        card_widget.nominal, card_widget.suit = card
+        card_widget.opened = opened
+        card_widget.update_text()
+        return card_widget
+
+
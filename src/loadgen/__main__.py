@@ -0,0 +1,45 @@
+import argparse
+import json
+
+from .harness import run_load, PORT_NO
+from ..network.aio import AsyncNetworking
+from ..network.network import Networking
+from ..sim.policies import POLICIES
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m src.loadgen',
+                                     description='Нагрузочный тест сетевой игры на localhost')
+    parser.add_argument('-n', '--players', type=int, default=50)
+    parser.add_argument('-p', '--policy', default='random', choices=sorted(POLICIES))
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('--port', type=int, default=PORT_NO, help='первый из портов игроков')
+    parser.add_argument('--aio', action='store_true', help='asyncio вместо потока чтения на сокет')
+    parser.add_argument('--lobby', action='store_true', help='искать соперника через лобби')
+    parser.add_argument('--loss', type=float, default=0.0, help='доля теряемых исходящих датаграмм')
+    parser.add_argument('--json', action='store_true', help='вывести статистику в JSON')
+    args = parser.parse_args()
+
+    stats = run_load(args.players, args.policy, args.seed, args.port,
+                     AsyncNetworking if args.aio else Networking, args.loss, args.lobby)
+
+    if args.json:
+        print(json.dumps(stats))
+        return
+
+    lat = stats['latency_ms']
+    print(f"{stats['players']} players: {stats['games']} games ({stats['finished']} finished), "
+          f"{stats['unpaired']} unpaired, {stats['mismatched']} mismatched, {stats['seconds']:.1f}s")
+    if lat['samples']:
+        print(f"action RTT: p50 {lat['p50']:.2f} ms, p95 {lat['p95']:.2f} ms, p99 {lat['p99']:.2f} ms "
+              f"({lat['samples']} samples)")
+    print(f"loss: {stats['loss']:.2%} seen by receivers ({stats['gaps']} gaps), "
+          f"{stats['injected_loss']:.2%} dropped by --loss ({stats['dropped']} of {stats['datagrams']} datagrams)")
+    print(f"retransmitted: {stats['retransmit_rate']:.2%} ({stats['retransmissions']} of {stats['frames']} frames), "
+          f"{stats['messages_per_sec']:.0f} msg/s, {stats['threads']} extra threads")
+    if stats['cpu_ms_per_game'] is not None:
+        print(f"CPU: {stats['cpu_seconds']:.2f}s total, {stats['cpu_ms_per_game']:.1f} ms/game")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+Нагрузочный тест сетевой игры: N игроков в одном процессе ищут друг друга через
+DiscoveryProtocol и играют через DurakNetGame на localhost, как настоящие клиенты.
+"""
+import random
+import threading
+import time
+
+from ..logic.durak import UpdateAction
+from ..logic.net_game import DurakNetGame
+from ..network.discovery_protocol import DiscoveryProtocol, PeerCache
+from ..network.lobby import LobbyClient
+from ..network.mux import Multiplexer, CONTROL
+from ..network.network import Networking
+from ..sim.policies import POLICIES
+
+PORT_NO = 38020
+
+# сколько ждать соперника, начала партии после того, как он найден, и сколько длится одна партия
+DISCOVERY_TIMEOUT = 10.0
+START_TIMEOUT = 5.0
+GAME_TIMEOUT = 60.0
+
+
+def percentile(values, p):
+    """
+    :param values: отсортированный список
+    :param p: от 0 до 100
+    """
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+class SimulatedPlayer:
+    def __init__(self, pid, ports, policy, rng: random.Random, network_cls=Networking, loss=0.0, lobby=False):
+        """
+        :param ports: порты всех игроков теста; каждый займет свободный
+        :param loss: доля исходящих датаграмм, которые теряются
+        :param lobby: искать соперника через лобби, а не DiscoveryProtocol
+        """
+        self.pid = pid
+        self.lobby = lobby
+        self.policy = policy
+        self.rng = rng
+        self.mux = Multiplexer(ports, network_cls=network_cls, host='127.0.0.1', broadcast_addr='127.0.0.1')
+        if loss:
+            self._make_lossy(loss)
+
+        self.game = None
+        self.peer = None
+        self.finished = False
+        self.actions = 0
+        # исходящие датаграммы и сколько из них выброшено имитацией потерь
+        self.datagrams = 0
+        self.dropped = 0
+
+        # номер пакета хода -> время подтверждения, номера пакетов наших ходов
+        self._acked = {}
+        self._move_frames = []
+        self._updated = threading.Event()
+
+    def _make_lossy(self, loss):
+        send = self.mux.send
+        rng = random.Random(self.pid)
+
+        def lossy_send(sid, data, to):
+            self.datagrams += 1
+            if rng.random() < loss:
+                self.dropped += 1
+                return 0
+            return send(sid, data, to)
+
+        self.mux.send = lossy_send
+
+    def _on_state_updated(self, _):
+        self._updated.set()
+
+    def _act(self):
+        game = self.game
+        with game._lock:
+            g = game.state
+            if g.winner is not None or g.acting_player_index != game.my_index:
+                return False
+            action = self.policy(g, g.legal_actions(game.my_index), self.rng)
+            if action[0] == UpdateAction.ATTACK:
+                game.attack(action[1])
+            elif action[0] == UpdateAction.DEFEND:
+                game.defend(action[2], action[1])
+            else:
+                game.finish_turn()
+            self._move_frames.append(game._channel.last_sent)
+        self.actions += 1
+        return True
+
+    def run(self):
+        if self.lobby:
+            discovery = LobbyClient(self.pid, self.mux.session(CONTROL), rng=self.rng)
+        else:
+            discovery = DiscoveryProtocol(self.pid, net=self.mux.session(CONTROL), peers=PeerCache(), rng=self.rng)
+        addr, self.peer = discovery.run(DISCOVERY_TIMEOUT)
+        if self.peer is None:
+            return
+
+        self.game = DurakNetGame(self.pid, self.peer, addr, mux=self.mux)
+        self.game.on_state_updated = self._on_state_updated
+        self.game._channel.on_ack = lambda seq, latency: self._acked.__setitem__(seq, latency)
+        self.game.start()
+
+        # ходить можно, когда соперник подтвердил наш hello (первый пакет канала)
+        # и пришло состояние от игрока 0 (или мы его отправили). Если соперник выбрал не нас, hello не подтвердится
+        start = time.monotonic() + START_TIMEOUT
+        while not (self._updated.is_set() and 1 in self._acked):
+            if time.monotonic() > start:
+                return
+            time.sleep(0.01)
+        deadline = time.monotonic() + GAME_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.game.state.winner is not None:
+                self.finished = True
+                # даем последним подтверждениям дойти
+                end = time.monotonic() + 1.0
+                while self.game._channel.unacked and time.monotonic() < end:
+                    time.sleep(0.01)
+                return
+            if not self._act():
+                self._updated.wait(0.05)
+                self._updated.clear()
+
+    @property
+    def latencies(self):
+        return [self._acked[seq] for seq in self._move_frames if seq in self._acked]
+
+    def close(self):
+        if self.game is not None:
+            self.game.stop()
+        self.mux.close()
+
+
+def run_load(n_players, policy='random', seed=0, port=PORT_NO, network_cls=Networking, loss=0.0, lobby=False):
+    """
+    Запустить n_players игроков, дождаться конца их партий и собрать статистику
+    :return: словарь со статистикой
+    """
+    ports = list(range(port, port + n_players))
+    players = [SimulatedPlayer(random.Random(f'{seed}:pid:{i}').getrandbits(63) + 1, ports, POLICIES[policy],
+                               random.Random(f'{seed}:{i}'), network_cls, loss, lobby) for i in range(n_players)]
+
+    threads_before = threading.active_count()
+    cpu0, t0 = time.process_time(), time.perf_counter()
+
+    threads = [threading.Thread(target=p.run, daemon=True) for p in players]
+    for t in threads:
+        t.start()
+    threads_peak = threading.active_count()
+    for t in threads:
+        t.join(DISCOVERY_TIMEOUT + GAME_TIMEOUT + 5.0)
+
+    seconds = time.perf_counter() - t0
+    cpu = time.process_time() - cpu0
+
+    by_pid = {p.pid: p for p in players}
+    paired = [p for p in players if p.peer is not None]
+    # пара сложилась, только если соперник тоже выбрал нас
+    mutual = [p for p in paired if by_pid.get(p.peer) is not None and by_pid[p.peer].peer == p.pid]
+    games = len(mutual) // 2
+
+    latencies = sorted(x * 1000 for p in mutual for x in p.latencies)
+    # потери считаем по сложившимся парам: у остальных пакеты не подтверждаются вовсе;
+    # потеря - пропуск в нумерации, который увидел получатель, а не число повторов отправителя
+    channels = [p.game._channel for p in mutual]
+    frames = sum(c.sent for c in channels)
+    retransmissions = sum(c.retransmissions for c in channels)
+    expected = sum(c.expected for c in channels)
+    gaps = sum(c.gaps for c in channels)
+    datagrams = sum(p.datagrams for p in players)
+    dropped = sum(p.dropped for p in players)
+    messages = sum(p.mux.sent + p.mux.received for p in players)
+
+    finished = sum(p.finished for p in mutual) // 2
+
+    for p in players:
+        p.close()
+
+    return {
+        'players': n_players, 'games': games, 'finished': finished,
+        'unpaired': n_players - len(paired), 'mismatched': len(paired) - len(mutual),
+        'actions': sum(p.actions for p in players), 'seconds': seconds,
+        'latency_ms': {'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95),
+                       'p99': percentile(latencies, 99), 'samples': len(latencies)},
+        'frames': frames, 'retransmissions': retransmissions,
+        'retransmit_rate': retransmissions / frames if frames else 0.0,
+        'gaps': gaps, 'loss': gaps / expected if expected else 0.0,
+        'datagrams': datagrams, 'dropped': dropped,
+        'injected_loss': dropped / datagrams if datagrams else 0.0,
+        'messages_per_sec': messages / seconds if seconds else 0.0,
+        'cpu_seconds': cpu, 'cpu_ms_per_game': cpu * 1000 / games if games else None,
+        'threads': threads_peak - threads_before,
+    }
@@ -0,0 +1,325 @@
+"""
+Пакетный движок: K партий в массивах NumPy, один векторный шаг на все партии сразу.
+
+Правила те же, что у Durak: добор по rotate(players, attacker_index),
+козырь - первая не-туз карта колоды после раздачи, коды TurnFinishResult.
+Карты нумеруются как в bitboard: card = value * 4 + suit.
+"""
+import numpy as np
+
+from . import bitboard
+from .durak import CARDS_IN_HAND_MAX, N_PLAYERS, TurnFinishResult
+from .serialization import DurakSerialized
+
+N_CARDS = bitboard.N_CARDS
+FIELD_SLOTS = N_CARDS
+
+NO_CARD = -1
+NO_WINNER = -1
+NO_RESULT = -1
+
+ACTION_NONE = 0
+ACTION_ATTACK = 1
+ACTION_DEFEND = 2
+ACTION_FINISH = 3
+
+_U1 = np.uint64(1)
+_SHIFTS = np.arange(N_CARDS, dtype=np.uint64)
+
+BIT = _U1 << _SHIFTS
+RANK_MASK = np.array(bitboard.RANK_MASK, dtype=np.uint64)
+BEATERS = np.array(bitboard.BEATERS, dtype=np.uint64)
+BEATEN_BY = np.array(bitboard.BEATEN_BY, dtype=np.uint64)
+SUIT_OF = np.array(bitboard.SUIT_OF, dtype=np.int8)
+VALUE_OF = np.array(bitboard.VALUE_OF, dtype=np.int8)
+
+_NIBBLE_LOW = np.uint64(bitboard._NIBBLE_LOW)
+
+
+def bits(masks):
+    """
+    Маски (...,) -> булев массив (..., 36)
+    """
+    return ((masks[..., None] >> _SHIFTS) & _U1).astype(bool)
+
+
+def popcount(masks):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(masks).astype(np.int64)
+    return bits(masks).sum(axis=-1)
+
+
+def ranks_mask(masks):
+    """
+    Векторный bitboard.ranks_mask
+    """
+    m = masks | (masks >> np.uint64(1)) | (masks >> np.uint64(2)) | (masks >> np.uint64(3))
+    return (m & _NIBBLE_LOW) * np.uint64(0xF)
+
+
+def random_bit(candidates, rng: np.random.Generator):
+    """
+    Случайная карта из каждой строки булевого массива (K, 36), NO_CARD для пустых строк
+    """
+    keys = rng.random(candidates.shape)
+    keys[~candidates] = -1.0
+    choice = keys.argmax(axis=1).astype(np.int8)
+    choice[~candidates.any(axis=1)] = NO_CARD
+    return choice
+
+
+class BatchDurak:
+    def __init__(self, n_games, rng: np.random.Generator = None, decks=None):
+        self.n_games = n_games
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.reset(decks)
+
+    def reset(self, decks=None):
+        """
+        Начать все партии заново
+        :param decks: перетасованные колоды (K, 36) до раздачи; по умолчанию тасуются self.rng
+        """
+        k = self.n_games
+        if decks is None:
+            decks = self.rng.permuted(np.tile(np.arange(N_CARDS, dtype=np.int8), (k, 1)), axis=1)
+        deck = np.array(decks, dtype=np.int8)
+        rows = np.arange(k)
+        self._rows = rows
+
+        self.hands = np.zeros((k, N_PLAYERS), dtype=np.uint64)
+        dealt = CARDS_IN_HAND_MAX * N_PLAYERS
+        for p in range(N_PLAYERS):
+            own = deck[:, p * CARDS_IN_HAND_MAX:(p + 1) * CARDS_IN_HAND_MAX]
+            self.hands[:, p] = np.bitwise_or.reduce(BIT[own], axis=1)
+
+        # козырь - первая не-туз карта остатка колоды, она перекладывается в конец
+        rest = deck[:, dealt:]
+        trump_pos = (VALUE_OF[rest] != bitboard.ACE_VALUE).argmax(axis=1)
+        self.trump = rest[rows, trump_pos]
+        self.trump_suit = SUIT_OF[self.trump]
+
+        after = np.arange(N_CARDS - dealt)[None, :] >= trump_pos[:, None]
+        shifted = np.where(after[:, :-1], rest[:, 1:], rest[:, :-1])
+        deck[:, dealt:-1] = shifted
+        deck[:, -1] = self.trump
+        self.deck = deck
+        self.deck_pos = np.full(k, dealt, dtype=np.int8)
+
+        self.attacker = np.zeros(k, dtype=np.int8)
+        self.winner = np.full(k, NO_WINNER, dtype=np.int8)
+
+        self.field_att = np.full((k, FIELD_SLOTS), NO_CARD, dtype=np.int8)
+        self.field_def = np.full((k, FIELD_SLOTS), NO_CARD, dtype=np.int8)
+        self.field_n = np.zeros(k, dtype=np.int8)
+        self.field_mask = np.zeros(k, dtype=np.uint64)
+        self.unbeaten_mask = np.zeros(k, dtype=np.uint64)
+
+    @property
+    def defender(self):
+        return (self.attacker + 1) % N_PLAYERS
+
+    @property
+    def deck_len(self):
+        return N_CARDS - self.deck_pos
+
+    @property
+    def active(self):
+        return self.winner == NO_WINNER
+
+    def attacker_hands(self):
+        return self.hands[self._rows, self.attacker]
+
+    def defender_hands(self):
+        return self.hands[self._rows, self.defender]
+
+    def acting_player(self):
+        return np.where(self.unbeaten_mask != 0, self.defender, self.attacker)
+
+    def attack_masks(self):
+        """
+        Маски карт, которыми атакующий может сейчас походить
+        """
+        allowed = np.where(self.field_mask == 0, ~np.uint64(0), ranks_mask(self.field_mask))
+        masks = self.attacker_hands() & allowed
+        masks[(self.defender_hands() == 0) | ~self.active] = 0
+        return masks
+
+    def beaters(self, cards):
+        """
+        Маски карт, которыми можно побить cards (по козырю каждой партии)
+        """
+        return BEATERS[self.trump_suit, cards.clip(0)]
+
+    def step(self, kind, card, target=None):
+        """
+        Один ход во всех партиях сразу
+        :param kind: ACTION_* для каждой партии
+        :param card: карта атаки или защиты
+        :param target: для защиты - какую карту бьем
+        :return: (успех хода, код TurnFinishResult или NO_RESULT)
+        """
+        kind = np.asarray(kind)
+        card = np.asarray(card, dtype=np.int8)
+        target = np.full(self.n_games, NO_CARD, dtype=np.int8) if target is None else np.asarray(target, np.int8)
+
+        ok = np.zeros(self.n_games, dtype=bool)
+        result = np.full(self.n_games, NO_RESULT, dtype=np.int8)
+        active = self.active
+
+        att = np.flatnonzero(active & (kind == ACTION_ATTACK))
+        if att.size:
+            ok[att] = self._attack(att, card[att])
+
+        dfn = np.flatnonzero(active & (kind == ACTION_DEFEND))
+        if dfn.size:
+            ok[dfn] = self._defend(dfn, target[dfn], card[dfn])
+
+        fin = np.flatnonzero(active & (kind == ACTION_FINISH))
+        if fin.size:
+            ok[fin] = True
+            result[fin] = self._finish_turn(fin)
+
+        return ok, result
+
+    def _attack(self, rows, cards):
+        bit = BIT[cards.clip(0)]
+        attacker = self.attacker[rows]
+        hand = self.hands[rows, attacker]
+        field = self.field_mask[rows]
+        valid = ((cards >= 0) & (hand & bit != 0) & (self.hands[rows, 1 - attacker] != 0) &
+                 ((field == 0) | (RANK_MASK[cards.clip(0)] & field != 0)))
+
+        r, b = rows[valid], bit[valid]
+        self.hands[r, attacker[valid]] ^= b
+        self.field_att[r, self.field_n[r]] = cards[valid]
+        self.field_n[r] += 1
+        self.field_mask[r] |= b
+        self.unbeaten_mask[r] |= b
+        return valid
+
+    def _defend(self, rows, targets, cards):
+        bit = BIT[cards.clip(0)]
+        defender = (self.attacker[rows] + 1) % N_PLAYERS
+        valid = ((cards >= 0) & (targets >= 0) &
+                 (self.unbeaten_mask[rows] & BIT[targets.clip(0)] != 0) &
+                 (self.hands[rows, defender] & bit != 0) &
+                 (BEATERS[self.trump_suit[rows], targets.clip(0)] & bit != 0))
+
+        r, b = rows[valid], bit[valid]
+        slot = (self.field_att[r] == targets[valid][:, None]).argmax(axis=1)
+        self.field_def[r, slot] = cards[valid]
+        self.hands[r, defender[valid]] ^= b
+        self.field_mask[r] |= b
+        self.unbeaten_mask[r] ^= BIT[targets[valid]]
+        return valid
+
+    def _draw(self, rows, players):
+        """
+        Добор до CARDS_IN_HAND_MAX из колоды для игроков players в партиях rows
+        """
+        lack = np.maximum(0, CARDS_IN_HAND_MAX - popcount(self.hands[rows, players]))
+        n = np.minimum(N_CARDS - self.deck_pos[rows], lack)
+        for i in range(CARDS_IN_HAND_MAX):
+            take = n > i
+            if not take.any():
+                break
+            r, p = rows[take], players[take]
+            self.hands[r, p] |= BIT[self.deck[r, self.deck_pos[r]]]
+            self.deck_pos[r] += 1
+
+    def _finish_turn(self, rows):
+        attacker = self.attacker[rows]
+        defender = (attacker + 1) % N_PLAYERS
+
+        took = self.unbeaten_mask[rows] != 0
+        t = rows[took]
+        self.hands[t, defender[took]] |= self.field_mask[t]
+
+        self.field_att[rows] = NO_CARD
+        self.field_def[rows] = NO_CARD
+        self.field_n[rows] = 0
+        self.field_mask[rows] = 0
+        self.unbeaten_mask[rows] = 0
+
+        for shift in range(N_PLAYERS):
+            self._draw(rows, (attacker + shift) % N_PLAYERS)
+
+        result = np.where(took, TurnFinishResult.TOOK_CARDS.value, TurnFinishResult.NORMAL_TURN.value).astype(np.int8)
+
+        empty = self.hands[rows] == 0
+        over = (self.deck_pos[rows] == N_CARDS) & empty.any(axis=1)
+        self.winner[rows[over]] = empty[over].argmax(axis=1)
+        result[over] = TurnFinishResult.GAME_OVER.value
+
+        normal = ~over & ~took
+        self.attacker[rows[normal]] = defender[normal]
+        return result
+
+    def random_actions(self, rng: np.random.Generator = None):
+        """
+        Случайный допустимый ход в каждой партии (для массовых прогонов)
+        :return: (kind, card, target) для step()
+        """
+        rng = rng if rng is not None else self.rng
+        k = self.n_games
+        kind = np.full(k, ACTION_NONE, dtype=np.int8)
+        card = np.full(k, NO_CARD, dtype=np.int8)
+        target = np.full(k, NO_CARD, dtype=np.int8)
+        active = self.active
+        defending = active & (self.unbeaten_mask != 0)
+        attacking = active & ~defending
+
+        # защита: случайная небитая карта и случайная карта, которой ее можно побить; иначе - взять
+        t = random_bit(bits(self.unbeaten_mask), rng)
+        options = bits(self.beaters(t) & self.defender_hands())
+        d = random_bit(options, rng)
+        n_options = popcount(self.beaters(t) & self.defender_hands())
+        take = (d == NO_CARD) | (rng.random(k) * (n_options + 1) < 1)
+        kind[defending & take] = ACTION_FINISH
+        beat = defending & ~take
+        kind[beat] = ACTION_DEFEND
+        card[beat] = d[beat]
+        target[beat] = t[beat]
+
+        # атака: случайная допустимая карта или "бито", если на столе уже что-то есть
+        options = bits(self.attack_masks())
+        a = random_bit(options, rng)
+        n_options = popcount(self.attack_masks())
+        can_finish = self.field_mask != 0
+        finish = can_finish & ((a == NO_CARD) | (rng.random(k) * (n_options + 1) < 1))
+        kind[attacking & finish] = ACTION_FINISH
+        play = attacking & ~finish & (a != NO_CARD)
+        kind[play] = ACTION_ATTACK
+        card[play] = a[play]
+
+        return kind, card, target
+
+    def run_random(self, max_steps=2000):
+        """
+        Доиграть все партии случайными ходами
+        :return: число сделанных шагов
+        """
+        for n in range(max_steps):
+            if not self.active.any():
+                return n
+            self.step(*self.random_actions())
+        return max_steps
+
+    def serialized(self, i):
+        """
+        Партия i в формате DurakSerialized.serialized()
+        """
+        pos = int(self.deck_pos[i])
+        field = [(bitboard.INT_TO_CARD[a], bitboard.INT_TO_CARD[d] if d != NO_CARD else None)
+                 for a, d in zip(self.field_att[i, :self.field_n[i]], self.field_def[i, :self.field_n[i]])]
+        winner = int(self.winner[i])
+        return {"trump": bitboard.INT_TO_CARD[self.trump[i]], "attacker_index": int(self.attacker[i]),
+                "deck": [bitboard.INT_TO_CARD[c] for c in self.deck[i, pos:]],
+                "winner": winner if winner != NO_WINNER else None,
+                "field": field,
+                "players": [{"index": p, "cards": bitboard.cards_of(int(self.hands[i, p]))}
+                            for p in range(N_PLAYERS)],
+                "last_update": {}}
+
+    def to_durak(self, i) -> DurakSerialized:
+        return DurakSerialized(self.serialized(i))
@@ -0,0 +1,349 @@
+"""
+Альтернативное ядро движка: карта - число 0..35, рука и стол - 36-битные маски.
+
+Номер карты совпадает с её позицией в DECK: card = value * 4 + suit,
+где value - индекс в NOMINALS, а suit - индекс в SUITS.
+
+Это отдельное ядро: симуляции (sim), бот и ISMCTS работают на Durak, а BitDurak
+используют тесты и logic.batch (его таблицы). legal_actions/apply/undo у BitDurak нет,
+так что подставить его в разыгрывание партий нельзя. Сравнение с Durak - замеры bitboard_*
+в python -m src.bench: can_beat примерно вдвое быстрее, а possible_to_beat медленнее,
+потому что Durak держит его готовым между ходами.
+"""
+import random
+
+from .durak import (DECK, CARD_INDEX, SUITS, NOMINALS, ACE, CARDS_IN_HAND_MAX, N_PLAYERS,
+                    TurnFinishResult, UpdateAction, rotate)
+from .serialization import DurakSerialized
+
+N_CARDS = len(DECK)
+N_SUITS = len(SUITS)
+N_NOMINALS = len(NOMINALS)
+
+ALL_CARDS = (1 << N_CARDS) - 1
+
+CARD_TO_INT = CARD_INDEX
+INT_TO_CARD = list(DECK)
+
+BIT = [1 << i for i in range(N_CARDS)]
+
+SUIT_OF = [i % N_SUITS for i in range(N_CARDS)]
+VALUE_OF = [i // N_SUITS for i in range(N_CARDS)]
+
+ACE_VALUE = NOMINALS.index(ACE)
+
+SUIT_MASK = [sum(BIT[v * N_SUITS + s] for v in range(N_NOMINALS)) for s in range(N_SUITS)]
+NOMINAL_MASK = [sum(BIT[v * N_SUITS + s] for s in range(N_SUITS)) for v in range(N_NOMINALS)]
+
+# маска всех карт того же достоинства, что и данная карта
+RANK_MASK = [NOMINAL_MASK[VALUE_OF[c]] for c in range(N_CARDS)]
+
+# младший бит каждой тетрады
+_NIBBLE_LOW = sum(1 << (v * N_SUITS) for v in range(N_NOMINALS))
+
+
+def _beats(trump_suit, att, dfn):
+    if SUIT_OF[dfn] == trump_suit:
+        return SUIT_OF[att] != trump_suit or VALUE_OF[dfn] > VALUE_OF[att]
+    elif SUIT_OF[att] == SUIT_OF[dfn]:
+        return VALUE_OF[dfn] > VALUE_OF[att]
+    return False
+
+
+# BEATERS[trump_suit][att] - маска карт, которыми можно побить att
+BEATERS = [[sum(BIT[d] for d in range(N_CARDS) if _beats(t, a, d)) for a in range(N_CARDS)]
+           for t in range(N_SUITS)]
+
+# BEATEN_BY[trump_suit][dfn] - маска карт, которые бьет dfn
+BEATEN_BY = [[sum(BIT[a] for a in range(N_CARDS) if _beats(t, a, d)) for d in range(N_CARDS)]
+             for t in range(N_SUITS)]
+
+# порядок карт в руке как в Player.sort_hand: по достоинству, затем по символу масти
+_SUIT_ORDER = sorted(range(N_SUITS), key=lambda s: SUITS[s])
+_NIBBLE_SUITS = [[s for s in _SUIT_ORDER if n >> s & 1] for n in range(1 << N_SUITS)]
+HAND_ORDER = [v * N_SUITS + s for v in range(N_NOMINALS) for s in _SUIT_ORDER]
+
+
+def card_to_int(card):
+    return CARD_TO_INT[tuple(card)]
+
+
+def int_to_card(i):
+    return INT_TO_CARD[i]
+
+
+def mask_of(cards):
+    """
+    Маска из списка карт в виде кортежей
+    """
+    m = 0
+    for card in cards:
+        m |= BIT[CARD_TO_INT[tuple(card)]]
+    return m
+
+
+def ints_of(mask):
+    """
+    Номера карт маски в порядке сортировки руки
+    """
+    result = []
+    v = 0
+    while mask:
+        nibble = mask & 0xF
+        if nibble:
+            base = v * N_SUITS
+            result += [base + s for s in _NIBBLE_SUITS[nibble]]
+        mask >>= N_SUITS
+        v += 1
+    return result
+
+
+def cards_of(mask):
+    """
+    Карты маски в виде кортежей, отсортированные как Player.sort_hand
+    """
+    return [INT_TO_CARD[i] for i in ints_of(mask)]
+
+
+def popcount(mask):
+    return bin(mask).count('1')
+
+
+def ranks_mask(mask):
+    """
+    Маска всех карт тех достоинств, что встречаются в mask
+    """
+    m = mask | mask >> 1 | mask >> 2 | mask >> 3
+    return (m & _NIBBLE_LOW) * 0xF
+
+
+def can_beat(trump_suit, att, dfn):
+    """
+    Бьет ли dfn карту att при козырной масти trump_suit
+    """
+    return BEATERS[trump_suit][att] >> dfn & 1 == 1
+
+
+class BitDurak:
+    """
+    Тот же Durak, но на масках. Поле field: {атакующая карта: отбивающая карта или None}
+    """
+
+    def __init__(self, rng: random.Random = None, deck=None):
+        self.attacker_index = 0
+
+        self.rng = rng or random.Random()
+
+        self.deck = [card_to_int(c) for c in deck] if deck is not None else list(range(N_CARDS))
+        self.rng.shuffle(self.deck)
+
+        self.hands = [0] * N_PLAYERS
+        for i in range(N_PLAYERS):
+            self._take_cards_from_deck(i)
+
+        self.trump = next(c for c in self.deck if VALUE_OF[c] != ACE_VALUE)
+        self.trump_suit = SUIT_OF[self.trump]
+
+        self.deck.remove(self.trump)
+        self.deck.append(self.trump)
+
+        self.winner = None
+        self.last_update = {}
+
+        self._clear_field()
+
+    def _clear_field(self):
+        self.field = {}
+        self.field_mask = 0
+        self.unbeaten_mask = 0
+
+    def _take_cards_from_deck(self, index):
+        hand = self.hands[index]
+        lack = max(0, CARDS_IN_HAND_MAX - popcount(hand))
+        n = min(len(self.deck), lack)
+        new_cards = self.deck[:n]
+        for c in new_cards:
+            hand |= BIT[c]
+        self.hands[index] = hand
+        del self.deck[:n]
+        return new_cards
+
+    @property
+    def defender_index(self):
+        return (self.attacker_index + 1) % N_PLAYERS
+
+    def can_beat(self, att, dfn):
+        """
+        Бьет ли dfn карту att
+        """
+        return BEATERS[self.trump_suit][att] >> dfn & 1 == 1
+
+    def can_add_to_field(self, card):
+        if not self.hands[self.defender_index]:
+            return False
+        return not self.field_mask or bool(RANK_MASK[card] & self.field_mask)
+
+    def attack_mask(self):
+        """
+        Маска карт, которыми атакующий может сейчас походить
+        """
+        hand = self.hands[self.attacker_index]
+        if not self.hands[self.defender_index]:
+            return 0
+        if not self.field_mask:
+            return hand
+        return hand & ranks_mask(self.field_mask)
+
+    def defend_variants(self, card):
+        """
+        Маска небитых карт, которые можно побить картой card
+        """
+        return BEATEN_BY[self.trump_suit][card] & self.unbeaten_mask
+
+    @property
+    def possible_to_beat(self):
+        hand = self.hands[self.defender_index]
+        beaters = BEATERS[self.trump_suit]
+        m = self.unbeaten_mask
+        while m:
+            low = m & -m
+            if not beaters[low.bit_length() - 1] & hand:
+                return False
+            m ^= low
+        return True
+
+    @property
+    def any_unbeaten_cards(self):
+        return popcount(self.unbeaten_mask)
+
+    def attack(self, card):
+        if self.winner:
+            return False
+
+        bit = BIT[card]
+        if not self.hands[self.attacker_index] & bit:
+            return False
+
+        if not self.can_add_to_field(card):
+            return False
+
+        self.hands[self.attacker_index] ^= bit
+        self.field[card] = None
+        self.field_mask |= bit
+        self.unbeaten_mask |= bit
+
+        self.last_update = {'action': UpdateAction.ATTACK, 'card': card, 'player': self.attacker_index}
+
+        return True
+
+    def defend(self, attacking_card, defending_card):
+        assert not self.winner
+
+        if not self.unbeaten_mask & BIT[attacking_card]:
+            return False
+        if not self.hands[self.defender_index] & BIT[defending_card]:
+            return False
+        if self.can_beat(attacking_card, defending_card):
+            self.field[attacking_card] = defending_card
+
+            bit = BIT[defending_card]
+            self.hands[self.defender_index] ^= bit
+            self.field_mask |= bit
+            self.unbeaten_mask ^= BIT[attacking_card]
+
+            self.last_update = {'action': UpdateAction.DEFEND, 'defending_card': defending_card,
+                                'attacking_card': attacking_card, 'player': self.defender_index}
+
+            return True
+        return False
+
+    def finish_turn(self) -> TurnFinishResult:
+        assert not self.winner
+
+        self.last_update = {'action': UpdateAction.FINISH_TURN}
+
+        took_cards = False
+        if self.unbeaten_mask:
+            cards = list(self.field) + [c for c in self.field.values() if c is not None]
+            self.hands[self.defender_index] |= self.field_mask
+            self.last_update['take_cards'] = {'cards': cards, 'player': self.defender_index}
+            took_cards = True
+        else:
+            self.last_update['clear_field'] = True
+        self._clear_field()
+
+        take_cards = []
+        for i in rotate(list(range(N_PLAYERS)), self.attacker_index):
+            take_cards += [(i, c) for c in self._take_cards_from_deck(i)]
+        self.last_update['from_deck'] = take_cards
+
+        if not self.deck:
+            for i in range(N_PLAYERS):
+                if not self.hands[i]:
+                    self.winner = i
+                    self.last_update['winner'] = self.winner
+                    return TurnFinishResult.GAME_OVER
+
+        if took_cards:
+            return TurnFinishResult.TOOK_CARDS
+        else:
+            self.attacker_index = self.defender_index
+            self.last_update['turn_change'] = self.attacker_index
+            return TurnFinishResult.NORMAL_TURN
+
+    @classmethod
+    def from_durak(cls, game):
+        """
+        Построить BitDurak из обычного Durak (или DurakSerialized)
+        """
+        self = cls.__new__(cls)
+        self.rng = getattr(game, 'rng', None) or random.Random()
+        self.attacker_index = game.attacker_index
+        self.winner = game.winner
+        self.trump = card_to_int(game.trump)
+        self.trump_suit = SUIT_OF[self.trump]
+        self.deck = [card_to_int(c) for c in game.deck]
+        self.hands = [mask_of(p.cards) for p in game.players]
+        self._clear_field()
+        for att, dfn in game.field.items():
+            a = card_to_int(att)
+            self.field_mask |= BIT[a]
+            if dfn is None:
+                self.field[a] = None
+                self.unbeaten_mask |= BIT[a]
+            else:
+                d = card_to_int(dfn)
+                self.field[a] = d
+                self.field_mask |= BIT[d]
+        self.last_update = _convert_update(game.last_update, card_to_int)
+        return self
+
+    def serialized(self):
+        """
+        Состояние в формате DurakSerialized.serialized()
+        """
+        return {"trump": INT_TO_CARD[self.trump], "attacker_index": self.attacker_index,
+                "deck": [INT_TO_CARD[c] for c in self.deck], "winner": self.winner,
+                "field": [(INT_TO_CARD[a], INT_TO_CARD[d] if d is not None else None)
+                          for a, d in self.field.items()],
+                "players": [{"index": i, "cards": cards_of(hand)} for i, hand in enumerate(self.hands)],
+                "last_update": _convert_update(self.last_update, int_to_card)}
+
+    def to_durak(self) -> DurakSerialized:
+        return DurakSerialized(self.serialized())
+
+
+def _convert_update(update, convert):
+    """
+    Перевести карты в last_update из одного представления в другое
+    """
+    result = dict(update)
+    for key in ('card', 'defending_card', 'attacking_card'):
+        if key in result:
+            result[key] = convert(result[key])
+    if 'take_cards' in result:
+        take = result['take_cards']
+        result['take_cards'] = {'cards': [convert(c) for c in take['cards']], 'player': take['player']}
+    if 'from_deck' in result:
+        result['from_deck'] = [(i, convert(c)) for i, c in result['from_deck']]
+    return result
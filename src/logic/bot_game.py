@@ -0,0 +1,83 @@
+import random
+import threading
+
+from .durak import UpdateAction
+from .game import DurakGame
+from .ismcts import ISMCTS
+from .serialization import DurakSerialized
+
+
+class DurakBotGame(DurakGame):
+    """
+    Игра против компьютера. Бот думает в своем потоке, главный поток Kivy не блокируется
+    """
+
+    def __init__(self, my_index=0, budget_ms=150, rng: random.Random = None):
+        super().__init__(my_index)
+
+        self.search = ISMCTS(budget_ms, rng)
+
+        self._wake = threading.Event()
+        self._version = 0
+        self._running = False
+
+        # карты, которые бот видел уходящими в руку игрока
+        self._seen_my_cards = set()
+
+    def _state_changed(self, action=None):
+        with self._lock:
+            self._version += 1
+            up = self.state.last_update
+            if up.get('action') == UpdateAction.FINISH_TURN:
+                if self.is_me(up.get('take_cards', {}).get('player')):
+                    self._seen_my_cards.update(map(tuple, up['take_cards']['cards']))
+                if not self.state.deck:
+                    self._seen_my_cards.update(tuple(c) for i, c in up['from_deck']
+                                               if self.is_me(i) and tuple(c) == tuple(self.state.trump))
+            self._notify()
+        self._wake.set()
+
+    def _bot_should_act(self):
+        g = self.state
+        return self._running and g.winner is None and g.acting_player_index == self._opp_index
+
+    def _bot_loop(self):
+        while self._running:
+            self._wake.wait()
+            self._wake.clear()
+
+            while True:
+                with self._lock:
+                    if not self._bot_should_act():
+                        break
+                    version = self._version
+                    snapshot = DurakSerialized(self.state.serialized())
+                    known = set(self._seen_my_cards)
+
+                action = self.search.search(snapshot, self._opp_index, known)
+
+                with self._lock:
+                    if version != self._version or not self._bot_should_act():
+                        continue
+                    if action is None or not self.state.apply(action):
+                        break
+                    # ход бота и уведомление о нем - под одной блокировкой, иначе между ними
+                    # успеет вклиниться ход игрока
+                    self._state_changed(action)
+
+    def _new_game(self):
+        with self._lock:
+            self.state = DurakSerialized()
+            self._seen_my_cards = set()
+            self._version += 1
+            self._notify()
+        self._wake.set()
+
+    def start(self):
+        self._running = True
+        threading.Thread(target=self._bot_loop, daemon=True).start()
+        self._new_game()
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
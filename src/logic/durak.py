@@ -1,7 +1,11 @@
+import bisect
 import random
 
 from enum import Enum
 
+from .. import metrics
+from .zobrist import ZobristKeys
+
 SPADES = '♠'
 HEARTS = '♥'
 DIAMS = '♦'
@@ -21,11 +25,35 @@ N_PLAYERS = 2
 DECK = [(nom, suit) for nom in NOMINALS for suit in SUITS]
 DECK_SHORT = [(nom, suit) for nom in NOMINALS_SHORT for suit in SUITS]
 
+CARD_INDEX = {card: i for i, card in enumerate(DECK)}
+
+# ключ сортировки карты в руке: по достоинству, при равном - по символу масти
+HAND_KEY = {card: NAME_TO_VALUE[card[0]] * len(SUITS) + sorted(SUITS).index(card[1]) for card in DECK}
+
+ZOBRIST = ZobristKeys(N_PLAYERS, len(DECK))
+
 
 class Player:
+    """
+    Рука игрока. cards всегда отсортированы по достоинству и масти, как их показывает раскладка,
+    а для каждой масти отдельно хранятся ее карты по возрастанию: младшая карта масти
+    старше заданной и младший козырь находятся двоичным поиском.
+    Индекс по мастям строится при первом запросе после пачки новых карт и дальше обновляется по месту
+    """
+
     def __init__(self, index, cards):
         self.index = index
-        self.cards = list(map(tuple, cards))
+        self._cards = sorted(map(tuple, cards), key=HAND_KEY.__getitem__)
+        self._by_suit = None
+
+    @property
+    def cards(self):
+        return self._cards
+
+    @cards.setter
+    def cards(self, cards):
+        self._cards = list(cards)
+        self.sort_hand()
 
     def take_cards_from_deck(self, deck: list):
         """
@@ -42,21 +70,84 @@ class Player:
 
     def sort_hand(self):
         """
-        Сортирует карты по достоинству и масти
+        Сортирует карты по достоинству и масти.
+        Снаружи нужно только если cards меняли по месту
         """
-        self.cards.sort(key=lambda c: (NAME_TO_VALUE[c[0]], c[1]))
+        self._cards.sort(key=HAND_KEY.__getitem__)
+        self._by_suit = None
         return self
 
+    def _suits(self):
+        if self._by_suit is None:
+            self._by_suit = {suit: [] for suit in SUITS}
+            for card in self._cards:
+                self._by_suit[card[1]].append(card)
+        return self._by_suit
+
+    def add_card(self, card):
+        """
+        Вставить карту на ее место в отсортированной руке
+        :return: позиция карты
+        """
+        key = HAND_KEY.__getitem__
+        i = bisect.bisect(self._cards, key(card), key=key)
+        self._cards.insert(i, card)
+        if self._by_suit is not None:
+            bisect.insort(self._by_suit[card[1]], card, key=key)
+        return i
+
     def add_cards(self, cards):
-        self.cards += list(cards)
-        self.sort_hand()
+        # пачку (например, весь стол) быстрее досортировать целиком, чем вставлять по одной
+        if cards:
+            self._cards += cards
+            self.sort_hand()
         return self
 
     def __repr__(self):
         return f"Player{self.cards!r}"
 
     def take_card(self, card):
-        self.cards.remove(card)
+        """
+        Убрать карту из руки
+        :return: позиция, на которой она была
+        """
+        key = HAND_KEY.__getitem__
+        i = bisect.bisect_left(self._cards, key(card), key=key)
+        if i == len(self._cards) or self._cards[i] != card:
+            raise ValueError(f'{card!r} is not in hand')
+        del self._cards[i]
+        if self._by_suit is not None:
+            self._by_suit[card[1]].remove(card)
+        return i
+
+    def remove_cards(self, cards):
+        for card in cards:
+            self.take_card(card)
+
+    def lowest(self, suit, above=None):
+        """
+        Младшая карта масти suit старше достоинства above (по умолчанию любая)
+        :return: карта или None
+        """
+        cards = self._suits()[suit]
+        i = 0 if above is None else bisect.bisect(cards, HAND_KEY[above, suit], key=HAND_KEY.__getitem__)
+        return cards[i] if i < len(cards) else None
+
+    def lowest_trump(self, trump_suit):
+        return self.lowest(trump_suit)
+
+    def beating(self, card, trump_suit):
+        """
+        Карты руки, которые бьют card, в порядке руки
+        """
+        suit = card[1]
+        suits = self._suits()
+        cards = suits[suit]
+        cards = cards[bisect.bisect(cards, HAND_KEY[card], key=HAND_KEY.__getitem__):]
+        if suit != trump_suit and suits[trump_suit]:
+            cards += suits[trump_suit]
+            cards.sort(key=HAND_KEY.__getitem__)
+        return cards
 
     @property
     def n_cards(self):
@@ -113,6 +204,36 @@ class Durak:
 
         self.last_update = {}
 
+        self._init_derived()
+
+    def _init_derived(self):
+        """
+        Пересчитать все, что выводится из состояния: журнал отмены, индексы ходов, хэш
+        """
+        self.journal = []
+        self._rebuild_legal_actions()
+        self.state_hash = self.compute_hash()
+
+    def compute_hash(self):
+        """
+        Хэш Zobrist состояния с нуля. Durak.state_hash поддерживается по месту и всегда равен ему
+        """
+        h = ZOBRIST.trump[CARD_INDEX[self.trump]] ^ ZOBRIST.attacker[self.attacker_index]
+        for p in self.players:
+            for c in p.cards:
+                h ^= ZOBRIST.hand[p.index][CARD_INDEX[c]]
+        for att, dfn in self.field.items():
+            h ^= ZOBRIST.field_attack[CARD_INDEX[att]]
+            if dfn is not None:
+                h ^= ZOBRIST.field_defend[CARD_INDEX[att]][CARD_INDEX[dfn]]
+        n = len(self.deck)
+        h ^= ZOBRIST.deck_size[n]
+        for i, c in enumerate(self.deck):
+            h ^= ZOBRIST.deck[n - 1 - i][CARD_INDEX[c]]
+        if self.winner is not None:
+            h ^= ZOBRIST.winner[self.winner]
+        return h
+
     def card_match(self, card1, card2):
         if card1 is None or card2 is None:
             return False
@@ -150,40 +271,35 @@ class Durak:
         if not self.field:
             return True
 
-        for attack_card, defend_card in self.field.items():
-            if self.card_match(attack_card, card) or self.card_match(defend_card, card):
-                return True
-
-        return False
+        return card[0] in self._field_nominals
 
     @property
     def possible_to_beat(self):
         """
         Проверяет можно ли вообще обить что-то в такой ситуации
         """
-        for unbeaten_card in self.unbeaten_cards:
-            can_beat = any(self.can_beat(my_card, unbeaten_card) for my_card in self.defending_player.cards)
-            if not can_beat:
-                return False
-        return True
+        # для каждой небитой карты _defend_moves уже хранит, чем ее можно побить
+        return all(self._defend_moves.values())
+
+    # списки ниже поддерживаются по месту и не копируются: менять их нельзя
 
     @property
     def attacking_cards(self):
         """
         Список атакующих карт
         """
-        return list(filter(bool, self.field.keys()))
+        return self._attacking
 
     @property
     def defending_cards(self):
         """
-        Список отбивающих карт (фильртруем None)
+        Список отбивающих карт в порядке атакующих, которые они бьют
         """
-        return list(filter(bool, self.field.values()))
+        return self._defending
 
     @property
     def unbeaten_cards(self):
-        return [c for c in self.field.keys() if self.field[c] is None]
+        return self._unbeaten
 
     @property
     def attacking_player(self):
@@ -193,6 +309,15 @@ class Durak:
     def defending_player(self):
         return self.players[(self.attacker_index + 1) % N_PLAYERS]
 
+    @property
+    def acting_player_index(self):
+        """
+        Кто должен ходить: защищающийся, пока есть небитые карты, иначе атакующий
+        """
+        if self.any_unbeaten_cards:
+            return self.defending_player.index
+        return self.attacker_index
+
     def defend_variants(self, card):
         """
         Варианты, какие карты можно побить
@@ -201,19 +326,93 @@ class Durak:
         """
         return [att_card for att_card in self.unbeaten_cards if self.can_beat(att_card, card)]
 
+    def _rebuild_legal_actions(self):
+        """
+        Полностью пересчитывает индексы стола и допустимых ходов.
+        Вызывается при создании состояния и в конце хода, в остальное время индексы обновляются по месту.
+        """
+        self._field_nominals = {c[0] for pair in self.field.items() for c in pair if c is not None}
+        self._attacking = list(self.field)
+        self._defending = [c for c in self.field.values() if c is not None]
+        self._unbeaten = [c for c, dfn in self.field.items() if dfn is None]
+
+        attacker_cards = self.attacking_player.cards
+        if self.field:
+            self._attack_moves = {c: None for c in attacker_cards if c[0] in self._field_nominals}
+        else:
+            self._attack_moves = dict.fromkeys(attacker_cards)
+
+        defender = self.defending_player
+        self._defend_moves = {att: defender.beating(att, self.trump_suit) for att in self.unbeaten_cards}
+
+    def _add_field_nominal(self, nominal):
+        if nominal not in self._field_nominals:
+            self._field_nominals.add(nominal)
+            for c in self.attacking_player.cards:
+                if c[0] == nominal:
+                    self._attack_moves[c] = None
+
+    def legal_actions(self, player_index=None):
+        """
+        Список допустимых ходов:
+        (UpdateAction.ATTACK, карта), (UpdateAction.DEFEND, атакующая карта, отбивающая карта)
+        и (UpdateAction.FINISH_TURN,) - "бито" для атакующего или "взять" для защищающегося
+        :param player_index: если указан, только ходы этого игрока
+        """
+        if self.winner is not None:
+            return []
+
+        actions = []
+        attacker = player_index is None or player_index == self.attacker_index
+        defender = player_index is None or player_index != self.attacker_index
+
+        if attacker and self.defending_player.cards:
+            actions += [(UpdateAction.ATTACK, c) for c in self._attack_moves]
+        if defender:
+            actions += [(UpdateAction.DEFEND, att, c) for att, cards in self._defend_moves.items() for c in cards]
+
+        if self.field:
+            unbeaten = bool(self._defend_moves)
+            if player_index is None or defender == unbeaten:
+                actions.append((UpdateAction.FINISH_TURN,))
+
+        return actions
+
+    def apply(self, action):
+        """
+        Выполнить ход в формате legal_actions()
+        """
+        kind = action[0]
+        if kind == UpdateAction.ATTACK:
+            return self.attack(action[1])
+        elif kind == UpdateAction.DEFEND:
+            return self.defend(action[1], action[2])
+        elif kind == UpdateAction.FINISH_TURN:
+            return self.finish_turn()
+        raise ValueError(f'Unknown action {action!r}')
+
     def _take_all_field(self):
         """
         Соперник берет все катры со стола себе.
         """
-        cards = self.attacking_cards + self.defending_cards
+        cards = self._attacking + self._defending
         self.defending_player.add_cards(cards)
-        self.field = {}
+        self._clear_field()
         self.last_update['take_cards'] = {'cards': cards, 'player': self.defending_player.index}
 
+    def _clear_field(self):
+        self.field = {}
+        self._field_nominals = set()
+        self._attacking = []
+        self._defending = []
+        self._unbeaten = []
+        self._defend_moves = {}
+
     @property
     def any_unbeaten_cards(self):
-        return len(self.unbeaten_cards)
+        return len(self._unbeaten)
 
+    @metrics.timed('durak.attack')
     def attack(self, card):
         if self.winner:
             return False
@@ -225,12 +424,26 @@ class Durak:
             return False
 
         self.attacking_player.take_card(card)
+        self.journal.append((UpdateAction.ATTACK, card, self.last_update, self.state_hash))
+        i = CARD_INDEX[card]
+        self.state_hash ^= ZOBRIST.hand[self.attacker_index][i] ^ ZOBRIST.field_attack[i]
+
+        if not self.field:
+            self._attack_moves = {c: None for c in self.attacking_player.cards if c[0] == card[0]}
+            self._field_nominals.add(card[0])
+        else:
+            del self._attack_moves[card]
+        self._defend_moves[card] = self.defending_player.beating(card, self.trump_suit)
+
         self.field[card] = None
+        self._attacking.append(card)
+        self._unbeaten.append(card)
 
         self.last_update = {'action': UpdateAction.ATTACK, 'card': card, 'player': self.attacker_index}
 
         return True
 
+    @metrics.timed('durak.defend')
     def defend(self, attacking_card, defending_card):
         """
         Защита
@@ -243,9 +456,29 @@ class Durak:
         if self.field[attacking_card] is not None:
             return False
         if self.can_beat(attacking_card, defending_card):
-            self.field[attacking_card] = defending_card
-
             self.defending_player.take_card(defending_card)
+            self.field[attacking_card] = defending_card
+            self.journal.append((UpdateAction.DEFEND, attacking_card, defending_card, self.last_update,
+                                 self.state_hash))
+            i = CARD_INDEX[defending_card]
+            self.state_hash ^= (ZOBRIST.hand[self.defending_player.index][i] ^
+                                ZOBRIST.field_defend[CARD_INDEX[attacking_card]][i])
+
+            del self._defend_moves[attacking_card]
+            for cards in self._defend_moves.values():
+                if defending_card in cards:
+                    cards.remove(defending_card)
+            self._add_field_nominal(defending_card[0])
+
+            self._unbeaten.remove(attacking_card)
+            # отбивающие идут в порядке атакующих: считаем отбитые до этой
+            k = 0
+            for att in self._attacking:
+                if att == attacking_card:
+                    break
+                if self.field[att] is not None:
+                    k += 1
+            self._defending.insert(k, defending_card)
 
             self.last_update = {'action': UpdateAction.DEFEND, 'defending_card': defending_card,
                                 'attacking_card': attacking_card, 'player': self.defending_player.index}
@@ -253,9 +486,28 @@ class Durak:
             return True
         return False
 
+    @metrics.timed('durak.finish_turn')
     def finish_turn(self) -> TurnFinishResult:
         assert not self.winner
 
+        from_deck = []
+        self.journal.append((UpdateAction.FINISH_TURN, self.field, bool(self.any_unbeaten_cards), from_deck,
+                             self.attacker_index, self.winner, self.last_update, self.state_hash))
+
+        h = self.state_hash
+        took = self.any_unbeaten_cards
+        defender_keys = ZOBRIST.hand[self.defending_player.index]
+        for att, dfn in self.field.items():
+            i = CARD_INDEX[att]
+            h ^= ZOBRIST.field_attack[i]
+            if took:
+                h ^= defender_keys[i]
+            if dfn is not None:
+                j = CARD_INDEX[dfn]
+                h ^= ZOBRIST.field_defend[i][j]
+                if took:
+                    h ^= defender_keys[j]
+
         self.last_update = {'action': UpdateAction.FINISH_TURN}
 
         took_cards = False
@@ -265,26 +517,84 @@ class Durak:
             took_cards = True
         else:
 
-            self.field = {}
+            self._clear_field()
             self.last_update['clear_field'] = True
 
         take_cards = []
+        h ^= ZOBRIST.deck_size[len(self.deck)]
         for p in rotate(self.players, self.attacker_index):
+            n = len(self.deck)
             cards = p.take_cards_from_deck(self.deck)
             take_cards += [(p.index, card) for card in cards]
+            from_deck.append((p.index, cards))
+            for k, card in enumerate(cards):
+                i = CARD_INDEX[card]
+                h ^= ZOBRIST.deck[n - 1 - k][i] ^ ZOBRIST.hand[p.index][i]
+        h ^= ZOBRIST.deck_size[len(self.deck)]
         self.last_update['from_deck'] = take_cards
+        self.state_hash = h
 
         if not self.deck:
             for p in self.players:
                 if not p.cards:
                     self.winner = p.index
+                    self.state_hash ^= ZOBRIST.winner[self.winner]
                     self.last_update['winner'] = self.winner
                     return TurnFinishResult.GAME_OVER
 
         if took_cards:
-            return TurnFinishResult.TOOK_CARDS
+            result = TurnFinishResult.TOOK_CARDS
         else:
 
+            self.state_hash ^= ZOBRIST.attacker[self.attacker_index] ^ ZOBRIST.attacker[self.defending_player.index]
             self.attacker_index = self.defending_player.index
             self.last_update['turn_change'] = self.attacker_index
-            return TurnFinishResult.NORMAL_TURN
+            result = TurnFinishResult.NORMAL_TURN
+
+        self._rebuild_legal_actions()
+        return result
+
+    def last_action(self):
+        """
+        Последнее действие из журнала отмены в формате legal_actions()
+        :return: ход или None, если журнал пуст
+        """
+        if not self.journal:
+            return None
+        record = self.journal[-1]
+        if record[0] == UpdateAction.ATTACK:
+            return record[0], record[1]
+        if record[0] == UpdateAction.DEFEND:
+            return record[0], record[1], record[2]
+        return UpdateAction.FINISH_TURN,
+
+    def undo(self):
+        """
+        Отменить последнее действие (attack, defend или finish_turn) по журналу
+        :return: bool - было ли что отменять
+        """
+        if not self.journal:
+            return False
+
+        record = self.journal.pop()
+        kind = record[0]
+        if kind == UpdateAction.ATTACK:
+            _, card, self.last_update, self.state_hash = record
+            del self.field[card]
+            self.attacking_player.add_card(card)
+        elif kind == UpdateAction.DEFEND:
+            _, attacking_card, defending_card, self.last_update, self.state_hash = record
+            self.field[attacking_card] = None
+            self.defending_player.add_card(defending_card)
+        else:
+            (_, field, took_cards, from_deck, self.attacker_index, self.winner, self.last_update,
+             self.state_hash) = record
+            for index, cards in reversed(from_deck):
+                self.players[index].remove_cards(cards)
+                self.deck[:0] = cards
+            if took_cards:
+                self.defending_player.remove_cards([c for pair in field.items() for c in pair if c is not None])
+            self.field = field
+
+        self._rebuild_legal_actions()
+        return True
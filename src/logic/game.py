@@ -0,0 +1,163 @@
+import copy
+import threading
+from abc import ABC, abstractmethod
+
+from .durak import TurnFinishResult, UpdateAction
+from .serialization import DurakSerialized
+
+
+class DurakGame(ABC):
+    """
+    Партия с точки зрения одного игрока: проверка правил для его действий.
+    Наследники решают, куда отправлять изменения (по сети, боту и т.п.)
+    """
+
+    def __init__(self, my_index):
+        self.state = DurakSerialized()
+
+        self._my_index = my_index
+        self._opp_index = 1 - my_index
+
+        # получает копию состояния после каждого изменения (см. _notify)
+        self.on_state_updated = lambda _: ...
+        self.on_opponent_quit = lambda: ...
+        # связь с соперником пропала (False) или восстановлена (True)
+        self.on_connection_changed = lambda connected: ...
+
+        # действия игрока и обновления от соперника приходят из разных потоков
+        self._lock = threading.RLock()
+
+        # журнал партий (logic.gamelog.JournalWriter), None - не записывать
+        self.journal = None
+        self._journal_game = None
+        # состояние, к которому относятся записанные ходы: другое значит, что его заменили целиком
+        self._journal_state = None
+        # скрытые карты переложены (игра через сервер) - после хода записать полное состояние
+        self._journal_snapshot = False
+
+    @abstractmethod
+    def _state_changed(self, action):
+        """
+        Вызывается после каждого успешного действия игрока
+        :param action: ход в формате Durak.legal_actions()
+        """
+
+    def _notify(self):
+        """
+        Сообщить о новом состоянии. Вызывается под self._lock сразу после изменения.
+        Обработчик получает копию состояния вместе с last_update этого изменения: главный поток
+        Kivy разбирает обновления позже, когда поток бота или сети уже мог сделать следующий ход
+        """
+        if self.journal is not None:
+            self._write_journal()
+        snapshot = DurakSerialized(self.state.serialized())
+        snapshot.last_update = copy.deepcopy(self.state.last_update)
+        self.on_state_updated(snapshot)
+
+    def _write_journal(self):
+        """
+        Дописать изменение в журнал: ход берется из журнала отмены движка,
+        а замененное целиком состояние (новая партия, resync) пишется полностью
+        """
+        state, journal = self.state, self.journal
+        action = state.last_action() if state is self._journal_state else None
+        if self._journal_game is None:
+            self._journal_game = journal.new_game(state)
+        elif action is None:
+            journal.snapshot(self._journal_game, state)
+        else:
+            journal.action(self._journal_game, action, state)
+            if self._journal_snapshot:
+                journal.snapshot(self._journal_game, state)
+        self._journal_state = state
+        self._journal_snapshot = False
+        if state.winner is not None:
+            # следующее состояние начнет в журнале новую партию
+            journal.end_game(self._journal_game)
+            journal.flush()
+            self._journal_game = None
+
+    def finish_turn(self) -> TurnFinishResult:
+        with self._lock:
+            return self._finish_turn()
+
+    def attack(self, card):
+        with self._lock:
+            return self._attack(card)
+
+    def defend(self, my_card, field_card):
+        with self._lock:
+            return self._defend(my_card, field_card)
+
+    def _finish_turn(self):
+        g = self.state
+        if g.field:
+            if self.is_my_turn and g.any_unbeaten_cards:
+                return TurnFinishResult.CANT_FORCE_TO_TAKE
+            elif not self.is_my_turn and not g.any_unbeaten_cards:
+                return TurnFinishResult.CANT_TAKE_NOW
+            else:
+                result = g.finish_turn()
+                self._state_changed((UpdateAction.FINISH_TURN,))
+                return result
+        else:
+            return TurnFinishResult.EMPTY
+
+    def _attack(self, card):
+        assert self.is_my_turn
+        result = self.state.attack(card)
+        if result:
+            self._state_changed((UpdateAction.ATTACK, card))
+        return result
+
+    def _defend(self, my_card, field_card):
+        assert not self.is_my_turn
+        g = self.state
+        if g.field:
+
+            if isinstance(field_card, int):
+                field_card = list(g.field.keys())[field_card]
+
+            assert my_card in self.state.defending_player.cards
+            assert field_card in self.state.field.keys()
+            result = g.defend(field_card, my_card)
+            if result:
+                self._state_changed((UpdateAction.DEFEND, field_card, my_card))
+            return result
+        else:
+            return False
+
+    @abstractmethod
+    def start(self):
+        ...
+
+    @abstractmethod
+    def stop(self):
+        ...
+
+    @property
+    def my_cards(self):
+        return self.state.players[self._my_index].cards
+
+    @property
+    def opp_cards(self):
+        return self.state.players[self._opp_index].cards
+
+    @property
+    def is_my_turn(self):
+        return self.state.attacker_index == self._my_index
+
+    def is_me(self, index):
+        return index == self._my_index
+
+    ME = 'me'
+    OPPONENT = 'opponent'
+
+    @property
+    def winner(self):
+        if self.state.winner is not None:
+            return self.ME if self._my_index == self.state.winner else self.OPPONENT
+
+    @property
+    def my_index(self):
+        return self._my_index
@@ -0,0 +1,307 @@
+"""
+Двоичный журнал партий: только дописывается, действия всех партий идут подряд.
+
+Файл начинается с MAGIC, дальше записи: заголовок RECORD (тип, длина полезной нагрузки,
+номер партии, номер действия), полезная нагрузка и crc32 заголовка с нагрузкой.
+Партия начинается с записи R_GAME с полным состоянием, каждое действие - запись R_ACTION
+(codec.encode_action), а каждые snapshot_every действий пишется R_SNAPSHOT с полным состоянием.
+
+Рядом лежит индекс <журнал>.idx: по записи INDEX (номер партии, номер действия, смещение)
+на каждое полное состояние. Состояние после любого действия восстанавливается так:
+по индексу ищем ближайшее полное состояние не позже нужного действия, читаем журнал
+с его смещения и доигрываем действия этой партии. Номер партии может повториться (журнал
+дописывается): тогда партия - это записи от ее R_GAME до следующего R_GAME с тем же номером,
+и по умолчанию читается последняя из них. Файлы читаются потоком, целиком в память
+не загружаются. Оборванная при аварии последняя запись при чтении пропускается.
+"""
+import os
+import random
+import struct
+import zlib
+
+from ..network import codec
+from .serialization import DurakSerialized
+
+MAGIC = b'DKJ\x01'
+
+RECORD = struct.Struct('>BIQI')
+CRC = struct.Struct('>I')
+INDEX = struct.Struct('>QIQ')
+
+R_GAME = 1
+R_ACTION = 2
+R_SNAPSHOT = 3
+
+SNAPSHOT_EVERY = 32
+
+# читаем и пишем кусками такого размера
+BUFFER_SIZE = 1 << 20
+
+
+class JournalError(ValueError):
+    pass
+
+
+def index_path(path):
+    return f'{path}.idx'
+
+
+def _state_payload(state):
+    # DurakSerialized.serialized() работает и для обычного Durak
+    return codec.encode_state(DurakSerialized.serialized(state))
+
+
+def _decode_state(payload):
+    return DurakSerialized(codec.decode_state(codec._Reader(payload)))
+
+
+class JournalWriter:
+    """
+    Запись журнала. Можно дописывать в уже существующий файл
+    """
+
+    def __init__(self, path, snapshot_every=SNAPSHOT_EVERY, rng: random.Random = None):
+        """
+        :param snapshot_every: через сколько действий партии писать ее полное состояние
+        :param rng: для номеров партий, по умолчанию случайные
+        """
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self._rng = rng or random.Random()
+
+        self._file = open(path, 'ab', buffering=BUFFER_SIZE)
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._index = open(index_path(path), 'ab', buffering=BUFFER_SIZE)
+
+        # номер партии -> номер последнего действия
+        self._seq = {}
+
+    def _write(self, kind, game_id, seq, payload):
+        offset = self._file.tell()
+        header = RECORD.pack(kind, len(payload), game_id, seq)
+        self._file.write(header)
+        self._file.write(payload)
+        self._file.write(CRC.pack(zlib.crc32(payload, zlib.crc32(header))))
+        if kind != R_ACTION:
+            self._index.write(INDEX.pack(game_id, seq, offset))
+
+    def new_game(self, state, game_id=None):
+        """
+        Начать партию с состояния state
+        :return: номер партии
+        """
+        if game_id is None:
+            game_id = self._rng.getrandbits(63)
+        self._seq[game_id] = 0
+        self._write(R_GAME, game_id, 0, _state_payload(state))
+        return game_id
+
+    def action(self, game_id, action, state):
+        """
+        Записать действие, которое уже применено к state
+        :param action: ход в формате Durak.legal_actions()
+        :return: номер действия в партии, начиная с 1
+        """
+        seq = self._seq[game_id] + 1
+        self._seq[game_id] = seq
+        self._write(R_ACTION, game_id, seq, codec.encode_action(action))
+        if seq % self.snapshot_every == 0:
+            self._write(R_SNAPSHOT, game_id, seq, _state_payload(state))
+        return seq
+
+    def snapshot(self, game_id, state, seq=None):
+        """
+        Полное состояние вне очереди, например когда его целиком прислал соперник
+        :param seq: с какого номера действия продолжить партию
+        """
+        if seq is not None:
+            self._seq[game_id] = seq
+        self._write(R_SNAPSHOT, game_id, self._seq[game_id], _state_payload(state))
+
+    def end_game(self, game_id):
+        self._seq.pop(game_id, None)
+
+    def flush(self):
+        self._file.flush()
+        self._index.flush()
+
+    def close(self):
+        self._file.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class JournalReader:
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(index_path(path)):
+            self.rebuild_index()
+
+    def records(self, offset=len(MAGIC)):
+        """
+        Записи журнала начиная со смещения offset
+        :return: генератор (смещение, тип, номер партии, номер действия, полезная нагрузка)
+        """
+        with open(self.path, 'rb', buffering=BUFFER_SIZE) as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise JournalError(f'Not a game journal: {self.path}')
+            f.seek(offset)
+            while True:
+                header = f.read(RECORD.size)
+                if len(header) < RECORD.size:
+                    return
+                kind, length, game_id, seq = RECORD.unpack(header)
+                payload = f.read(length)
+                crc = f.read(CRC.size)
+                if len(crc) < CRC.size:
+                    # запись оборвана - журнал писали в момент аварии
+                    return
+                if CRC.unpack(crc)[0] != zlib.crc32(payload, zlib.crc32(header)):
+                    raise JournalError(f'Bad checksum at offset {offset}')
+                yield offset, kind, game_id, seq, payload
+                offset += RECORD.size + length + CRC.size
+
+    def _index(self):
+        """
+        :return: генератор (номер партии, номер действия, смещение) полных состояний
+        """
+        with open(index_path(self.path), 'rb', buffering=BUFFER_SIZE) as f:
+            while len(entry := f.read(INDEX.size)) == INDEX.size:
+                yield INDEX.unpack(entry)
+
+    def rebuild_index(self):
+        """
+        Заново построить индекс по журналу, например если индекс потерян
+        """
+        with open(index_path(self.path), 'wb', buffering=BUFFER_SIZE) as f:
+            for offset, kind, game_id, seq, _ in self.records():
+                if kind != R_ACTION:
+                    f.write(INDEX.pack(game_id, seq, offset))
+
+    def games(self):
+        """
+        :return: номера партий в порядке начала
+        """
+        # полное состояние вне очереди тоже может прийтись на действие 0
+        return list(dict.fromkeys(game_id for game_id, seq, _ in self._index() if seq == 0))
+
+    def starts(self, game_id):
+        """
+        :return: смещения записей R_GAME партии по порядку; больше одного, если номер партии использован
+        повторно, например при дописывании в существующий журнал
+        """
+        offsets = []
+        with open(self.path, 'rb') as f:
+            for g, seq, offset in self._index():
+                # полное состояние вне очереди на действии 0 в индексе не отличить от начала партии
+                if g == game_id and seq == 0:
+                    f.seek(offset)
+                    if RECORD.unpack(f.read(RECORD.size))[0] == R_GAME:
+                        offsets.append(offset)
+        return offsets
+
+    def _span(self, game_id, start):
+        """
+        :param start: смещение R_GAME партии, None - последняя партия с этим номером
+        :return: (смещение начала, смещение следующей партии с тем же номером или None)
+        """
+        starts = self.starts(game_id)
+        if not starts:
+            raise KeyError(game_id)
+        if start is None:
+            start = starts[-1]
+        elif start not in starts:
+            raise KeyError((game_id, start))
+        i = starts.index(start)
+        return start, starts[i + 1] if i + 1 < len(starts) else None
+
+    def actions(self, game_id, start=None):
+        """
+        :param start: смещение R_GAME из starts(), None - последняя партия с этим номером
+        :return: генератор ходов партии по порядку
+        """
+        start, end = self._span(game_id, start)
+        for offset, kind, g, seq, payload in self.records(start):
+            if offset == end:
+                # номер партии использован повторно - дальше уже другая партия
+                return
+            if g == game_id and kind == R_ACTION:
+                yield codec.decode_action(payload)
+
+    def state_at(self, game_id, seq=None, start=None):
+        """
+        Состояние партии после действия номер seq
+        :param seq: None - последнее записанное
+        :param start: смещение R_GAME из starts(), None - последняя партия с этим номером
+        :return: DurakSerialized
+        """
+        start, end = self._span(game_id, start)
+        snapshot = None
+        for g, s, offset in self._index():
+            if g != game_id or offset < start or end is not None and offset >= end:
+                continue
+            if (seq is None or s <= seq) and (snapshot is None or s >= snapshot[0]):
+                snapshot = s, offset
+
+        state = None
+        done = snapshot[0]
+        for offset, kind, g, s, payload in self.records(snapshot[1]):
+            if offset == end:
+                break
+            if state is None:
+                state = _decode_state(payload)
+                continue
+            if g != game_id or kind != R_ACTION or s <= done:
+                continue
+            if seq is not None and s > seq:
+                break
+            if s != done + 1:
+                raise JournalError(f'Game {game_id}: action {s} follows {done}')
+            if not state.apply(codec.decode_action(payload)):
+                raise JournalError(f'Game {game_id}: action {s} is illegal')
+            done = s
+        if seq is not None and done != seq:
+            raise KeyError((game_id, seq))
+        return state
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m src.logic.gamelog', description='Просмотр журнала партий')
+    parser.add_argument('path')
+    parser.add_argument('-g', '--game', type=int, help='номер партии')
+    parser.add_argument('-a', '--action', type=int, help='номер действия, по умолчанию последнее')
+    parser.add_argument('--start', type=int, help='смещение начала партии, если номер повторяется; '
+                                                  'по умолчанию последняя')
+    args = parser.parse_args()
+
+    reader = JournalReader(args.path)
+    if args.game is None:
+        games = actions = snapshots = 0
+        for _, kind, _, _, _ in reader.records():
+            games += kind == R_GAME
+            actions += kind == R_ACTION
+            snapshots += kind == R_SNAPSHOT
+        print(f'{games} games, {actions} actions, {snapshots} snapshots')
+        return
+
+    starts = reader.starts(args.game)
+    if len(starts) > 1:
+        print(f'game {args.game} was recorded {len(starts)} times, at offsets', *starts)
+    state = reader.state_at(args.game, args.action, args.start)
+    print('trump:', state.trump, 'attacker:', state.attacker_index, 'winner:', state.winner)
+    print('deck:', len(state.deck), 'field:', state.field)
+    for p in state.players:
+        print(f'player {p.index}:', p.cards)
+    print('last update:', state.last_update)
+
+
+if __name__ == '__main__':
+    main()
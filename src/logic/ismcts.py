@@ -0,0 +1,190 @@
+"""
+Information Set Monte Carlo Tree Search (single observer) для Durak.
+
+Скрытая информация - карты соперника и порядок колоды. На каждой итерации
+они пересэмплируются из того, что видел игрок, затем ход разыгрывается на движке
+и откатывается через Durak.undo(), без копирования партии.
+
+Узлы дерева - множества информации игрока. Разные порядки ходов (подкинуть 7, потом 8
+или наоборот) приводят к одному множеству: такие транспозиции находятся
+по таблице транспозиций и делят один узел со статистикой.
+"""
+import math
+import random
+import time
+
+from .durak import CARD_INDEX, ZOBRIST
+from .serialization import DurakSerialized
+from .view import out_of_game, view_hash
+from .zobrist import TranspositionTable
+from ..sim.policies import greedy_policy
+
+EXPLORATION = 0.7
+ROLLOUT_EPSILON = 0.1
+MAX_ROLLOUT_ACTIONS = 300
+
+
+class Determinizer:
+    """
+    Копия партии с точки зрения игрока observer, в которой можно пересдавать скрытые карты
+    """
+
+    def __init__(self, state, observer, known_opp_cards=()):
+        self.game = DurakSerialized(DurakSerialized.serialized(state))
+        self.observer = observer
+
+        opp = self.game.players[1 - observer]
+        known_opp_cards = set(map(tuple, known_opp_cards))
+        self.known = [c for c in opp.cards if c in known_opp_cards]
+        self.trump_in_deck = bool(self.game.deck)
+
+        visible = set(self.known)
+        if self.trump_in_deck:
+            visible.add(self.game.trump)
+        self.hidden = [c for c in opp.cards if c not in visible] + [c for c in self.game.deck if c not in visible]
+        self.n_opp_hidden = opp.n_cards - len(self.known)
+
+    def resample(self, rng: random.Random):
+        """
+        Раскидать невидимые карты между рукой соперника и колодой случайным образом
+        """
+        game = self.game
+        hidden = list(self.hidden)
+        rng.shuffle(hidden)
+
+        opp = game.players[1 - self.observer]
+        # присваивание cards само сортирует руку
+        opp.cards = self.known + hidden[:self.n_opp_hidden]
+
+        game.deck = hidden[self.n_opp_hidden:]
+        if self.trump_in_deck:
+            game.deck.append(game.trump)
+
+        game._init_derived()
+        return game
+
+
+def info_set_key(game, observer):
+    """
+    Хэш множества информации observer: то, что он видит (logic.view), и отбой.
+    Ключи позиций колоды в view_hash не участвуют, для отбоя берем их
+    """
+    h = view_hash(game, observer)
+    for c in out_of_game(game):
+        h ^= ZOBRIST.deck[0][CARD_INDEX[c]]
+    return h
+
+
+class Node:
+    __slots__ = ('player', 'children', 'visits', 'wins', 'avail')
+
+    def __init__(self, player=None):
+        self.player = player
+        self.children = {}
+        self.visits = 0
+        self.wins = 0.0
+        self.avail = 1
+
+    def ucb(self, c):
+        return self.wins / self.visits + c * math.sqrt(math.log(self.avail) / self.visits)
+
+
+def rollout(game, rng: random.Random, epsilon=ROLLOUT_EPSILON, max_actions=MAX_ROLLOUT_ACTIONS):
+    for _ in range(max_actions):
+        if game.winner is not None:
+            return
+        actions = game.legal_actions(game.acting_player_index)
+        if not actions:
+            return
+        if rng.random() < epsilon:
+            game.apply(rng.choice(actions))
+        else:
+            game.apply(greedy_policy(game, actions, rng))
+
+
+class ISMCTS:
+    def __init__(self, budget_ms=150, rng: random.Random = None, exploration=EXPLORATION, table_size_log2=14):
+        self.budget_ms = budget_ms
+        self.rng = rng or random.Random()
+        self.exploration = exploration
+        self.iterations = 0
+        # (ключ множества информации, кто сделал ход) -> Node текущего поиска
+        self.table = TranspositionTable(table_size_log2)
+
+    def search(self, state, observer, known_opp_cards=()):
+        """
+        Лучший ход игрока observer в состоянии state за budget_ms миллисекунд
+        :param known_opp_cards: карты соперника, которые observer видел (взятые со стола)
+        :return: ход в формате Durak.legal_actions() или None, если ходить нечем
+        """
+        actions = state.legal_actions(observer)
+        if len(actions) <= 1:
+            return actions[0] if actions else None
+
+        deadline = time.perf_counter() + self.budget_ms / 1000.0
+        determinizer = Determinizer(state, observer, known_opp_cards)
+        root = Node()
+        rng = self.rng
+        self.iterations = 0
+        # узлы прошлого поиска строились при другом знании о руке соперника
+        self.table.clear()
+
+        while True:
+            self._iterate(root, determinizer.resample(rng), rng, observer)
+            self.iterations += 1
+            if time.perf_counter() >= deadline:
+                break
+
+        legal = set(actions)
+        return max((a for a in root.children if a in legal), key=lambda a: root.children[a].visits,
+                   default=actions[0])
+
+    def _iterate(self, root, game, rng, observer):
+        node = root
+        path = [root]
+
+        # выбор и расширение
+        while game.winner is None:
+            player = game.acting_player_index
+            actions = game.legal_actions(player)
+            if not actions:
+                break
+            untried = [a for a in actions if a not in node.children]
+            for a in actions:
+                child = node.children.get(a)
+                if child is not None:
+                    child.avail += 1
+            if untried:
+                action = rng.choice(untried)
+                game.apply(action)
+                key = info_set_key(game, observer) << 1 | player
+                found = self.table.get(key)
+                if found is not None:
+                    # сюда уже приходили другим порядком ходов: продолжаем выбор из общего узла
+                    node = node.children[action] = found[0]
+                    path.append(node)
+                    continue
+                child = node.children[action] = Node(player)
+                self.table.put(key, child)
+                path.append(child)
+                break
+            action = max(actions, key=lambda a: node.children[a].ucb(self.exploration))
+            node = node.children[action]
+            game.apply(action)
+            path.append(node)
+
+        rollout(game, rng)
+
+        # обратное распространение: выигрыш считается для того, кто сделал ход в узел
+        winner = game.winner
+        for node in path:
+            node.visits += 1
+            if node.player is not None:
+                if winner is None:
+                    node.wins += 0.5
+                elif winner == node.player:
+                    node.wins += 1.0
+
+        while game.undo():
+            pass
+
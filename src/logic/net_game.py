@@ -1,14 +1,48 @@
+import random
+import threading
+import time
 from threading import Timer
 
-from .durak import TurnFinishResult
+from .game import DurakGame
 from .serialization import DurakSerialized
+from ..network import codec
+from ..network.mux import session_id
 from ..network.network import Networking
+from ..network.reliable import ReliableChannel
 
 
-class DurakNetGame:
-    def __init__(self, my_id, remote_id, remote_addr, ports):
-        self.state = DurakSerialized()
+def encode_move(action):
+    return [action[0], *map(list, action[1:])]
 
+
+def decode_move(move):
+    return (move[0], *map(tuple, move[1:]))
+
+
+class DurakNetGame(DurakGame):
+    """
+    Сетевая партия. Каждый ход передается дельтой: сам ход, его порядковый номер
+    и хэш состояния после него. Полное состояние отправляется только в начале игры
+    и при расхождении хэшей; в спорных случаях верным считается состояние игрока 0.
+    При подключении стороны обмениваются 'hello' и, если оба понимают двоичный формат codec,
+    переходят на него; иначе остается JSON.
+
+    Если связь пропала, партия продолжается с того же места: сторона, чьи пакеты перестали
+    подтверждаться, отправляет 'resume' с токеном сессии и номером последнего хода.
+    Соседи начинают надежный канал заново и досылают друг другу недостающие ходы,
+    а если их уже нет в истории - полное состояние
+    """
+
+    RESUME_RETRY = 0.3
+    RESUME_TIMEOUT = 30.0
+
+    def __init__(self, my_id, remote_id, remote_addr, ports=None, network_cls=Networking, mux=None):
+        """
+        :param remote_addr: адрес соперника; с mux - пара (адрес, порт), откуда он нам писал
+        :param ports: два порта, если игра идет на своих сокетах
+        :param network_cls: Networking (поток чтения на сокет) или aio.AsyncNetworking
+        :param mux: mux.Multiplexer - играть через общий сокет клиента, в своей сессии
+        """
         self._my_id = int(my_id)
         self._remote_id = int(remote_id)
         self._remote_addr = remote_addr
@@ -17,118 +51,229 @@ class DurakNetGame:
 
         me_first = self._my_id < self._remote_id
 
-        self._my_index = 0 if me_first else 1
-        self._opp_index = 1 if me_first else 0
+        super().__init__(0 if me_first else 1)
+
+        # сколько ходов применено к self.state
+        self._seq = 0
+
+        # ходы после последнего полного состояния: (ход, хэш после него); _history[0] - ход номер _history_base + 1
+        self._history = []
+        self._history_base = 0
 
-        network1 = Networking(port_no=ports[0])
-        network2 = Networking(port_no=ports[1])
+        self._binary = False
 
-        self._receiver = network1 if me_first else network2
-        self._receiver.bind("")
+        # токен сессии выдает игрок 0 в 'hello'; по нему узнается 'resume' этой же партии
+        self.token = random.getrandbits(63) + 1 if me_first else None
+        # номер, с которого начинается наш канал в текущей попытке 'resume', и когда она начата
+        self._epoch = None
+        self._resuming = None
+        # номер канала соседа из последнего принятого 'resume'
+        self._peer_epoch = None
 
-        self._sender = network2 if me_first else network1
+        if mux is not None:
+            self._receiver = self._sender = mux.session(session_id(self._my_id, self._remote_id))
+        else:
+            network1 = network_cls(port_no=ports[0])
+            network2 = network_cls(port_no=ports[1])
+
+            self._receiver = network1 if me_first else network2
+            self._receiver.bind("")
+
+            self._sender = network2 if me_first else network1
+
+        self._channel = ReliableChannel(self._sender, self._receiver, self._remote_addr)
+        self._channel.on_stall = self.resume
 
-        self.on_state_updated = lambda _: ...
-        self.on_opponent_quit = lambda: ...
+    def _send(self, j):
+        self._channel.send_json(j, binary=self._binary)
+
+    def _send_hello(self, reply=False):
+        self._send({'action': 'hello', 'codecs': [codec.VERSION], 'reply': reply, 'token': self.token})
+
+    def _reset_history(self):
+        self._history = []
+        self._history_base = self._seq
 
     def _send_game_state(self):
-        self.on_state_updated(self.state)
-        self._sender.send_json({
-            'action': 'state',
-            'state': self.state.serialized()
-        }, self._remote_addr)
+        with self._lock:
+            self._reset_history()
+            self._notify()
+            self._send({
+                'action': 'state',
+                'seq': self._seq,
+                'state': self.state.serialized()
+            })
+
+    def _move_message(self, seq):
+        move, checksum = self._history[seq - self._history_base - 1]
+        return {'action': 'move', 'seq': seq, 'move': move, 'checksum': checksum}
+
+    def _state_changed(self, action):
+        self._seq += 1
+        self._history.append((encode_move(action), self.state.state_hash))
+        self._notify()
+        self._send(self._move_message(self._seq))
 
     def _send_quit(self):
-        self._sender.send_json({
+        self._send({
             'action': 'quit'
-        }, self._remote_addr)
-
-    def finish_turn(self) -> TurnFinishResult:
-        g = self.state
-        if g.field:
-            if self.is_my_turn and g.any_unbeaten_cards:
-                return TurnFinishResult.CANT_FORCE_TO_TAKE
-            elif not self.is_my_turn and not g.any_unbeaten_cards:
-                return TurnFinishResult.CANT_TAKE_NOW
-            else:
-                result = g.finish_turn()
-                self._send_game_state()
-                return result
-        else:
-            return TurnFinishResult.EMPTY
+        })
 
-    def attack(self, card):
-        assert self.is_my_turn
-        result = self.state.attack(card)
-        if result:
+    def _desync(self):
+        """
+        Состояния разошлись: игрок 0 присылает полное состояние, игрок 1 его запрашивает
+        """
+        if self._my_index == 0:
             self._send_game_state()
-        return result
-
-    def defend(self, my_card, field_card):
-        assert not self.is_my_turn
-        g = self.state
-        if g.field:
-
-            if isinstance(field_card, int):
-                field_card = list(g.field.keys())[field_card]
-
-            assert my_card in self.state.defending_player.cards
-            assert field_card in self.state.field.keys()
-            result = g.defend(field_card, my_card)
-            if result:
-                self._send_game_state()
-            return result
         else:
-            return False
+            self._send({'action': 'resync'})
 
     def _new_game(self):
 
-        self.state = DurakSerialized()
+        with self._lock:
+            self.state = DurakSerialized()
+            self._seq = 0
+            self._reset_history()
 
         Timer(0.5, self._send_game_state).start()
 
+    def _on_remote_move(self, data):
+        with self._lock:
+            if data['seq'] <= self._seq:
+                # ход уже получен, повторно его дослали после 'resume'
+                return
+            if data['seq'] != self._seq + 1:
+                self._desync()
+                return
+            try:
+                ok = self.state.apply(decode_move(data['move']))
+            except (AssertionError, KeyError, ValueError):
+                ok = False
+            if not ok or self.state.state_hash != data['checksum']:
+                self._desync()
+                return
+            self._seq = data['seq']
+            self._history.append((data['move'], data['checksum']))
+            self._notify()
+
+    def resume(self):
+        """
+        Восстановить связь с соседом после обрыва. Повторяется, пока он не ответит 'resumed',
+        но не дольше RESUME_TIMEOUT
+        """
+        with self._lock:
+            if self._resuming is not None or not self.token or not self._channel.running:
+                return
+            self._epoch = random.getrandbits(31) + 1
+            self._resuming = time.monotonic()
+        self.on_connection_changed(False)
+        threading.Thread(target=self._resume_job, daemon=True).start()
+
+    def _resume_job(self):
+        while self._channel.running:
+            with self._lock:
+                if self._resuming is None:
+                    return
+                if time.monotonic() - self._resuming > self.RESUME_TIMEOUT:
+                    self._resuming = None
+                    break
+                message = self._resume_message('resume')
+            self._channel.send_unreliable_json(message)
+            time.sleep(self.RESUME_RETRY)
+        if self._channel.running:
+            self.on_opponent_quit()
+
+    def _resume_message(self, action):
+        return {'action': action, 'token': self.token, 'epoch': self._epoch, 'peer_epoch': self._peer_epoch,
+                'seq': self._seq, 'checksum': self.state.state_hash}
+
+    def _on_resume(self, data):
+        """
+        Сосед переподключается: начинаем канал заново с нового номера и отвечаем 'resumed'.
+        Токен уже проверен, поэтому сосед может прийти с нового адреса (сменил сеть) -
+        канал переходит на адрес, с которого пришел 'resume'
+        """
+        with self._lock:
+            if data['epoch'] != self._peer_epoch:
+                moved = not self._channel.is_remote(self._channel.last_addr)
+                if self._resuming is not None and self._my_index == 0 and not moved:
+                    # переподключаемся одновременно - уступает игрок 1; но если он сменил адрес,
+                    # наш 'resume' до него не дойдет, и уступаем мы
+                    return
+                self._resuming = None
+                self._epoch = random.getrandbits(31) + 1
+                self._peer_epoch = data['epoch']
+                self._channel.reset(self._channel.last_addr, next_seq=self._epoch, delivered=self._peer_epoch - 1)
+                resumed = True
+            else:
+                # наш 'resumed' потерялся
+                resumed = False
+            self._channel.send_unreliable_json(self._resume_message('resumed'))
+            if resumed:
+                self._catch_up(data)
+        if resumed:
+            self.on_connection_changed(True)
+
+    def _on_resumed(self, data):
+        with self._lock:
+            if self._resuming is None or data['peer_epoch'] != self._epoch:
+                return
+            self._resuming = None
+            self._peer_epoch = data['epoch']
+            self._channel.reset(self._channel.last_addr, next_seq=self._epoch, delivered=self._peer_epoch - 1)
+            self._catch_up(data)
+        self.on_connection_changed(True)
+
+    def _catch_up(self, data):
+        """
+        Дослать соседу ходы после его последнего; если их уже нет в истории - полное состояние
+        """
+        seq = data['seq']
+        if seq == self._seq:
+            if data['checksum'] != self.state.state_hash:
+                self._desync()
+        elif seq < self._history_base:
+            self._send_game_state()
+        elif seq < self._seq:
+            for s in range(seq + 1, self._seq + 1):
+                self._send(self._move_message(s))
+
     def _on_remote_message(self, data):
         action = data['action']
-        if action == 'state':
-            self.state = DurakSerialized(data['state'])
-            self.on_state_updated(self.state)
+        if action == 'move':
+            self._on_remote_move(data)
+        elif action == 'state':
+            with self._lock:
+                self.state = DurakSerialized(data['state'])
+                self._seq = data.get('seq', 0)
+                self._reset_history()
+                self._notify()
+        elif action == 'hello':
+            if not data.get('reply'):
+                self._send_hello(reply=True)
+            self._binary = codec.VERSION in data.get('codecs', [])
+            if self._my_index == 1 and data.get('token'):
+                self.token = data['token']
+        elif action in ('resume', 'resumed'):
+            if not self.token or data.get('token') != self.token:
+                return
+            if action == 'resume':
+                self._on_resume(data)
+            else:
+                self._on_resumed(data)
+        elif action == 'resync':
+            self._send_game_state()
         elif action == 'quit':
             self.on_opponent_quit()
 
     def start(self):
 
-        self._receiver.run_reader_thread(self._on_remote_message)
+        self._channel.run_reader_thread(self._on_remote_message)
+        self._send_hello()
 
         if self._my_index == 0:
             self._new_game()
 
     def stop(self):
         self._send_quit()
-        self._receiver.read_running = False
-
-    @property
-    def my_cards(self):
-        return self.state.players[self._my_index].cards
-
-    @property
-    def opp_cards(self):
-        return self.state.players[self._opp_index].cards
-
-    @property
-    def is_my_turn(self):
-        return self.state.attacker_index == self._my_index
-
-    def is_me(self, index):
-        return index == self._my_index
-
-    ME = 'me'
-    OPPONENT = 'opponent'
-
-    @property
-    def winner(self):
-        if self.state.winner is not None:
-            return self.ME if self._my_index == self.state.winner else self.OPPONENT
-
-    @property
-    def my_index(self):
-        return self._my_index
+        self._channel.close()
@@ -1,13 +1,15 @@
+from .. import metrics
 from .durak import Durak, Player
 
 
 class DurakSerialized(Durak):
+    @metrics.timed('serialization.decode')
     def __init__(self, j=None):
         if j is None:
             super().__init__()
         else:
 
-            self.trump = j["trump"]
+            self.trump = tuple(j["trump"])
             self.attacker_index = j["attacker_index"]
             self.players = [Player(p['index'], p['cards']) for p in j["players"]]
             self.deck = list(map(tuple, j["deck"]))
@@ -16,6 +18,9 @@ class DurakSerialized(Durak):
             self.field = {tuple(ac): tuple(dc) if dc is not None else None for ac, dc in j["field"]}
             self.last_update = j["last_update"]
 
+            self._init_derived()
+
+    @metrics.timed('serialization.encode')
     def serialized(self):
         return {"trump": self.trump, "attacker_index": self.attacker_index, "deck": self.deck, "winner": self.winner,
                 "field": list(self.field.items()),
@@ -0,0 +1,219 @@
+import random
+import threading
+
+from .durak import UpdateAction
+from .game import DurakGame
+from .net_game import encode_move, decode_move
+from .view import from_view, view_hash
+from ..network import codec
+from ..network.network import Networking
+
+
+class DurakServerGame(DurakGame):
+    """
+    Партия через центральный сервер (python -m src.server). Ход применяется локально сразу
+    и отправляется серверу; неподтвержденные ходы повторяются по порядку номеров, пока сервер
+    их не подтвердит. Если сервер ход отклонил или хэши разошлись, его состояние заменяет наше.
+
+    Сервер присылает только вид партии (logic.view), поэтому руку соперника и колоду
+    мы раскладываем наугад и поправляем, когда карты открываются: соперник пошел картой,
+    которой у него по нашей раскладке нет, или нам пришли из колоды другие карты.
+    Подменные карты в руке соперника лежат рубашкой вверх; о подмене игра сообщает
+    в last_update['relabel'] парами (было, стало)
+    """
+
+    RETRY = 0.3
+
+    def __init__(self, my_id, server_addr, network_cls=Networking, rng: random.Random = None):
+        """
+        :param server_addr: (адрес, порт) сервера или маршрутизатора
+        """
+        # индекс станет известен после 'joined'
+        super().__init__(0)
+
+        self._my_id = int(my_id)
+        self._server = tuple(server_addr)
+
+        self._rng = rng or random.Random()
+
+        self._seq = 0
+        self._joined = False
+        self._binary = False
+
+        # номер -> ход, который сервер еще не подтвердил; по порядку номеров
+        self._pending = {}
+
+        self._running = False
+        self._wake = threading.Event()
+
+        self._network = network_cls(port_no=0)
+        self._network.bind("")
+
+    def _send(self, j):
+        self._network.send_bytes(codec.dumps(j, binary=self._binary), self._server)
+
+    def _send_join(self):
+        self._send({'action': 'join', 'pid': self._my_id, 'codecs': [codec.VERSION]})
+
+    def _state_changed(self, action):
+        self._seq += 1
+        move = {'action': 'move', 'seq': self._seq, 'move': encode_move(action), 'checksum': 0}
+        self._pending[self._seq] = move
+        if action[0] == UpdateAction.FINISH_TURN:
+            # какие карты придут из колоды, знает только сервер: ход применим, когда он его пришлет
+            self.state.undo()
+        else:
+            self._notify()
+        self._send(move)
+
+    def _resync(self):
+        self._pending.clear()
+        self._send({'action': 'resync'})
+
+    def _on_move(self, data):
+        with self._lock:
+            pending = self._pending
+            if data['seq'] <= self._seq - len(pending):
+                # повтор уже примененного хода
+                return
+            if data['seq'] in pending:
+                # подтверждение нашего хода; сервер применяет ходы по порядку, так что подтверждены и все до него
+                move = pending[data['seq']]
+                for seq in [seq for seq in pending if seq <= data['seq']]:
+                    del pending[seq]
+                if move['move'][0] != UpdateAction.FINISH_TURN:
+                    # хэш сервера - после этого хода; сверить можно, только если следующих у нас нет
+                    if not pending and view_hash(self.state, self._my_index) != data['checksum']:
+                        self._resync()
+                    return
+                # свое "бито" или "взять" мы отложили до ответа сервера - применяем как чужой ход
+            elif data['seq'] != self._seq + 1 or pending:
+                self._resync()
+                return
+            try:
+                ok = self._apply(decode_move(data['move']), data.get('drawn', []))
+            except (AssertionError, KeyError, ValueError, IndexError, TypeError):
+                ok = False
+            if not ok or view_hash(self.state, self._my_index) != data['checksum']:
+                self._resync()
+                return
+            self._seq = data['seq']
+            self._notify()
+
+    def _apply(self, action, drawn):
+        """
+        Применить ход с сервера, сначала разложив скрытые карты так, как они открылись
+        :param drawn: карты, которые мы берем из колоды этим ходом
+        """
+        g = self.state
+        opp = g.players[self._opp_index]
+        relabel = []
+
+        if action[0] == UpdateAction.FINISH_TURN:
+            # пробный ход показывает, с каких мест колоды мы возьмем карты
+            if not g.finish_turn():
+                return False
+            n_mine = sum(self.is_me(i) for i, _ in g.last_update['from_deck'])
+            first = next((k for k, (i, _) in enumerate(g.last_update['from_deck']) if self.is_me(i)), 0)
+            g.undo()
+            if len(drawn) != n_mine:
+                return False
+            for k, card in enumerate(map(tuple, drawn), first):
+                if g.deck[k] == card:
+                    continue
+                # в журнале ход не воспроизвести по прежней раскладке - нужно полное состояние
+                self._journal_snapshot = True
+                if card in g.deck:
+                    j = g.deck.index(card)
+                    g.deck[j], g.deck[k] = g.deck[k], card
+                elif card in opp.cards:
+                    opp.take_card(card)
+                    opp.add_card(g.deck[k])
+                    relabel.append((card, g.deck[k]))
+                    g.deck[k] = card
+                else:
+                    return False
+        else:
+            card = action[1] if action[0] == UpdateAction.ATTACK else action[2]
+            player = g.attacker_index if action[0] == UpdateAction.ATTACK else g.defending_player.index
+            if player == self._opp_index and card not in opp.cards:
+                # соперник открыл карту, которая по нашей раскладке лежит в колоде
+                if card not in g.deck[:-1]:
+                    return False
+                self._journal_snapshot = True
+                placeholder = opp.cards[-1]
+                opp.take_card(placeholder)
+                opp.add_card(card)
+                g.deck[g.deck.index(card)] = placeholder
+                relabel.append((placeholder, card))
+
+        if relabel or action[0] == UpdateAction.FINISH_TURN:
+            g._init_derived()
+        if not g.apply(action):
+            return False
+        if relabel:
+            g.last_update['relabel'] = relabel
+        return True
+
+    def _on_message(self, data):
+        action = data['action']
+        if action == 'move':
+            self._on_move(data)
+        elif action == 'view':
+            with self._lock:
+                before = self.state
+                self.state = from_view(data['state'], self._rng, hint=before)
+                opp_index = 1 - data['state']['index']
+                gone = [c for c in before.players[opp_index].cards if c not in self.state.players[opp_index].cards]
+                came = [c for c in self.state.players[opp_index].cards if c not in before.players[opp_index].cards]
+                if gone and came:
+                    self.state.last_update['relabel'] = list(zip(gone, came))
+                self._seq = data.get('seq', 0)
+                self._pending.clear()
+                self._notify()
+        elif action == 'joined':
+            with self._lock:
+                self._joined = True
+                self._binary = True
+                self._my_index = data['index']
+                self._opp_index = 1 - self._my_index
+        elif action == 'redirect':
+            self._server = (self._server[0], data['port'])
+            self._send_join()
+        elif action == 'quit':
+            self._running = False
+            self.on_opponent_quit()
+
+    def _retry_job(self):
+        while self._running:
+            self._wake.wait(self.RETRY)
+            with self._lock:
+                if not self._running:
+                    return
+                if not self._joined:
+                    self._send_join()
+                else:
+                    for move in list(self._pending.values()):
+                        self._send(move)
+
+    def start(self):
+        self._running = True
+        self._network.run_reader_thread(self._on_message)
+        threading.Thread(target=self._retry_job, daemon=True).start()
+        self._send_join()
+
+    def stop(self):
+        with self._lock:
+            if self._joined and self._running:
+                self._send({'action': 'quit'})
+            self._running = False
+        self._wake.set()
+        self._network.read_running = False
+
+    @property
+    def joined(self):
+        return self._joined
+
+    @property
+    def seq(self):
+        return self._seq
@@ -0,0 +1,83 @@
+"""
+Партия глазами одного игрока: своя рука, стол, козырь, вышедшие из игры карты
+и сколько карт у соперника и в колоде. Сервер партий отправляет каждому игроку только это,
+рука соперника и порядок колоды остаются на сервере.
+"""
+import random
+
+from .durak import DECK, CARD_INDEX, ZOBRIST
+from .serialization import DurakSerialized
+
+
+def out_of_game(state):
+    """
+    Карты, ушедшие в отбой: их видели оба игрока
+    """
+    present = {c for p in state.players for c in p.cards}
+    present.update(state.deck)
+    present.update(c for pair in state.field.items() for c in pair if c is not None)
+    return [c for c in DECK if c not in present]
+
+
+def view(state, index):
+    """
+    :param index: чьими глазами смотрим
+    :return: словарь для сообщения 'state'
+    """
+    return {'index': index, 'trump': state.trump, 'attacker_index': state.attacker_index,
+            'winner': state.winner, 'field': list(state.field.items()),
+            'cards': list(state.players[index].cards), 'opp_cards': state.players[1 - index].n_cards,
+            'deck': len(state.deck), 'out': out_of_game(state)}
+
+
+def view_hash(state, index):
+    """
+    Хэш того, что видит игрок index. Одинаков для настоящего состояния на сервере
+    и для состояния клиента, где скрытые карты разложены наугад
+    """
+    h = ZOBRIST.trump[CARD_INDEX[state.trump]] ^ ZOBRIST.attacker[state.attacker_index]
+    for c in state.players[index].cards:
+        h ^= ZOBRIST.hand[index][CARD_INDEX[c]]
+    # у соперника важно только число карт: ключ берем по числу вместо номера карты
+    h ^= ZOBRIST.hand[1 - index][state.players[1 - index].n_cards % len(DECK)]
+    for att, dfn in state.field.items():
+        h ^= ZOBRIST.field_attack[CARD_INDEX[att]]
+        if dfn is not None:
+            h ^= ZOBRIST.field_defend[CARD_INDEX[att]][CARD_INDEX[dfn]]
+    h ^= ZOBRIST.deck_size[len(state.deck)]
+    if state.winner is not None:
+        h ^= ZOBRIST.winner[state.winner]
+    return h
+
+
+def from_view(v, rng: random.Random = None, hint=None):
+    """
+    Полное состояние, совместимое с видом: невидимые карты случайно разложены
+    по руке соперника и колоде, козырь лежит на дне, пока колода не пуста
+
+    :param hint: прежнее состояние клиента; невидимые карты, уже лежавшие у соперника,
+                 по возможности остаются у него, чтобы не перекрашивать виджеты рубашек
+    """
+    rng = rng or random.Random()
+    index = v['index']
+    trump = tuple(v['trump'])
+    cards = list(map(tuple, v['cards']))
+    field = [(tuple(att), tuple(dfn) if dfn is not None else None) for att, dfn in v['field']]
+
+    visible = set(cards) | set(map(tuple, v['out'])) | {c for pair in field for c in pair if c is not None}
+    hidden = [c for c in DECK if c not in visible and (c != trump or not v['deck'])]
+    rng.shuffle(hidden)
+    if hint is not None:
+        held = set(hint.players[1 - index].cards)
+        # сортировка устойчива: карты из прежней руки соперника уходят в хвост, то есть к нему
+        hidden.sort(key=lambda c: c in held)
+    n_deck = v['deck'] - 1 if v['deck'] else 0
+    deck = hidden[:n_deck] + ([trump] if v['deck'] else [])
+    opp_cards = hidden[n_deck:]
+    if len(opp_cards) != v['opp_cards']:
+        raise ValueError(f"View does not add up: {len(opp_cards)} hidden cards for {v['opp_cards']}")
+
+    players = [{'index': index, 'cards': cards}, {'index': 1 - index, 'cards': opp_cards}]
+    return DurakSerialized({'trump': trump, 'attacker_index': v['attacker_index'], 'winner': v['winner'],
+                            'field': field, 'deck': deck, 'players': sorted(players, key=lambda p: p['index']),
+                            'last_update': {}})
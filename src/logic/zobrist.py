@@ -0,0 +1,89 @@
+"""
+Ключи Zobrist для состояний Durak и таблица транспозиций.
+
+Ключи порождаются фиксированным seed, поэтому хэш одного и того же состояния
+совпадает во всех процессах и на всех устройствах.
+"""
+import random
+
+ZOBRIST_SEED = 0xD06A4
+
+
+class ZobristKeys:
+    """
+    64-битные ключи по номеру карты (индекс в DECK)
+    """
+
+    def __init__(self, n_players, n_cards, seed=ZOBRIST_SEED):
+        rng = random.Random(seed)
+
+        def key():
+            return rng.getrandbits(64)
+
+        self.hand = [[key() for _ in range(n_cards)] for _ in range(n_players)]
+        self.field_attack = [key() for _ in range(n_cards)]
+        # пара на столе: какой картой (второй индекс) побита какая (первый индекс)
+        self.field_defend = [[key() for _ in range(n_cards)] for _ in range(n_cards)]
+        # карта на позиции колоды, считая от дна (позиция козыря - 0)
+        self.deck = [[key() for _ in range(n_cards)] for _ in range(n_cards)]
+        self.deck_size = [key() for _ in range(n_cards + 1)]
+        self.attacker = [key() for _ in range(n_players)]
+        self.trump = [key() for _ in range(n_cards)]
+        self.winner = [key() for _ in range(n_players)]
+
+
+class TranspositionTable:
+    """
+    Кэш оценок позиций фиксированного размера.
+    В каждой корзине два слота: один хранит запись с наибольшей глубиной (или из текущего поиска),
+    второй всегда перезаписывается.
+    """
+    EMPTY = None
+
+    def __init__(self, size_log2=16):
+        self.n_buckets = 1 << size_log2
+        self._mask = self.n_buckets - 1
+        # слот: [ключ, глубина, поколение, значение, ход]
+        self._deep = [self.EMPTY] * self.n_buckets
+        self._recent = [self.EMPTY] * self.n_buckets
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def new_search(self):
+        """
+        Записи прошлых поисков становятся первыми кандидатами на вытеснение
+        """
+        self.generation += 1
+
+    def get(self, key):
+        """
+        :return: (значение, глубина, ход) или None
+        """
+        i = key & self._mask
+        for slot in (self._deep[i], self._recent[i]):
+            if slot is not None and slot[0] == key:
+                self.hits += 1
+                return slot[3], slot[1], slot[4]
+        self.misses += 1
+        return None
+
+    def put(self, key, value, depth=0, move=None):
+        i = key & self._mask
+        entry = [key, depth, self.generation, value, move]
+        deep = self._deep[i]
+        if deep is None or deep[0] == key or depth >= deep[1] or deep[2] != self.generation:
+            if deep is not None and deep[0] != key:
+                self._recent[i] = deep
+            self._deep[i] = entry
+        else:
+            self._recent[i] = entry
+
+    def clear(self):
+        self._deep = [self.EMPTY] * self.n_buckets
+        self._recent = [self.EMPTY] * self.n_buckets
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return sum(s is not None for s in self._deep) + sum(s is not None for s in self._recent)
@@ -0,0 +1,164 @@
+"""
+Счетчики и гистограммы времени для горячих мест движка, сети и анимации.
+
+Включаются переменной окружения metrics=1 (до импорта модулей игры). Выключенные ничего
+не стоят: timed() возвращает функцию как есть, а места, где считаются байты,
+проверяют ENABLED. metrics_port=<порт> - отдавать метрики по http://127.0.0.1:<порт>/
+(текстом, или JSON по /json), metrics_file=<путь> - записать JSON при выходе.
+"""
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENABLED = bool(int(os.environ.get('metrics', 0)))
+
+# верхние границы корзин гистограммы в микросекундах: 1, 2, 4 ... ~67 с
+BUCKETS = [1 << i for i in range(27)]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, us):
+        # bit_length дает номер корзины без поиска: 2^(k-1) <= us < 2^k
+        self.counts[min(int(us).bit_length(), len(BUCKETS))] += 1
+        self.count += 1
+        self.total += us
+        if us > self.max:
+            self.max = us
+
+    def percentile(self, p):
+        """
+        :return: верхняя граница корзины, в которую попал p-й процентиль, мкс
+        """
+        if not self.count:
+            return None
+        rank = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+    def summary(self):
+        return {'count': self.count, 'mean_us': self.total / self.count if self.count else None,
+                'p50_us': self.percentile(50), 'p95_us': self.percentile(95), 'p99_us': self.percentile(99),
+                'max_us': self.max}
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, us):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(us)
+
+    def snapshot(self):
+        with self._lock:
+            return {'counters': dict(self.counters),
+                    'histograms': {name: h.summary() for name, h in self.histograms.items()}}
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def to_text(self):
+        """
+        По строке на значение: имя и число, как у Prometheus
+        """
+        snapshot = self.snapshot()
+        lines = [f'{name} {value}' for name, value in sorted(snapshot['counters'].items())]
+        for name, summary in sorted(snapshot['histograms'].items()):
+            lines += [f'{name}.{key} {value}' for key, value in summary.items() if value is not None]
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+REGISTRY = Registry()
+
+
+def count(name, n=1):
+    REGISTRY.count(name, n)
+
+
+def timed(name):
+    """
+    Декоратор: число вызовов и гистограмма их длительности под именем name.
+    При выключенных метриках функция остается без обертки
+    """
+    def decorator(f):
+        if not ENABLED:
+            return f
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter_ns()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                REGISTRY.observe(name, (time.perf_counter_ns() - t0) / 1000)
+
+        return wrapper
+
+    return decorator
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip('/') == '/json':
+            body, content_type = REGISTRY.to_json(), 'application/json'
+        else:
+            body, content_type = REGISTRY.to_text(), 'text/plain; charset=utf-8'
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *_):
+        pass
+
+
+def serve(port, host='127.0.0.1'):
+    """
+    Отдавать метрики по HTTP в фоновом потоке
+    :return: сервер; server.server_address[1] - занятый порт
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _dump(path):
+    with open(path, 'w') as f:
+        f.write(REGISTRY.to_json())
+
+
+if ENABLED:
+    if os.environ.get('metrics_port'):
+        serve(int(os.environ['metrics_port']))
+    if os.environ.get('metrics_file'):
+        atexit.register(_dump, os.environ['metrics_file'])
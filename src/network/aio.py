@@ -0,0 +1,178 @@
+"""
+Сетевой транспорт на asyncio (DatagramProtocol) с тем же интерфейсом, что у Networking.
+
+Чтение не требует отдельного потока на сокет: все сокеты процесса обслуживаются
+одним циклом событий - циклом Kivy, если приложение запущено через async_run,
+или общим фоновым циклом. Закрытие происходит сразу, без ожидания таймаута.
+"""
+import asyncio
+import json
+import logging
+import queue
+import threading
+
+from . import codec
+from .. import metrics
+from .network import JsonReceiver, Networking, broadcast_address
+
+_shared_loop = None
+_shared_loop_lock = threading.Lock()
+
+
+def event_loop():
+    """
+    Текущий цикл событий, если мы внутри него, иначе общий фоновый цикл процесса
+    """
+    global _shared_loop
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    with _shared_loop_lock:
+        if _shared_loop is None:
+            _shared_loop = asyncio.new_event_loop()
+            threading.Thread(target=_shared_loop.run_forever, daemon=True, name='aio-network').start()
+        return _shared_loop
+
+
+def _in_loop(loop):
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+class _Protocol(asyncio.DatagramProtocol):
+    def __init__(self, owner):
+        self.owner = owner
+
+    def datagram_received(self, data, addr):
+        self.owner._on_datagram(data, addr)
+
+    def error_received(self, exc):
+        logging.error(f'Datagram error: {exc!r}')
+
+
+class AsyncNetworking(JsonReceiver):
+    BUFF = Networking.BUFF
+
+    def __init__(self, port_no, broadcast=False, reuse=True, loop=None):
+        self.port_no = port_no
+        self._loop = loop or event_loop()
+        self._socket = Networking.get_socket(broadcast=broadcast, reuse=reuse)
+        self._socket.setblocking(False)
+        self._transport = None
+        self._callback = None
+        self._raw = False
+        self._queue = queue.Queue()
+        self._closed = False
+
+    def bind(self, to=""):
+        self._socket.bind((to, self.port_no))
+        self.port_no = self._socket.getsockname()[1]
+        self._open()
+
+    def _open(self):
+        if self._transport is not None or self._closed:
+            return
+
+        async def create():
+            transport, _ = await self._loop.create_datagram_endpoint(lambda: _Protocol(self), sock=self._socket)
+            if self._closed:
+                transport.close()
+            else:
+                self._transport = transport
+
+        if _in_loop(self._loop):
+            self._loop.create_task(create())
+        else:
+            asyncio.run_coroutine_threadsafe(create(), self._loop).result()
+
+    def _on_datagram(self, data, addr):
+        if metrics.ENABLED:
+            metrics.count('net.received_datagrams')
+            metrics.count('net.received_bytes', len(data))
+        if self._callback is None:
+            self._queue.put((data, addr))
+        elif self._raw:
+            self._callback(data, addr)
+        else:
+            try:
+                message = codec.loads(data)
+            except ValueError as e:
+                logging.error(f'Bad message: {e}')
+                return
+            if message:
+                self._callback(message)
+
+    @property
+    def loop(self):
+        """
+        Цикл событий, из которого вызываются callback; в нем же можно заводить таймеры
+        """
+        return self._loop
+
+    def run_reader_thread(self, callback, raw=False):
+        """
+        То же, что Networking.run_reader_thread, но без потока: callback вызывается из цикла событий
+        """
+        self._raw = raw
+        # время обработки каждой датаграммы на приеме, как у Networking
+        self._callback = metrics.timed('net.reader_callback')(callback)
+        self._open()
+
+    def recv_json(self, timeout=Networking.TIMEOUT):
+        """
+        Блокирующее чтение для кода вне цикла событий (например, потока поиска соперника)
+        """
+        self._open()
+        try:
+            data, addr = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None, None
+        try:
+            return codec.loads(data), addr
+        except ValueError as e:
+            logging.error(f'Bad message: {e}')
+            return None, None
+
+    @metrics.timed('net.send_bytes')
+    def send_bytes(self, data, to):
+        addr = to if isinstance(to, tuple) else (to, self.port_no)
+        if metrics.ENABLED:
+            metrics.count('net.sent_datagrams')
+            metrics.count('net.sent_bytes', len(data))
+        if self._transport is None:
+            return self._socket.sendto(data, addr)
+        if _in_loop(self._loop):
+            self._transport.sendto(data, addr)
+        else:
+            self._loop.call_soon_threadsafe(self._transport.sendto, data, addr)
+        return len(data)
+
+    def send_json(self, j, to):
+        return self.send_bytes(bytes(json.dumps(j), 'utf-8'), to)
+
+    def send_json_broadcast(self, j):
+        return self.send_json(j, broadcast_address())
+
+    @property
+    def read_running(self):
+        return not self._closed
+
+    @read_running.setter
+    def read_running(self, value):
+        if not value:
+            self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        transport = self._transport
+        if transport is None:
+            self._socket.close()
+        elif _in_loop(self._loop):
+            transport.close()
+        else:
+            self._loop.call_soon_threadsafe(transport.close)
@@ -0,0 +1,294 @@
+"""
+Компактный двоичный формат сообщений DurakNetGame.
+
+Заголовок: магический байт, версия, тип сообщения, crc32 полезной нагрузки.
+Карта кодируется одним байтом - своим индексом в DECK. JSON-сообщения
+начинаются с '{', поэтому loads() различает форматы по первому байту.
+"""
+import json
+import struct
+import zlib
+
+from .. import metrics
+from ..logic.durak import DECK, CARD_INDEX, UpdateAction
+
+MAGIC = 0xD7
+VERSION = 1
+
+HEADER = struct.Struct('>BBBI')
+
+T_STATE = 1
+T_MOVE = 2
+T_RESYNC = 3
+T_QUIT = 4
+# вид партии одного игрока и ход с картами, которые он взял из колоды (сервер партий)
+T_VIEW = 5
+T_MOVE_DRAWN = 6
+
+NO_CARD = 0xFF
+NO_PLAYER = 0xFF
+
+ACTION_CODES = {UpdateAction.ATTACK: 1, UpdateAction.DEFEND: 2, UpdateAction.FINISH_TURN: 3}
+ACTION_NAMES = {v: k for k, v in ACTION_CODES.items()}
+
+F_CLEAR_FIELD = 1
+F_TAKE_CARDS = 2
+F_TURN_CHANGE = 4
+F_WINNER = 8
+
+
+class CodecError(ValueError):
+    pass
+
+
+def _card(c):
+    return NO_CARD if c is None else CARD_INDEX[tuple(c)]
+
+
+def _cards(cards):
+    cards = [CARD_INDEX[tuple(c)] for c in cards]
+    return bytes([len(cards), *cards])
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def byte(self):
+        b = self.data[self.pos]
+        self.pos += 1
+        return b
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return values
+
+    def card(self):
+        b = self.byte()
+        return None if b == NO_CARD else DECK[b]
+
+    def cards(self):
+        n = self.byte()
+        cards = [DECK[b] for b in self.data[self.pos:self.pos + n]]
+        self.pos += n
+        return cards
+
+    def player(self):
+        b = self.byte()
+        return None if b == NO_PLAYER else b
+
+
+def _encode_update(up):
+    action = up.get('action')
+    if action is None:
+        return bytes([0])
+    out = bytearray([ACTION_CODES[action]])
+    if action == UpdateAction.ATTACK:
+        out += bytes([_card(up['card']), up['player']])
+    elif action == UpdateAction.DEFEND:
+        out += bytes([_card(up['attacking_card']), _card(up['defending_card']), up['player']])
+    else:
+        flags = ((F_CLEAR_FIELD if 'clear_field' in up else 0) | (F_TAKE_CARDS if 'take_cards' in up else 0) |
+                 (F_TURN_CHANGE if 'turn_change' in up else 0) | (F_WINNER if 'winner' in up else 0))
+        out.append(flags)
+        if 'take_cards' in up:
+            out.append(up['take_cards']['player'])
+            out += _cards(up['take_cards']['cards'])
+        from_deck = up.get('from_deck', [])
+        out.append(len(from_deck))
+        for player, card in from_deck:
+            out += bytes([player, _card(card)])
+        if 'turn_change' in up:
+            out.append(up['turn_change'])
+        if 'winner' in up:
+            out.append(up['winner'])
+    return bytes(out)
+
+
+def _decode_update(r: _Reader):
+    code = r.byte()
+    if code == 0:
+        return {}
+    action = ACTION_NAMES[code]
+    up = {'action': action}
+    if action == UpdateAction.ATTACK:
+        up['card'] = r.card()
+        up['player'] = r.byte()
+    elif action == UpdateAction.DEFEND:
+        up['attacking_card'] = r.card()
+        up['defending_card'] = r.card()
+        up['player'] = r.byte()
+    else:
+        flags = r.byte()
+        if flags & F_CLEAR_FIELD:
+            up['clear_field'] = True
+        if flags & F_TAKE_CARDS:
+            player = r.byte()
+            up['take_cards'] = {'cards': r.cards(), 'player': player}
+        up['from_deck'] = [(r.byte(), r.card()) for _ in range(r.byte())]
+        if flags & F_TURN_CHANGE:
+            up['turn_change'] = r.byte()
+        if flags & F_WINNER:
+            up['winner'] = r.byte()
+    return up
+
+
+def encode_state(state: dict):
+    """
+    Полезная нагрузка для DurakSerialized.serialized()
+    """
+    winner = state['winner']
+    out = bytearray([_card(state['trump']), state['attacker_index'], NO_PLAYER if winner is None else winner])
+    out += _cards(state['deck'])
+    out.append(len(state['players']))
+    for p in state['players']:
+        out.append(p['index'])
+        out += _cards(p['cards'])
+    out.append(len(state['field']))
+    for att, dfn in state['field']:
+        out += bytes([_card(att), _card(dfn)])
+    out += _encode_update(state['last_update'])
+    return bytes(out)
+
+
+def decode_state(r: _Reader):
+    trump = r.card()
+    attacker_index = r.byte()
+    winner = r.player()
+    deck = r.cards()
+    players = []
+    for _ in range(r.byte()):
+        index = r.byte()
+        players.append({'index': index, 'cards': r.cards()})
+    field = [(r.card(), r.card()) for _ in range(r.byte())]
+    return {'trump': trump, 'attacker_index': attacker_index, 'deck': deck, 'winner': winner,
+            'field': field, 'players': players, 'last_update': _decode_update(r)}
+
+
+def encode_view(view: dict):
+    """
+    Полезная нагрузка для logic.view.view()
+    """
+    winner = view['winner']
+    out = bytearray([_card(view['trump']), view['attacker_index'], NO_PLAYER if winner is None else winner,
+                     view['index'], view['opp_cards'], view['deck']])
+    out += _cards(view['cards'])
+    out.append(len(view['field']))
+    for att, dfn in view['field']:
+        out += bytes([_card(att), _card(dfn)])
+    out += _cards(view['out'])
+    return bytes(out)
+
+
+def decode_view(r: _Reader):
+    trump = r.card()
+    attacker_index = r.byte()
+    winner = r.player()
+    index, opp_cards, deck = r.byte(), r.byte(), r.byte()
+    cards = r.cards()
+    field = [(r.card(), r.card()) for _ in range(r.byte())]
+    return {'index': index, 'trump': trump, 'attacker_index': attacker_index, 'winner': winner, 'field': field,
+            'cards': cards, 'opp_cards': opp_cards, 'deck': deck, 'out': r.cards()}
+
+
+def encode_action(action):
+    """
+    Ход в формате Durak.legal_actions() (или encode_move) в байтах: код действия и индексы карт
+    """
+    return bytes([ACTION_CODES[action[0]], *map(_card, action[1:])])
+
+
+def decode_action(data: bytes):
+    """
+    :return: ход в формате Durak.legal_actions()
+    """
+    try:
+        return (ACTION_NAMES[data[0]], *(DECK[b] for b in data[1:]))
+    except (IndexError, KeyError) as e:
+        raise CodecError(f'Malformed action: {e!r}')
+
+
+def encode(j: dict):
+    """
+    Сообщение DurakNetGame в двоичном виде
+    """
+    action = j['action']
+    if action == 'state':
+        msg_type, payload = T_STATE, struct.pack('>I', j.get('seq', 0)) + encode_state(j['state'])
+    elif action == 'view':
+        msg_type, payload = T_VIEW, struct.pack('>I', j.get('seq', 0)) + encode_view(j['state'])
+    elif action == 'move':
+        move = j['move']
+        payload = struct.pack('>IQ', j['seq'], j['checksum'])
+        if 'drawn' in j:
+            msg_type, payload = T_MOVE_DRAWN, payload + _cards(j['drawn']) + encode_action(move)
+        else:
+            msg_type, payload = T_MOVE, payload + encode_action(move)
+    elif action == 'resync':
+        msg_type, payload = T_RESYNC, b''
+    elif action == 'quit':
+        msg_type, payload = T_QUIT, b''
+    else:
+        raise CodecError(f'No binary form for {action!r}')
+    return HEADER.pack(MAGIC, VERSION, msg_type, zlib.crc32(payload)) + payload
+
+
+def decode(data: bytes):
+    if len(data) < HEADER.size:
+        raise CodecError('Message is too short')
+    magic, version, msg_type, crc = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise CodecError(f'Unsupported message format {magic:#x} v{version}')
+    payload = data[HEADER.size:]
+    if zlib.crc32(payload) != crc:
+        raise CodecError('Checksum mismatch')
+
+    r = _Reader(payload)
+    try:
+        if msg_type == T_STATE:
+            seq, = r.unpack('>I')
+            return {'action': 'state', 'seq': seq, 'state': decode_state(r)}
+        elif msg_type == T_VIEW:
+            seq, = r.unpack('>I')
+            return {'action': 'view', 'seq': seq, 'state': decode_view(r)}
+        elif msg_type in (T_MOVE, T_MOVE_DRAWN):
+            seq, checksum = r.unpack('>IQ')
+            message = {'action': 'move', 'seq': seq, 'checksum': checksum}
+            if msg_type == T_MOVE_DRAWN:
+                message['drawn'] = r.cards()
+            kind, *cards = decode_action(payload[r.pos:])
+            message['move'] = [kind, *map(list, cards)]
+            return message
+        elif msg_type == T_RESYNC:
+            return {'action': 'resync'}
+        elif msg_type == T_QUIT:
+            return {'action': 'quit'}
+    except (IndexError, KeyError, struct.error) as e:
+        raise CodecError(f'Malformed message: {e!r}')
+    raise CodecError(f'Unknown message type {msg_type}')
+
+
+def is_binary(data: bytes):
+    return bool(data) and data[0] == MAGIC
+
+
+@metrics.timed('codec.loads')
+def loads(data: bytes):
+    """
+    Разобрать сообщение в любом из форматов
+    """
+    if is_binary(data):
+        return decode(data)
+    return json.loads(data.decode('utf-8', errors='ignore'))
+
+
+@metrics.timed('codec.dumps')
+def dumps(j: dict, binary=False):
+    """
+    Сообщение в двоичном виде, если binary и у него есть двоичная форма, иначе JSON
+    """
+    if binary and j.get('action') in ('state', 'view', 'move', 'resync', 'quit'):
+        return encode(j)
+    return bytes(json.dumps(j), 'utf-8')
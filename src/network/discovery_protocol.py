@@ -1,47 +1,183 @@
 import random
 import logging
 import threading
+import time
 
 from src.network import network
 
 
+class PeerCache:
+    """
+    Недавно замеченные соседи: pid -> (адрес, когда видели). После партии с ними можно
+    снова связаться напрямую, не дожидаясь широковещательной рассылки
+    """
+
+    def __init__(self, ttl=60.0):
+        self.ttl = ttl
+        self._peers = {}
+        self._lock = threading.Lock()
+
+    def seen(self, pid, addr):
+        with self._lock:
+            self._peers[pid] = (addr, time.monotonic())
+
+    def recent(self):
+        """
+        :return: [(pid, адрес)] начиная с последних замеченных
+        """
+        now = time.monotonic()
+        with self._lock:
+            for pid in [pid for pid, (_, t) in self._peers.items() if now - t > self.ttl]:
+                del self._peers[pid]
+            return [(pid, addr) for pid, (addr, _) in sorted(self._peers.items(), key=lambda kv: -kv[1][1])]
+
+    def __len__(self):
+        return len(self._peers)
+
+
+PEER_CACHE = PeerCache()
+
+
 class DiscoveryProtocol:
+    """
+    Поиск соперника в локальной сети. Рассылка 'discovery' идет с экспоненциально растущим
+    интервалом со случайным разбросом. Чтобы два соседа, нашедшие друг друга одновременно,
+    не разобрались в разные пары, предложение (stop_scan) делает только игрок с меньшим pid,
+    а пара считается сложившейся после ответного 'accept'
+    """
+
     A_DISCOVERY = 'discovery'
     A_STOP_SCAN = 'stop_scan'
+    A_ACCEPT = 'accept'
+
+    INTERVAL_MIN = 0.25
+    INTERVAL_MAX = 5.0
+    JITTER = 0.5
+
+    # сколько ждать 'accept' на предложение
+    OFFER_TIMEOUT = 0.3
+
+    # сосед с меньшим pid, которого слышали не раньше этого, еще может сделать нам предложение
+    LOWER_ACTIVE = 2.0
 
-    def __init__(self, pid, port_no):
+    def __init__(self, pid, port_no=None, net=None, peers: PeerCache = None, rng: random.Random = None):
+        """
+        :param net: готовый канал (например, служебная сессия mux.Multiplexer) вместо своего сокета на port_no
+        :param peers: кэш соседей, по умолчанию общий на процесс
+        """
         assert pid
         self._my_pid = pid
-        self._network = network.Networking(port_no, broadcast=True)
-        self._network.bind()
+        if net is None:
+            net = network.Networking(port_no, broadcast=True)
+            net.bind()
+        self._network = net
+        self._peers = PEER_CACHE if peers is None else peers
+        self._rng = rng or random.Random()
+
+    def _message(self, action, data=None):
+        return {'action': action, 'sender': self._my_pid, **(data or {})}
 
     def _send_action(self, action, data=None):
-        data = data or {}
-        self._network.send_json_broadcast({'action': action, 'sender': self._my_pid, **data})
+        self._network.send_json_broadcast(self._message(action, data))
+
+    def _send_to(self, addr, action, data=None):
+        self._network.send_json(self._message(action, data), addr)
 
     def _is_message_for_me(self, d):
-        return d and d.get('action') in [self.A_DISCOVERY, self.A_STOP_SCAN] and d.get('sender') != self._my_pid
+        return (d and d.get('action') in [self.A_DISCOVERY, self.A_STOP_SCAN, self.A_ACCEPT]
+                and d.get('sender') != self._my_pid)
+
+    def _next_interval(self, interval):
+        return interval * self._rng.uniform(1 - self.JITTER, 1 + self.JITTER)
+
+    def run(self, timeout=None):
+        """
+        :param timeout: сколько искать; None - пока не найдем
+        :return: (адрес соперника, его pid) или (None, None) по таймауту
+        """
+        t0 = time.monotonic()
+
+        # сначала напрямую зовем тех, с кем недавно играли
+        for _, addr in self._peers.recent():
+            self._send_to(addr, self.A_DISCOVERY)
+
+        interval = self.INTERVAL_MIN
+        next_broadcast = t0
+
+        # соседи с большим pid, которым можно сделать предложение: pid -> [адрес, когда слышали, когда предлагали];
+        # и с меньшим, которые могут сделать предложение нам: pid -> когда слышали
+        candidates = {}
+        lower = {}
+
+        # поиск идет кругами по OFFER_TIMEOUT: в каждом круге либо делаем одно предложение,
+        # либо ждем чужих. Если нам могут предложить, ждем с вероятностью 1/2, иначе при толпе
+        # все только предлагали бы и никто не соглашался
+        offer = None
+        round_end = t0
+        offered = set()
 
-    def run(self):
         while True:
-            logging.info('Scanning...')
-            self._send_action(self.A_DISCOVERY)
+            now = time.monotonic()
+            if timeout is not None and now - t0 > timeout:
+                return None, None
+
+            if now >= next_broadcast:
+                logging.info('Scanning...')
+                self._send_action(self.A_DISCOVERY)
+                next_broadcast = now + self._next_interval(interval)
+                interval = min(self.INTERVAL_MAX, interval * 2)
+
+            if now >= round_end:
+                offer = None
+                # предлагаем тому, кого слышали последним, и только если он подавал голос после прошлого
+                # предложения: кто молчит, скорее всего, уже играет
+                fresh = [(c[1], pid) for pid, c in candidates.items() if c[1] > c[2]]
+                may_be_offered = any(now - t < self.LOWER_ACTIVE for t in lower.values())
+                if fresh and not (may_be_offered and self._rng.random() < 0.5):
+                    offer = max(fresh)[1]
+                    offered.add(offer)
+                    candidates[offer][2] = now
+                    self._send_to(candidates[offer][0], self.A_STOP_SCAN, {'to_pid': offer})
+                round_end = now + self.OFFER_TIMEOUT
+
+            wait = min(next_broadcast, round_end) - now
+            data, addr = self._network.recv_json_until(self._is_message_for_me, timeout=max(wait, 0.001))
+            if not data:
+                continue
 
-            data, addr = self._network.recv_json_until(self._is_message_for_me, timeout=5.0)
+            action, sender = data['action'], data['sender']
+            self._peers.seen(sender, addr)
 
-            if data:
-                action, sender = data['action'], data['sender']
-                if action == self.A_DISCOVERY:
-                    self._send_action(self.A_STOP_SCAN, {'to_pid': sender})
-                elif action == self.A_STOP_SCAN:
-                    if data['to_pid'] != self._my_pid:
-                        continue
-                return addr, sender
+            if action == self.A_DISCOVERY:
+                if sender > self._my_pid:
+                    candidates.setdefault(sender, [addr, 0.0, -1.0])[:2] = addr, now
+                    if offer is None and not lower:
+                        # ждать чужих предложений незачем - начинаем круг сразу
+                        round_end = now
+                else:
+                    lower[sender] = now
+                    # предлагать будет сосед; отвечаем напрямую, чтобы он узнал о нас, не дожидаясь рассылки
+                    self._send_to(addr, self.A_DISCOVERY)
+            elif data.get('to_pid') != self._my_pid:
+                continue
+            elif action == self.A_STOP_SCAN:
+                lower[sender] = now
+                # пока ждем ответа на свое предложение, чужие не принимаем: соседу придется искать дальше
+                if offer is None and sender < self._my_pid:
+                    # второй раз - на случай потери: без ответа сосед не узнает, что пара сложилась
+                    for _ in range(2):
+                        self._send_to(addr, self.A_ACCEPT, {'to_pid': sender})
+                    return addr, sender
+            elif action == self.A_ACCEPT:
+                # согласившийся уже считает пару сложившейся, поэтому принимаем и запоздавший ответ
+                if sender in offered:
+                    return addr, sender
 
-    def run_in_background(self, callback: callable):
+    def run_in_background(self, callback: callable, timeout=None):
         def await_with_callback():
-            results = self.run()
-            callback(*results)
+            addr, peer = self.run(timeout)
+            if peer is not None:
+                callback(addr, peer)
 
         threading.Thread(target=await_with_callback, daemon=True).start()
 
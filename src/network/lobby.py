@@ -0,0 +1,367 @@
+"""
+Лобби: один узел сети (выбранный клиент или сервер без GUI) держит очередь ожидающих игроков
+и сам раздает им пары. Клиенты не рассылают 'discovery' друг другу: они слушают
+редкие объявления брокера и повторяют ему 'lobby_join', пока ждут пару: кто перестал
+повторять, через несколько интервалов выпадает из очереди. Уходя, клиент шлет 'lobby_leave'.
+"""
+import collections
+import logging
+import random
+import threading
+import time
+
+from . import codec
+from .network import Networking
+
+A_ANNOUNCE = 'lobby'
+A_JOIN = 'lobby_join'
+A_MATCH = 'lobby_match'
+A_LEAVE = 'lobby_leave'
+
+
+class Lobby:
+    """
+    Очередь ожидающих игроков. Пара собирается за O(1): первый в очереди достается новому игроку.
+    Игрок, не повторявший join дольше ttl, считается ушедшим
+    """
+
+    def __init__(self, ttl=None):
+        """
+        :param ttl: секунды без join до выпадения из очереди, None - ждать вечно
+        """
+        self.ttl = ttl
+        self._queue = collections.deque()
+        # pid -> (адрес, когда последний раз слышали); кто ушел из очереди, удаляется отсюда,
+        # а из _queue - когда до него дойдет очередь
+        self._waiting = {}
+
+    def _stale(self, seen, now):
+        return self.ttl is not None and now - seen > self.ttl
+
+    def join(self, pid, addr, now=None):
+        """
+        :param now: время по time.monotonic()
+        :return: (pid, адрес) соперника или None, если игрок встал в очередь
+        """
+        now = time.monotonic() if now is None else now
+        if pid in self._waiting:
+            self._waiting[pid] = (addr, now)
+            return None
+        while self._queue:
+            other = self._queue.popleft()
+            if other not in self._waiting:
+                continue
+            other_addr, seen = self._waiting.pop(other)
+            if not self._stale(seen, now):
+                return other, other_addr
+        self._waiting[pid] = (addr, now)
+        self._queue.append(pid)
+        return None
+
+    def leave(self, pid):
+        self._waiting.pop(pid, None)
+
+    def expire(self, now=None):
+        """
+        Забыть игроков, не повторявших join дольше ttl
+        :return: сколько их было
+        """
+        now = time.monotonic() if now is None else now
+        stale = [pid for pid, (_, seen) in self._waiting.items() if self._stale(seen, now)]
+        for pid in stale:
+            del self._waiting[pid]
+        if len(self._queue) > 2 * len(self._waiting):
+            # в очереди копятся ушедшие: перестраиваем ее, сохраняя порядок
+            queued = set()
+            self._queue = collections.deque(pid for pid in self._queue
+                                            if pid in self._waiting and not (pid in queued or queued.add(pid)))
+        return len(stale)
+
+    def __len__(self):
+        return len(self._waiting)
+
+
+class BroadcastGroup:
+    """
+    Широковещательная рассылка сразу на несколько портов - для брокера без своего mux.Multiplexer
+    """
+
+    def __init__(self, ports, broadcast_addr=None):
+        self._networks = [Networking(port, broadcast=True) for port in ports]
+        self._broadcast_addr = broadcast_addr
+
+    def send_json_broadcast(self, j):
+        for network in self._networks:
+            if self._broadcast_addr:
+                network.send_json(j, self._broadcast_addr)
+            else:
+                network.send_json_broadcast(j)
+
+
+class LobbyBroker:
+    """
+    Брокер лобби. Раз в ANNOUNCE_INTERVAL объявляет о себе широковещательно, 'lobby_join'
+    принимает на своем сокете и отвечает обоим игрокам пары 'lobby_match'
+    """
+
+    ANNOUNCE_INTERVAL = 1.0
+
+    # сколько и как долго помнить выданные пары, чтобы повторить ответ на повторный 'lobby_join'
+    ASSIGNED_MAX = 4096
+    ASSIGNED_TTL = 5.0
+
+    # клиент повторяет 'lobby_join' каждые LobbyClient.JOIN_RETRY; без повтора за несколько
+    # таких интервалов он выпадает из очереди
+    WAITING_TTL = 2.0
+
+    def __init__(self, pid, announce_net, network_cls=Networking, port=0):
+        """
+        :param announce_net: канал с send_json_broadcast для объявлений (служебная сессия mux.Multiplexer)
+        :param port: порт для 'lobby_join', 0 - любой свободный
+        """
+        self.pid = pid
+        self.lobby = Lobby(ttl=self.WAITING_TTL)
+        self._announce_net = announce_net
+        self._network = network_cls(port)
+        self._network.bind("")
+        self.port = self._network.port_no
+
+        self._lock = threading.Lock()
+        self._assigned = collections.OrderedDict()
+        self._local = {}
+        self._running = False
+        self._wake = threading.Event()
+
+        self.matches = 0
+
+    def _send(self, j, addr):
+        self._network.send_bytes(codec.dumps(j), addr)
+
+    def _assign(self, pid, addr, peer, peer_addr):
+        message = {'action': A_MATCH, 'sender': self.pid, 'to_pid': pid, 'peer': peer, 'peer_addr': peer_addr}
+        self._assigned[pid] = (time.monotonic(), message)
+        while len(self._assigned) > self.ASSIGNED_MAX:
+            self._assigned.popitem(last=False)
+        if pid in self._local:
+            # peer_addr без адреса - значит, соперник на этом же узле
+            self._local.pop(pid)(peer, peer_addr)
+        else:
+            self._send(message, addr)
+
+    def _join(self, pid, addr, game_addr):
+        """
+        :param addr: куда отвечать; None - клиент на этом узле
+        :param game_addr: [адрес, порт] для игры; адрес None - этот узел
+        """
+        with self._lock:
+            if pid in self._assigned:
+                assigned_at, message = self._assigned.pop(pid)
+                if time.monotonic() - assigned_at < self.ASSIGNED_TTL:
+                    self._assigned[pid] = assigned_at, message
+                    if addr is not None:
+                        self._send(message, addr)
+                    return
+            found = self.lobby.join(pid, (addr, game_addr))
+            if found is None:
+                return
+            peer, (peer_addr, peer_game_addr) = found
+            self.matches += 1
+            self._assign(pid, addr, peer, peer_game_addr)
+            self._assign(peer, peer_addr, pid, game_addr)
+
+    def join_local(self, pid, game_port, callback):
+        """
+        Встать в очередь клиенту на этом же узле
+        :param callback: callback(pid соперника, [адрес, порт]) при появлении пары
+        """
+        with self._lock:
+            self._local[pid] = callback
+        self._join(pid, None, [None, game_port])
+
+    def leave(self, pid):
+        """
+        Убрать игрока из очереди: он перестал искать соперника
+        """
+        with self._lock:
+            self.lobby.leave(pid)
+            self._local.pop(pid, None)
+
+    def _on_datagram(self, data, addr):
+        if not self._running:
+            return
+        try:
+            j = codec.loads(data)
+        except ValueError:
+            return
+        if j.get('action') == A_JOIN and j.get('sender'):
+            self._join(j['sender'], addr, [addr[0], j.get('port', addr[1])])
+        elif j.get('action') == A_LEAVE and j.get('sender'):
+            self.leave(j['sender'])
+
+    def _announce_job(self):
+        while self._running:
+            with self._lock:
+                self.lobby.expire()
+            self._announce_net.send_json_broadcast({'action': A_ANNOUNCE, 'sender': self.pid, 'port': self.port,
+                                                    'waiting': len(self.lobby)})
+            self._wake.wait(self.ANNOUNCE_INTERVAL)
+
+    def start(self):
+        self._running = True
+        self._network.run_reader_thread(self._on_datagram, raw=True)
+        threading.Thread(target=self._announce_job, daemon=True).start()
+        logging.info(f'Lobby broker {self.pid} on port {self.port}')
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        self._network.read_running = False
+
+
+# pid клиента -> брокер, которого он держит. Брокер переживает клиента: после партии
+# тот же игрок начнет новый поиск и снова встанет к своему брокеру
+_hosted = {}
+_hosted_lock = threading.Lock()
+
+
+def hosted_broker(pid):
+    return _hosted.get(pid)
+
+
+class LobbyClient:
+    """
+    Поиск соперника через лобби; тот же интерфейс, что у DiscoveryProtocol.
+    Если за ELECT_WAIT не слышно ни одного брокера, клиент сам становится брокером.
+    Из нескольких брокеров главный - с меньшим pid, остальные закрываются.
+    По таймауту или stop() клиент уходит из очереди
+    """
+
+    ELECT_WAIT = 1.5
+    JOIN_RETRY = 0.5
+    BROKER_TIMEOUT = 3.5
+
+    def __init__(self, pid, net, rng: random.Random = None, network_cls=Networking):
+        """
+        :param net: служебная сессия mux.Multiplexer, на которую приходят объявления
+        """
+        assert pid
+        self._my_pid = pid
+        self._network = net
+        self._rng = rng or random.Random()
+        self._network_cls = network_cls
+        self._stopped = threading.Event()
+
+    def _is_message_for_me(self, d):
+        return d and (d.get('action') == A_ANNOUNCE or
+                      d.get('action') == A_MATCH and d.get('to_pid') == self._my_pid)
+
+    def _join_hosted(self, on_match):
+        """
+        Встать в очередь к брокеру этого процесса, при необходимости запустив его
+        """
+        with _hosted_lock:
+            broker = _hosted.get(self._my_pid)
+            if broker is None:
+                broker = _hosted[self._my_pid] = LobbyBroker(self._my_pid, self._network, self._network_cls)
+                broker.start()
+        broker.join_local(self._my_pid, self._network.port_no, on_match)
+
+    def _leave(self, current):
+        """
+        Уйти из очереди брокера current; если сообщение потеряется, брокер забудет нас сам
+        """
+        if current is None:
+            return
+        if current[0] == self._my_pid:
+            broker = hosted_broker(self._my_pid)
+            if broker is not None:
+                broker.leave(self._my_pid)
+        else:
+            self._network.send_json({'action': A_LEAVE, 'sender': self._my_pid}, current[1])
+
+    def stop(self):
+        """
+        Прекратить поиск: run() вернет (None, None)
+        """
+        self._stopped.set()
+
+    def _stop_hosted(self):
+        with _hosted_lock:
+            broker = _hosted.pop(self._my_pid, None)
+        if broker is not None:
+            broker.stop()
+
+    def run(self, timeout=None):
+        """
+        :return: (адрес соперника, его pid) или (None, None) по таймауту
+        """
+        t0 = time.monotonic()
+        elect_at = t0 + self.ELECT_WAIT * self._rng.uniform(1, 1.5)
+        # pid, адрес и когда слышали брокера, к которому стоим в очереди
+        current = None
+        next_join = t0
+        local_match = []
+
+        def on_match(peer, addr):
+            local_match.append((peer, addr))
+
+        if hosted_broker(self._my_pid) is not None:
+            # брокер остался с прошлого поиска
+            current = (self._my_pid, None, t0)
+            self._join_hosted(on_match)
+
+        while True:
+            now = time.monotonic()
+            if timeout is not None and now - t0 > timeout or self._stopped.is_set():
+                self._leave(current)
+                return None, None
+
+            if local_match:
+                peer, peer_addr = local_match[0]
+                return tuple(peer_addr), peer
+
+            if current is not None and current[0] != self._my_pid and now - current[2] > self.BROKER_TIMEOUT:
+                logging.info(f'Lobby broker {current[0]} is gone')
+                current = None
+                elect_at = now + self.ELECT_WAIT * self._rng.uniform(0, 0.5)
+
+            if current is None and now >= elect_at:
+                current = (self._my_pid, None, now)
+                self._join_hosted(on_match)
+
+            if current is not None and now >= next_join:
+                # повторный join - знак брокеру, что мы еще ждем
+                if current[0] == self._my_pid:
+                    self._join_hosted(on_match)
+                else:
+                    self._network.send_json({'action': A_JOIN, 'sender': self._my_pid,
+                                             'port': self._network.port_no}, current[1])
+                next_join = now + self.JOIN_RETRY
+
+            wait = min(elect_at if current is None else next_join, now + 0.1) - now
+            data, addr = self._network.recv_json_until(self._is_message_for_me, timeout=max(wait, 0.001))
+            if not data:
+                continue
+
+            if data['action'] == A_ANNOUNCE:
+                pid = data['sender']
+                if pid == self._my_pid:
+                    continue
+                if current is None or pid <= current[0]:
+                    if current is None or pid < current[0]:
+                        next_join = now
+                    current = (pid, (addr[0], data['port']), now)
+                    if pid < self._my_pid:
+                        # есть брокер главнее - наш больше не нужен
+                        self._stop_hosted()
+            elif data['action'] == A_MATCH:
+                ip, port = data['peer_addr']
+                return (ip or addr[0], port), data['peer']
+
+    def run_in_background(self, callback: callable, timeout=None):
+        def await_with_callback():
+            addr, peer = self.run(timeout)
+            if peer is not None:
+                callback(addr, peer)
+
+        threading.Thread(target=await_with_callback, daemon=True).start()
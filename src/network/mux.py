@@ -0,0 +1,193 @@
+"""
+Один UDP-сокет на клиента для поиска соперника, игры и служебных сообщений.
+
+Датаграммы игровых сессий начинаются с заголовка: магический байт и номер сессии.
+Сессия 0 - поиск соперника и прочие служебные сообщения, она идет без заголовка,
+поэтому совместима со старыми клиентами. Номер игровой сессии вычисляется из pid
+обоих игроков, так что договариваться о нем не нужно.
+"""
+import hashlib
+import json
+import logging
+import queue
+import struct
+import threading
+import time
+
+from . import codec
+from .network import JsonReceiver, Networking, broadcast_address
+
+MAGIC = 0xD9
+
+HEADER = struct.Struct('>BQ')
+
+CONTROL = 0
+
+# сообщения сессии, которые ждут чтения дольше этого, считаются устаревшими
+STALE_AFTER = 5.0
+
+
+def session_id(pid1, pid2):
+    """
+    Номер игровой сессии двух игроков, одинаковый с обеих сторон
+    """
+    lo, hi = sorted((int(pid1), int(pid2)))
+    digest = hashlib.blake2b(struct.pack('>QQ', lo, hi), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') or 1
+
+
+class Session(JsonReceiver):
+    """
+    Канал одной сессии. Повторяет интерфейс Networking, поэтому подходит для ReliableChannel
+    """
+
+    def __init__(self, mux, sid):
+        self._mux = mux
+        self.session_id = sid
+        self.port_no = mux.port_no
+        self._callback = None
+        self._raw = False
+        self._queue = queue.Queue()
+        self._closed = False
+
+    def _on_payload(self, data, addr):
+        if self._callback is None:
+            self._queue.put((time.monotonic(), data, addr))
+        elif self._raw:
+            self._callback(data, addr)
+        else:
+            try:
+                message = codec.loads(data)
+            except ValueError as e:
+                logging.error(f'Bad message: {e}')
+                return
+            if message:
+                self._callback(message)
+
+    def bind(self, to=""):
+        # сокет уже привязан мультиплексором
+        pass
+
+    @property
+    def loop(self):
+        """
+        Цикл событий мультиплексора на aio.AsyncNetworking, иначе None
+        """
+        return getattr(self._mux._network, 'loop', None)
+
+    def run_reader_thread(self, callback, raw=False):
+        """
+        Отдельный поток не нужен: сообщения раздает поток чтения мультиплексора
+        """
+        self._raw = raw
+        self._callback = callback
+
+    def recv_json(self, timeout=Networking.TIMEOUT):
+        t0 = time.monotonic()
+        while (left := t0 + timeout - time.monotonic()) > 0:
+            try:
+                received, data, addr = self._queue.get(timeout=left)
+            except queue.Empty:
+                break
+            if time.monotonic() - received > STALE_AFTER:
+                continue
+            try:
+                return codec.loads(data), addr
+            except ValueError as e:
+                logging.error(f'Bad message: {e}')
+        return None, None
+
+    def send_bytes(self, data, to):
+        return self._mux.send(self.session_id, data, to)
+
+    def send_json(self, j, to):
+        return self.send_bytes(bytes(json.dumps(j), 'utf-8'), to)
+
+    def send_json_broadcast(self, j):
+        address = self._mux.broadcast_addr or broadcast_address()
+        for port in self._mux.ports:
+            self.send_json(j, (address, port))
+
+    @property
+    def read_running(self):
+        return not self._closed
+
+    @read_running.setter
+    def read_running(self, value):
+        if not value:
+            self.close()
+
+    def close(self):
+        self._closed = True
+        self._mux.drop_session(self.session_id)
+
+
+class Multiplexer:
+    def __init__(self, ports, network_cls=Networking, host="", broadcast_addr=None):
+        """
+        :param ports: порты по порядку предпочтения. Занимаем первый свободный, а широковещательные
+        сообщения шлем на все - так на одной машине могут работать несколько клиентов
+        :param network_cls: Networking или aio.AsyncNetworking
+        :param broadcast_addr: куда слать широковещательные сообщения, по умолчанию '<broadcast>'
+        """
+        self.ports = tuple(ports)
+        self.broadcast_addr = broadcast_addr
+        self._network = None
+        for port in self.ports:
+            network = network_cls(port, broadcast=True, reuse=False)
+            try:
+                network.bind(host)
+            except OSError:
+                network.close()
+                continue
+            self._network = network
+            break
+        if self._network is None:
+            raise OSError(f'All ports are busy: {self.ports}')
+        self.port_no = self._network.port_no
+
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self.sent = 0
+        self.received = 0
+        self.unrouted = 0
+
+        self.session(CONTROL)
+        self._network.run_reader_thread(self._on_datagram, raw=True)
+
+    def session(self, sid):
+        with self._lock:
+            if sid not in self._sessions:
+                self._sessions[sid] = Session(self, sid)
+            return self._sessions[sid]
+
+    def drop_session(self, sid):
+        if sid != CONTROL:
+            with self._lock:
+                self._sessions.pop(sid, None)
+
+    def send(self, sid, data, to):
+        frame = data if sid == CONTROL else HEADER.pack(MAGIC, sid) + data
+        self.sent += 1
+        return self._network.send_bytes(frame, to)
+
+    def _on_datagram(self, data, addr):
+        self.received += 1
+        if not data:
+            # пустая датаграмма никому не адресована
+            self.unrouted += 1
+            return
+        if len(data) >= HEADER.size and data[0] == MAGIC:
+            _, sid = HEADER.unpack_from(data)
+            data = data[HEADER.size:]
+        else:
+            sid = CONTROL
+        with self._lock:
+            session = self._sessions.get(sid)
+        if session is None:
+            self.unrouted += 1
+            return
+        session._on_payload(data, addr)
+
+    def close(self):
+        self._network.close()
@@ -1,3 +1,4 @@
+import functools
 import socket
 import json
 import time
@@ -5,54 +6,110 @@ import logging
 import threading
 
 from loguru import logger
-from loguru import logger
 
-class Networking:
+from . import codec
+from .. import metrics
+
+@functools.lru_cache(maxsize=None)
+def broadcast_address():
+    """
+    Широковещательный адрес; разрешается один раз на процесс
+    """
+    return socket.gethostbyname('<broadcast>')
+
+
+class JsonReceiver:
+    """
+    Общее для транспортов (Networking, aio.AsyncNetworking, mux.Session): ожидание нужного
+    сообщения поверх их recv_json(timeout)
+    """
+
+    def recv_json_until(self, predicate, timeout):
+        """
+        :param predicate: predicate(сообщение или None) - подходит ли сообщение
+        :return: (сообщение, адрес) или (None, None) по таймауту
+        """
+        t0 = time.monotonic()
+        while (left := t0 + timeout - time.monotonic()) > 0:
+            data, addr = self.recv_json(timeout=left)
+            if predicate(data):
+                return data, addr
+        return None, None
+
+
+class Networking(JsonReceiver):
     BUFF = 4096
     TIMEOUT = 2.0
 
     @classmethod
-    def get_socket(cls, broadcast=False, timeout=TIMEOUT):
+    def get_socket(cls, broadcast=False, timeout=TIMEOUT, reuse=True):
+        """
+        :param reuse: разрешить нескольким сокетам слушать один порт
+        """
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-        try:
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-        except AttributeError:
-            
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            except AttributeError:
+
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
         if broadcast:
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
         sock.settimeout(timeout)
         return sock
 
-    def recv_json(self):
+    def recv_bytes(self, timeout=None):
+        """
+        :param timeout: None - таймаут сокета (TIMEOUT)
+        """
+        if timeout is not None:
+            self._socket.settimeout(timeout)
         try:
-            
             data, addr = self._socket.recvfrom(self.BUFF)
-            
-            return json.loads(data.decode('utf-8', errors='ignore')), addr
-        except json.JSONDecodeError:
-            logging.error(f'JSONDecodeError!')
+            if metrics.ENABLED:
+                metrics.count('net.received_datagrams')
+                metrics.count('net.received_bytes', len(data))
+            return data, addr
         except socket.timeout:
-            pass  
-        except KeyboardInterrupt:
-            raise
+            pass
+        except OSError:
+            if self.read_running:
+                raise
+        finally:
+            if timeout is not None:
+                self._socket.settimeout(self.TIMEOUT)
         return None, None
 
-    def recv_json_until(self, predicate, timeout):
-        t0 = time.monotonic()
-        while time.monotonic() < t0 + timeout:
-            data, addr = self.recv_json()
-            if predicate(data):
-                return data, addr
+    def recv_json(self, timeout=None):
+        data, addr = self.recv_bytes(timeout)
+        if data is None:
+            return None, None
+        try:
+            
+            return codec.loads(data), addr
+        except json.JSONDecodeError:
+            logging.error(f'JSONDecodeError!')
+        except codec.CodecError as e:
+            logging.error(f'CodecError: {e}')
         return None, None
 
-    def run_reader_thread(self, callback):
+    def run_reader_thread(self, callback, raw=False):
+        """
+        :param raw: передавать в callback сырые (data, addr) вместо разобранного сообщения
+        """
         self.read_running = True
+        # время обработки каждой датаграммы на приеме
+        callback = metrics.timed('net.reader_callback')(callback)
 
         def reader_job():
             while self.read_running:
+                if raw:
+                    data, addr = self.recv_bytes()
+                    if data:
+                        callback(data, addr)
+                    continue
                 data, _ = self.recv_json()
                 if data:
                     callback(data)
@@ -63,18 +120,34 @@ class Networking:
 
     def bind(self, to=""):
         self._socket.bind((to, self.port_no))
+        # порт 0 - система выбрала свободный
+        self.port_no = self._socket.getsockname()[1]
 
-    def __init__(self, port_no, broadcast=False):
+    def __init__(self, port_no, broadcast=False, reuse=True):
         self.read_running = False
         self.port_no = port_no
-        self._socket = self.get_socket(broadcast=broadcast)
+        self._socket = self.get_socket(broadcast=broadcast, reuse=reuse)
 
     def send_json(self, j, to):
         data = bytes(json.dumps(j), 'utf-8')
-        return self._socket.sendto(data, (to, self.port_no))
+        return self.send_bytes(data, to)
+
+    @metrics.timed('net.send_bytes')
+    def send_bytes(self, data, to):
+        """
+        :param to: адрес или (адрес, порт); без порта отправляем на свой port_no
+        """
+        if metrics.ENABLED:
+            metrics.count('net.sent_datagrams')
+            metrics.count('net.sent_bytes', len(data))
+        return self._socket.sendto(data, to if isinstance(to, tuple) else (to, self.port_no))
 
     def send_json_broadcast(self, j):
-        return self.send_json(j, socket.gethostbyname('<broadcast>'))
+        return self.send_json(j, broadcast_address())
+
+    def close(self):
+        self.read_running = False
+        self._socket.close()
 
     def __del__(self):
         logger.info('Closing socket')
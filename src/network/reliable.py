@@ -0,0 +1,367 @@
+"""
+Надежная упорядоченная доставка поверх UDP.
+
+Каждый пакет данных получает порядковый номер. Получатель подтверждает
+последний номер, полученный без пропусков, и битовую маску
+следующих 32 номеров (выборочное подтверждение). Неподтвержденные пакеты
+отправляются повторно по таймауту, который считается по RTT (RFC 6298).
+Дубликаты отбрасываются, сообщения передаются в callback строго по порядку.
+
+Если отправлять нечего, раз в keepalive секунд уходит пустой пакет данных (heartbeat):
+он повторяется и подтверждается как обычный, поэтому обрыв молчащего канала
+тоже замечается через on_stall.
+
+Повторы ведет таймер: на aio.AsyncNetworking (и сессиях mux поверх него) - loop.call_later
+в общем цикле событий, иначе отдельный поток на канал.
+"""
+import logging
+import struct
+import threading
+import time
+
+from . import codec
+
+MAGIC = 0xD8
+
+F_DATA = 1
+F_ACK = 2
+# повтор пакета: по нему получатель узнает о потере, которую не видно по пропуску в нумерации
+F_RETRY = 4
+
+HEADER = struct.Struct('>BBIII')
+
+SACK_BITS = 32
+
+RTO_INITIAL = 0.2
+RTO_MIN = 0.03
+RTO_MAX = 2.0
+MAX_RETRIES = 30
+
+# после стольких повторов одного пакета соединение считается потерянным (on_stall)
+STALL_RETRIES = 6
+
+# секунды тишины до heartbeat
+KEEPALIVE = 1.0
+
+# пакеты с номером дальше этого от последнего доставленного отбрасываются: это остатки прежнего
+# соединения после reset()
+WINDOW = 1024
+
+
+def is_reliable(data: bytes):
+    return bool(data) and data[0] == MAGIC
+
+
+class ReliableChannel:
+    def __init__(self, sender, receiver, remote_addr, keepalive=KEEPALIVE):
+        """
+        :param sender: Networking, через который отправляем соседу
+        :param receiver: Networking, на котором слушаем
+        :param keepalive: секунды тишины до heartbeat, None - не отправлять
+        """
+        self._sender = sender
+        self._receiver = receiver
+        self._remote_addr = remote_addr
+
+        self._lock = threading.Lock()
+        self._timer_wakeup = threading.Condition(self._lock)
+        self._running = False
+
+        # цикл событий транспорта: повторы по loop.call_later вместо своего потока
+        self._loop = getattr(receiver, 'loop', None)
+        self._timer = None
+        # на когда заведен таймер в цикле событий
+        self._timer_at = None
+
+        # отправка: номер -> [кадр, время первой отправки, время следующего повтора, число повторов]
+        self._next_seq = 1
+        self._pending = {}
+        self.keepalive = keepalive
+        self._last_send_time = time.monotonic()
+
+        # прием
+        self._delivered = 0
+        self._out_of_order = {}
+        # старший из пришедших номеров: по пропускам в нумерации считаем потери на приеме
+        self._highest = 0
+
+        # оценка RTT
+        self.srtt = None
+        self.rttvar = None
+        self.rto = RTO_INITIAL
+
+        self.sent = 0
+        self.last_sent = 0
+        self.heartbeats = 0
+        self.retransmissions = 0
+        self.duplicates = 0
+        self.dropped = 0
+        self.stale = 0
+        # номеров данных до старшего пришедшего и сколько из них не пришли с первой отправки:
+        # пропущенные в нумерации и пришедшие впервые только повтором
+        self.expected = 0
+        self.gaps = 0
+
+        # откуда пришел последний пакет; на новый адрес канал переходит только через reset():
+        # чужой пакет с другого адреса не должен уводить ответы соседа
+        self.last_addr = None
+
+        self._callback = lambda _: ...
+
+        # вызывается для каждого подтвержденного пакета: (номер, секунд от первой отправки до подтверждения)
+        self.on_ack = lambda seq, latency: ...
+
+        # вызывается, когда пакет не подтверждается после STALL_RETRIES повторов
+        self.on_stall = lambda: ...
+
+    def _follow(self, addr):
+        # адрес без порта (отдельные сокеты на прием и отправку) меняем только на новый ip
+        return addr[0] if isinstance(self._remote_addr, str) else addr
+
+    def is_remote(self, addr):
+        """
+        Пришел ли пакет с адреса addr от соседа по текущему адресу
+        """
+        return self._follow(addr) == self._remote_addr
+
+    def reset(self, remote_addr=None, next_seq=1, delivered=0):
+        """
+        Начать соединение заново, например после смены сети: неподтвержденное забывается,
+        нумерация начинается с next_seq, от соседа ждем пакет номер delivered + 1
+        :param remote_addr: новый адрес соседа в том виде, в каком он пришел (last_addr)
+        """
+        with self._lock:
+            if remote_addr is not None:
+                self._remote_addr = self._follow(remote_addr)
+            self._next_seq = next_seq
+            self._pending.clear()
+            self._delivered = delivered
+            self._highest = delivered
+            self._out_of_order.clear()
+            self._wake()
+
+    def _ack_fields(self):
+        sack = 0
+        for seq in self._out_of_order:
+            offset = seq - self._delivered - 1
+            if 0 <= offset < SACK_BITS:
+                sack |= 1 << offset
+        return self._delivered, sack
+
+    def _frame(self, flags, seq, payload=b''):
+        ack, sack = self._ack_fields()
+        return HEADER.pack(MAGIC, flags | F_ACK, seq, ack, sack) + payload
+
+    def _queue_frame(self, payload):
+        """
+        Пронумеровать пакет данных и поставить его на повтор; вызывается под self._lock
+        """
+        seq = self._next_seq
+        self._next_seq += 1
+        frame = self._frame(F_DATA, seq, payload)
+        now = time.monotonic()
+        self._pending[seq] = [frame, now, now + self.rto, 0]
+        self._last_send_time = now
+        return seq, frame
+
+    def send_bytes(self, payload):
+        with self._lock:
+            seq, frame = self._queue_frame(payload)
+            self.sent += 1
+            self.last_sent = seq
+            self._wake(self._pending[seq][2])
+        self._sender.send_bytes(frame, self._remote_addr)
+        return seq
+
+    def send_json(self, j, binary=False):
+        return self.send_bytes(codec.dumps(j, binary=binary))
+
+    def send_unreliable_json(self, j):
+        """
+        Отправить один раз, без номера и подтверждения; сосед получит сообщение вне очереди
+        """
+        self._sender.send_bytes(codec.dumps(j), self._remote_addr)
+
+    def _send_ack(self):
+        with self._lock:
+            frame = self._frame(0, 0)
+        self._sender.send_bytes(frame, self._remote_addr)
+
+    def _update_rtt(self, sample):
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - sample)
+            self.srtt = 0.875 * self.srtt + 0.125 * sample
+        self.rto = min(RTO_MAX, max(RTO_MIN, self.srtt + 4 * self.rttvar))
+
+    def _on_ack(self, ack, sack):
+        now = time.monotonic()
+        acked = [seq for seq in self._pending if seq <= ack or (seq > ack and seq - ack - 1 < SACK_BITS and
+                                                                sack >> (seq - ack - 1) & 1)]
+        latencies = []
+        for seq in acked:
+            _, sent, _, retries = self._pending.pop(seq)
+            # алгоритм Карна: RTT меряем только по пакетам без повторов
+            if retries == 0:
+                self._update_rtt(now - sent)
+            latencies.append((seq, now - sent))
+        return latencies
+
+    def _on_frame(self, data, addr):
+        self.last_addr = addr
+        if not is_reliable(data):
+            # сосед без надежного канала - отдаем как есть
+            self._deliver(data)
+            return
+        if len(data) < HEADER.size:
+            return
+
+        _, flags, seq, ack, sack = HEADER.unpack_from(data)
+        payload = data[HEADER.size:]
+
+        ready = []
+        acked = []
+        with self._lock:
+            if flags & F_ACK:
+                acked = self._on_ack(ack, sack)
+            if flags & F_DATA:
+                if seq <= self._delivered or seq in self._out_of_order:
+                    self.duplicates += 1
+                elif seq - self._delivered > WINDOW:
+                    self.stale += 1
+                else:
+                    if seq > self._highest:
+                        self.expected += seq - self._highest
+                        self.gaps += seq - self._highest - 1 + bool(flags & F_RETRY)
+                        self._highest = seq
+                    self._out_of_order[seq] = payload
+                    while self._delivered + 1 in self._out_of_order:
+                        self._delivered += 1
+                        payload = self._out_of_order.pop(self._delivered)
+                        # пустой пакет - heartbeat, его достаточно подтвердить
+                        if payload:
+                            ready.append(payload)
+
+        for seq, latency in acked:
+            self.on_ack(seq, latency)
+        if flags & F_DATA:
+            self._send_ack()
+        for payload in ready:
+            self._deliver(payload)
+
+    def _deliver(self, payload):
+        try:
+            message = codec.loads(payload)
+        except ValueError as e:
+            logging.error(f'Bad message: {e}')
+            return
+        self._callback(message)
+
+    def _due(self, now):
+        """
+        Пакеты, которым пора на повтор, и heartbeat, если канал молчит; вызывается под self._lock
+        :return: (кадры для отправки, пора ли вызвать on_stall, когда проверить снова или None)
+        """
+        resend = []
+        stalled = False
+        for seq, entry in list(self._pending.items()):
+            if entry[2] <= now:
+                if entry[3] >= MAX_RETRIES:
+                    logging.warning(f'Giving up on packet {seq}')
+                    del self._pending[seq]
+                    self.dropped += 1
+                    continue
+                entry[3] += 1
+                entry[2] = now + min(RTO_MAX, self.rto * 2 ** entry[3])
+                if entry[3] == 1:
+                    entry[0] = entry[0][:1] + bytes([entry[0][1] | F_RETRY]) + entry[0][2:]
+                resend.append(entry[0])
+                stalled |= entry[3] == STALL_RETRIES
+        self.retransmissions += len(resend)
+
+        if not self._pending and self.keepalive is not None and now - self._last_send_time >= self.keepalive:
+            _, frame = self._queue_frame(b'')
+            self.heartbeats += 1
+            resend.append(frame)
+
+        deadline = min((entry[2] for entry in self._pending.values()), default=None)
+        if deadline is None and self.keepalive is not None:
+            deadline = self._last_send_time + self.keepalive
+        return resend, stalled, deadline
+
+    def _flush(self, frames, stalled):
+        for frame in frames:
+            self._sender.send_bytes(frame, self._remote_addr)
+        if stalled:
+            self.on_stall()
+
+    def _wake(self, deadline=None):
+        """
+        Пересчитать время следующего повтора (новый пакет, reset); вызывается под self._lock
+        :param deadline: срок нового пакета: таймер, заведенный раньше него, трогать незачем
+        """
+        if self._loop is None:
+            self._timer_wakeup.notify()
+        elif self._running and (deadline is None or self._timer_at is None or deadline < self._timer_at):
+            self._timer_at = deadline
+            self._loop.call_soon_threadsafe(self._on_timer)
+
+    def _retransmit_job(self):
+        with self._lock:
+            while self._running:
+                resend, stalled, deadline = self._due(time.monotonic())
+                if resend:
+                    self._lock.release()
+                    try:
+                        self._flush(resend, stalled)
+                    finally:
+                        self._lock.acquire()
+                    continue
+                self._timer_wakeup.wait(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def _on_timer(self):
+        """
+        Один проход повторов в цикле событий; следующий заводится на ближайший срок
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        with self._lock:
+            if not self._running:
+                return
+            resend, stalled, deadline = self._due(time.monotonic())
+            self._timer_at = deadline
+        self._flush(resend, stalled)
+        if deadline is not None:
+            self._timer = self._loop.call_later(max(0.0, deadline - time.monotonic()), self._on_timer)
+
+    def run_reader_thread(self, callback):
+        """
+        Начать прием; callback получает разобранные сообщения по порядку
+        """
+        self._callback = callback
+        self._running = True
+        if self._loop is None:
+            threading.Thread(target=self._retransmit_job, daemon=True).start()
+        else:
+            self._loop.call_soon_threadsafe(self._on_timer)
+        return self._receiver.run_reader_thread(self._on_frame, raw=True)
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def unacked(self):
+        return len(self._pending)
+
+    def close(self):
+        with self._lock:
+            self._running = False
+            if self._loop is None:
+                self._timer_wakeup.notify()
+            else:
+                self._loop.call_soon_threadsafe(self._on_timer)
+        self._receiver.read_running = False
@@ -0,0 +1,69 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+
+from .router import run_router
+from ..network.lobby import LobbyBroker, BroadcastGroup
+from .shard import serve_shard, run_shard
+
+PORT_NO = 37100
+
+# порты, на которых клиенты слушают поиск соперника (PORT_NO и PORT_NO_AUX в app.py)
+CLIENT_PORTS = [37020, 37021]
+
+# pid брокера сервера меньше любого pid клиента, поэтому при выборах он всегда главный
+LOBBY_PID = 1
+
+
+def print_load(load):
+    print(f"shard {load['shard']}: {load['matches']} matches, {load['sessions']} players, "
+          f"{load['actions']} actions ({load['rejected']} rejected), "
+          f"in/out {load['messages_in']}/{load['messages_out']}, lag {load['loop_lag_ms']:.1f} ms", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m src.server', description='Сервер партий без GUI')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=PORT_NO,
+                        help='порт для игроков; шарды занимают следующие порты')
+    parser.add_argument('--shards', type=int, default=1, help='число процессов-шардов')
+    parser.add_argument('--report-interval', type=float, default=5.0, help='как часто шарды сообщают нагрузку, с')
+    parser.add_argument('--lobby', action='store_true', help='заодно быть брокером лобби для клиентов в сети')
+    parser.add_argument('--client-ports', type=int, nargs='+', default=CLIENT_PORTS)
+    parser.add_argument('--journal', help='записывать партии в журнал: префикс файлов, по файлу на шард')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.lobby:
+        LobbyBroker(LOBBY_PID, BroadcastGroup(args.client_ports)).start()
+
+    if args.shards == 1:
+        # один шард - без маршрутизатора, прямо на порту для игроков
+        try:
+            asyncio.run(run_shard(args.host, args.port, 0, print_load, args.report_interval, journal=args.journal))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    reports = multiprocessing.Queue()
+    shard_ports = [args.port + 1 + i for i in range(args.shards)]
+    processes = [multiprocessing.Process(target=serve_shard,
+                                         args=(args.host, port, i, reports, args.report_interval, args.journal),
+                                         daemon=True)
+                 for i, port in enumerate(shard_ports)]
+    for p in processes:
+        p.start()
+
+    try:
+        asyncio.run(run_router(args.host, args.port, shard_ports, reports, on_report=print_load))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in processes:
+            p.terminate()
+
+
+if __name__ == '__main__':
+    main()
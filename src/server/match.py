@@ -0,0 +1,89 @@
+import time
+
+from ..logic.durak import UpdateAction
+from ..logic.gamelog import JournalWriter
+from ..logic.net_game import encode_move, decode_move
+from ..logic.serialization import DurakSerialized
+from ..logic.view import view, view_hash
+
+APPLIED = 'applied'
+DUPLICATE = 'duplicate'
+REJECTED = 'rejected'
+# ход через номер: предыдущий ход игрока еще не дошел, клиент повторит их по порядку
+EARLY = 'early'
+# сообщение не разбирается как ход
+MALFORMED = 'malformed'
+
+
+class Match:
+    """
+    Партия на сервере. Сервер - единственный источник правды: ход принимается, только если
+    он есть в legal_actions() игрока и сделан от последнего принятого хода.
+    Игроки получают только свой вид партии (logic.view): руку соперника и колоду знает лишь сервер
+    """
+
+    def __init__(self, match_id, addrs, journal: JournalWriter = None):
+        """
+        :param addrs: адреса игроков 0 и 1
+        :param journal: куда записывать партию
+        """
+        self.match_id = match_id
+        self.addrs = list(addrs)
+        self.state = DurakSerialized()
+        self.seq = 0
+        self.touched = time.monotonic()
+
+        self.journal = journal
+        self.journal_id = journal.new_game(self.state) if journal is not None else None
+
+        # (игрок, ход) последнего принятого хода - чтобы узнать повторную отправку
+        self._last = None
+
+    def index_of(self, addr):
+        return self.addrs.index(addr)
+
+    def move(self, index, seq, move):
+        """
+        Проверить и применить ход игрока
+        :param seq: номер, который ход получит, если будет принят
+        :return: APPLIED, DUPLICATE (этот ход уже принят), EARLY, REJECTED или MALFORMED
+        """
+        try:
+            action = decode_move(move)
+        except (TypeError, ValueError, IndexError):
+            return MALFORMED
+        if seq == self.seq and self._last == (index, action):
+            return DUPLICATE
+        if seq > self.seq + 1:
+            return EARLY
+        if seq != self.seq + 1 or action not in self.state.legal_actions(index):
+            return REJECTED
+
+        self.state.apply(action)
+        self.seq = seq
+        self._last = (index, action)
+        self.touched = time.monotonic()
+        if self.journal is not None:
+            self.journal.action(self.journal_id, action, self.state)
+            if self.finished:
+                self.journal.end_game(self.journal_id)
+        return APPLIED
+
+    def move_message(self, index):
+        """
+        Последний принятый ход для игрока index; после "бито" или "взять" - с картами,
+        которые он взял из колоды
+        """
+        _, action = self._last
+        message = {'action': 'move', 'seq': self.seq, 'move': encode_move(action),
+                   'checksum': view_hash(self.state, index)}
+        if action[0] == UpdateAction.FINISH_TURN:
+            message['drawn'] = [card for i, card in self.state.last_update['from_deck'] if i == index]
+        return message
+
+    def state_message(self, index):
+        return {'action': 'view', 'seq': self.seq, 'state': view(self.state, index)}
+
+    @property
+    def finished(self):
+        return self.state.winner is not None
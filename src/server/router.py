@@ -0,0 +1,80 @@
+"""
+Маршрутизатор: принимает 'join' на общем порту и отправляет игрока на порт шарда.
+"""
+import asyncio
+import logging
+import threading
+
+from ..network import codec
+
+
+class Router(asyncio.DatagramProtocol):
+    """
+    Игроки одной пары попадают на один шард, новые пары - на наименее загруженный
+    """
+
+    def __init__(self, shard_ports):
+        self.shard_ports = list(shard_ports)
+        self.loads = [{} for _ in self.shard_ports]
+        self.transport = None
+
+        # (шард, адрес) первого игрока пары, которой не хватает второго
+        self._filling = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def pick_shard(self, addr):
+        if self._filling is not None:
+            shard, first = self._filling
+            if first != addr:
+                self._filling = None
+            return shard
+        shard = min(range(len(self.shard_ports)), key=lambda i: self.loads[i].get('sessions', 0))
+        # пока не пришел отчет, считаем место занятым, чтобы следующая пара ушла на другой шард
+        self.loads[shard]['sessions'] = self.loads[shard].get('sessions', 0) + 2
+        self._filling = (shard, addr)
+        return shard
+
+    def datagram_received(self, data, addr):
+        try:
+            j = codec.loads(data)
+        except ValueError:
+            return
+        if j.get('action') != 'join':
+            return
+        port = self.shard_ports[self.pick_shard(addr)]
+        self.transport.sendto(codec.dumps({'action': 'redirect', 'port': port}), addr)
+
+    def on_report(self, load):
+        self.loads[load['shard']] = load
+
+
+def read_reports(reports, loop, router, on_report=None):
+    """
+    Поток, который переносит отчеты шардов из очереди multiprocessing в цикл событий маршрутизатора
+    """
+
+    def job():
+        while True:
+            load = reports.get()
+            if load is None:
+                return
+            loop.call_soon_threadsafe(router.on_report, load)
+            if on_report is not None:
+                on_report(load)
+
+    thread = threading.Thread(target=job, daemon=True)
+    thread.start()
+    return thread
+
+
+async def run_router(host, port, shard_ports, reports, on_report=None):
+    loop = asyncio.get_running_loop()
+    transport, router = await loop.create_datagram_endpoint(lambda: Router(shard_ports), local_addr=(host, port))
+    logging.info(f'Router listening on {host}:{port}, shards on {shard_ports}')
+    read_reports(reports, loop, router, on_report)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        transport.close()
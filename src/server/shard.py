@@ -0,0 +1,180 @@
+"""
+Шард сервера: все партии шарда обслуживаются одним циклом событий на одном UDP-сокете.
+"""
+import asyncio
+import logging
+import time
+
+from .match import Match, APPLIED, DUPLICATE, EARLY, MALFORMED
+from ..logic.gamelog import JournalWriter
+from ..network import codec
+
+# партия без ходов дольше этого удаляется
+MATCH_TIMEOUT = 600.0
+
+
+class MatchServer(asyncio.DatagramProtocol):
+    def __init__(self, shard=0, journal: JournalWriter = None):
+        """
+        :param journal: куда записывать партии шарда
+        """
+        self.shard = shard
+        self.journal = journal
+        self.transport = None
+
+        # адрес игрока -> (партия, индекс игрока)
+        self.sessions = {}
+        self.matches = {}
+        self._binary = set()
+        self._waiting = None
+        self._next_match = 1
+
+        self.messages_in = 0
+        self.messages_out = 0
+        self.actions = 0
+        self.rejected = 0
+        self.bad = 0
+        self.loop_lag = 0.0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def _send(self, j, addr):
+        self.messages_out += 1
+        self.transport.sendto(codec.dumps(j, binary=addr in self._binary), addr)
+
+    def datagram_received(self, data, addr):
+        self.messages_in += 1
+        try:
+            j = codec.loads(data)
+            action = j['action']
+        except (ValueError, KeyError, TypeError):
+            self.bad += 1
+            return
+
+        if action == 'join':
+            self._on_join(j, addr)
+            return
+
+        session = self.sessions.get(addr)
+        if session is None:
+            return
+        match, index = session
+        if action == 'move':
+            self._on_move(match, index, j, addr)
+        elif action == 'resync':
+            self._send(match.state_message(index), addr)
+        elif action == 'quit':
+            self._close_match(match, quitter=addr)
+
+    def _on_join(self, j, addr):
+        if codec.VERSION in j.get('codecs', []):
+            self._binary.add(addr)
+
+        if addr in self.sessions:
+            # ответ на join потерялся - повторяем
+            match, index = self.sessions[addr]
+            self._send({'action': 'joined', 'match': match.match_id, 'index': index}, addr)
+            self._send(match.state_message(index), addr)
+            return
+
+        if self._waiting is None or self._waiting == addr:
+            self._waiting = addr
+            return
+
+        match = Match(self._next_match, [self._waiting, addr], self.journal)
+        self._next_match += 1
+        self._waiting = None
+        self.matches[match.match_id] = match
+        for index, player in enumerate(match.addrs):
+            self.sessions[player] = (match, index)
+            self._send({'action': 'joined', 'match': match.match_id, 'index': index}, player)
+            self._send(match.state_message(index), player)
+
+    def _on_move(self, match, index, j, addr):
+        try:
+            result = match.move(index, j['seq'], j['move'])
+        except KeyError:
+            self.bad += 1
+            return
+
+        if result == APPLIED:
+            self.actions += 1
+            for i, player in enumerate(match.addrs):
+                self._send(match.move_message(i), player)
+            if match.finished:
+                self._close_match(match)
+        elif result == DUPLICATE:
+            self._send(match.move_message(index), addr)
+        elif result == MALFORMED:
+            self.bad += 1
+        elif result == EARLY:
+            # состояние не шлем: иначе клиент бросит ходы, которые еще повторяет
+            pass
+        else:
+            self.rejected += 1
+            self._send(match.state_message(index), addr)
+
+    def _close_match(self, match, quitter=None):
+        self.matches.pop(match.match_id, None)
+        for player in match.addrs:
+            if self.sessions.get(player, (None,))[0] is match:
+                del self.sessions[player]
+                self._binary.discard(player)
+                if quitter is not None and player != quitter:
+                    self._send({'action': 'quit'}, player)
+
+    def expire(self, now=None):
+        now = now or time.monotonic()
+        for match in [m for m in self.matches.values() if now - m.touched > MATCH_TIMEOUT]:
+            self._close_match(match)
+
+    def load(self):
+        """
+        Отчет о нагрузке шарда
+        """
+        return {'shard': self.shard, 'matches': len(self.matches), 'sessions': len(self.sessions),
+                'waiting': int(self._waiting is not None), 'messages_in': self.messages_in,
+                'messages_out': self.messages_out, 'actions': self.actions, 'rejected': self.rejected,
+                'bad': self.bad, 'loop_lag_ms': self.loop_lag * 1000}
+
+
+async def run_shard(host, port, shard=0, on_report=None, interval=1.0, started=None, journal=None):
+    """
+    :param on_report: вызывается раз в interval секунд с MatchServer.load()
+    :param started: threading.Event, отмечается, когда сокет открыт
+    :param journal: префикс файлов журнала партий; шард пишет в <journal>.<shard>
+    """
+    loop = asyncio.get_running_loop()
+    writer = JournalWriter(f'{journal}.{shard}') if journal else None
+    transport, server = await loop.create_datagram_endpoint(lambda: MatchServer(shard, writer),
+                                                            local_addr=(host, port))
+    logging.info(f'Shard {shard} listening on {host}:{port}')
+    if started is not None:
+        started.set()
+    try:
+        while True:
+            t0 = time.monotonic()
+            await asyncio.sleep(interval)
+            server.loop_lag = max(0.0, time.monotonic() - t0 - interval)
+            server.expire()
+            if writer is not None:
+                writer.flush()
+            if on_report is not None:
+                on_report(server.load())
+    finally:
+        transport.close()
+        if writer is not None:
+            writer.close()
+
+
+def serve_shard(host, port, shard=0, reports=None, interval=1.0, journal=None):
+    """
+    Точка входа процесса шарда
+    :param reports: очередь multiprocessing для отчетов о нагрузке
+    """
+    try:
+        asyncio.run(run_shard(host, port, shard, reports.put if reports is not None else None, interval,
+                              journal=journal))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,36 @@
+import argparse
+import json
+
+from .policies import POLICIES
+from .selfplay import simulate, MAX_ACTIONS
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m src.sim', description='Самоигра без GUI')
+    parser.add_argument('-n', '--games', type=int, default=10000)
+    parser.add_argument('-p', '--policies', nargs=2, default=['random', 'random'], choices=sorted(POLICIES))
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-w', '--workers', type=int, default=None, help='по умолчанию - число ядер')
+    parser.add_argument('--chunk', type=int, default=500, help='партий на одно задание пула')
+    parser.add_argument('--max-actions', type=int, default=MAX_ACTIONS)
+    parser.add_argument('--journal', help='записать партии в журнал: префикс файлов, по файлу на задание пула')
+    parser.add_argument('--json', action='store_true', help='вывести статистику в JSON')
+    args = parser.parse_args()
+
+    stats = simulate(args.policies, args.games, seed=args.seed, workers=args.workers,
+                     chunk=args.chunk, max_actions=args.max_actions, journal=args.journal)
+
+    if args.json:
+        print(json.dumps(stats))
+        return
+
+    print(f"{stats['games']} games in {stats['seconds']:.2f}s on {stats['workers']} workers "
+          f"({stats['games_per_sec']:.0f} games/s)")
+    print(f"turns/game: {stats['turns_per_game']:.1f}, actions/game: {stats['actions_per_game']:.1f}, "
+          f"unfinished: {stats['unfinished']}")
+    for i, (name, rate) in enumerate(zip(stats['policies'], stats['win_rates'])):
+        print(f'  player {i} ({name}): {rate:.2%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Стратегии для самоигры. Стратегия - функция policy(game, actions, rng) -> action,
+где actions - непустой список из game.legal_actions(player_index)
+"""
+from ..logic.durak import NAME_TO_VALUE, NOMINALS, UpdateAction
+
+
+def card_cost(game, card):
+    """
+    Чем больше, тем ценнее карта: козыри дороже любых некозырных
+    """
+    cost = NAME_TO_VALUE[card[0]]
+    if card[1] == game.trump_suit:
+        cost += len(NOMINALS)
+    return cost
+
+
+def random_policy(game, actions, rng):
+    return rng.choice(actions)
+
+
+def greedy_policy(game, actions, rng):
+    """
+    Ходит и отбивается самой дешевой картой, не подкидывает козыри, берет, если не может отбиться
+    """
+    attacks = [a for a in actions if a[0] == UpdateAction.ATTACK]
+    defends = [a for a in actions if a[0] == UpdateAction.DEFEND]
+    finish = [a for a in actions if a[0] == UpdateAction.FINISH_TURN]
+
+    if defends:
+        return min(defends, key=lambda a: card_cost(game, a[2]))
+    if attacks:
+        best = min(attacks, key=lambda a: card_cost(game, a[1]))
+        if not game.field or best[1][1] != game.trump_suit or not finish:
+            return best
+    return finish[0] if finish else rng.choice(actions)
+
+
+POLICIES = {
+    'random': random_policy,
+    'greedy': greedy_policy,
+}
@@ -0,0 +1,121 @@
+"""
+Самоигра без GUI: партии целиком, параллельно в пуле процессов
+"""
+import multiprocessing
+import random
+import time
+
+from ..logic.durak import Durak, UpdateAction
+from ..logic.gamelog import JournalWriter
+from .policies import POLICIES
+
+MAX_ACTIONS = 2000
+
+
+def game_rng(seed, game_no):
+    """
+    Генератор партии номер game_no. Зависит только от seed и номера партии,
+    поэтому результат не зависит от числа процессов и порядка их работы
+    """
+    return random.Random(f'{seed}:{game_no}')
+
+
+def play_game(policies, rng: random.Random, max_actions=MAX_ACTIONS, journal: JournalWriter = None, game_id=None):
+    """
+    Сыграть одну партию
+    :param policies: стратегии игроков по индексу
+    :param journal: куда записать партию
+    :param game_id: номер партии в журнале
+    :return: (индекс победителя или None, число ходов, число действий)
+    """
+    game = Durak(rng=rng)
+    if journal is not None:
+        game_id = journal.new_game(game, game_id)
+    turns = 0
+    n_actions = 0
+    while n_actions < max_actions and game.winner is None:
+        index = game.acting_player_index
+        actions = game.legal_actions(index)
+        if not actions:
+            break
+
+        action = policies[index](game, actions, rng)
+        if action[0] == UpdateAction.FINISH_TURN:
+            turns += 1
+        game.apply(action)
+        n_actions += 1
+        if journal is not None:
+            journal.action(game_id, action, game)
+
+    return game.winner, turns, n_actions
+
+
+def play_range(names, seed, start, stop, max_actions=MAX_ACTIONS, journal=None):
+    """
+    Сыграть партии с номерами [start, stop). В нечетных партиях игроки меняются местами.
+    :param journal: префикс файлов журнала; партии пишутся в <journal>.<start>, номер партии в журнале - game_no
+    :return: словарь со статистикой
+    """
+    stats = {'games': 0, 'turns': 0, 'actions': 0, 'unfinished': 0, 'wins': [0] * len(names)}
+    policies = [POLICIES[n] for n in names]
+    writer = JournalWriter(f'{journal}.{start}') if journal else None
+    for game_no in range(start, stop):
+        seats = [0, 1] if game_no % 2 == 0 else [1, 0]
+        winner, turns, n_actions = play_game([policies[s] for s in seats], game_rng(seed, game_no), max_actions,
+                                             writer, game_no)
+
+        stats['games'] += 1
+        stats['turns'] += turns
+        stats['actions'] += n_actions
+        if winner is None:
+            stats['unfinished'] += 1
+        else:
+            stats['wins'][seats[winner]] += 1
+    if writer is not None:
+        writer.close()
+    return stats
+
+
+def _play_range_job(args):
+    return play_range(*args)
+
+
+def merge_stats(a, b):
+    return {'games': a['games'] + b['games'], 'turns': a['turns'] + b['turns'],
+            'actions': a['actions'] + b['actions'], 'unfinished': a['unfinished'] + b['unfinished'],
+            'wins': [x + y for x, y in zip(a['wins'], b['wins'])]}
+
+
+def simulate(names, n_games, seed=0, workers=None, chunk=500, max_actions=MAX_ACTIONS, journal=None):
+    """
+    Сыграть n_games партий между стратегиями names в пуле из workers процессов
+    :param journal: префикс файлов журнала партий, по файлу на задание пула
+    :return: сводная статистика с полями games_per_sec, turns_per_game и win_rates
+    """
+    workers = workers or multiprocessing.cpu_count()
+    jobs = [(names, seed, start, min(start + chunk, n_games), max_actions, journal)
+            for start in range(0, n_games, chunk)]
+
+    t0 = time.perf_counter()
+    stats = {'games': 0, 'turns': 0, 'actions': 0, 'unfinished': 0, 'wins': [0] * len(names)}
+    if workers == 1:
+        for job in jobs:
+            stats = merge_stats(stats, _play_range_job(job))
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            for part in pool.imap_unordered(_play_range_job, jobs):
+                stats = merge_stats(stats, part)
+    elapsed = time.perf_counter() - t0
+
+    games = max(1, stats['games'])
+    stats.update({
+        'policies': list(names),
+        'seed': seed,
+        'workers': workers,
+        'seconds': elapsed,
+        'games_per_sec': stats['games'] / elapsed if elapsed else 0.0,
+        'turns_per_game': stats['turns'] / games,
+        'actions_per_game': stats['actions'] / games,
+        'win_rates': [w / games for w in stats['wins']],
+    })
+    return stats
@@ -1,7 +1,49 @@
+import asyncio
+import copy
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import urllib.request
 
-from ..logic.durak import Durak, ACE
+from .. import metrics
+from ..logic import bitboard
+from ..logic.bitboard import BitDurak
+from ..logic import gamelog
+from ..logic.durak import Durak, Player, UpdateAction, ACE, DECK, SUITS, HEARTS, SPADES, DIAMS, CLUBS, NAME_TO_VALUE
+from ..logic.bot_game import DurakBotGame
+from ..logic.game import DurakGame
+from ..logic.net_game import DurakNetGame, encode_move
+from ..logic.server_game import DurakServerGame
+from ..logic.ismcts import ISMCTS, Determinizer
 from ..logic.serialization import DurakSerialized
+from ..logic.view import from_view, view_hash
+from ..logic.zobrist import TranspositionTable
+from ..bench import runner as bench
+from ..loadgen.harness import percentile, run_load
+from ..network import codec
+from ..network.aio import AsyncNetworking, event_loop
+from ..network.discovery_protocol import DiscoveryProtocol, PeerCache
+from ..network.lobby import Lobby, LobbyBroker, LobbyClient, BroadcastGroup, hosted_broker
+from ..network.mux import Multiplexer, CONTROL
+from ..network.network import Networking
+from ..network.reliable import ReliableChannel
+from ..server.match import Match, APPLIED, DUPLICATE, EARLY, REJECTED, MALFORMED
+from ..server.router import Router
+from ..server.shard import run_shard
+from ..sim.policies import greedy_policy, random_policy
+from ..sim.selfplay import play_game, play_range, simulate
+
+try:
+    import numpy as np
+    from ..logic import batch
+except ImportError:
+    np = None
 
 
 class TestGame(unittest.TestCase):
@@ -25,6 +67,145 @@ class TestGame(unittest.TestCase):
             assert d.trump[0] != ACE
             assert d.trump == d.deck[-1]
 
+    def test_legal_actions(self):
+        def clone(game):
+            return DurakSerialized(DurakSerialized.serialized(game))
+
+        for seed in range(30):
+            rng = random.Random(seed)
+            d = Durak(rng=random.Random(seed))
+            while d.winner is None:
+                expected = []
+                for card in DECK:
+                    if clone(d).attack(card):
+                        expected.append((UpdateAction.ATTACK, card))
+                for att in d.unbeaten_cards:
+                    for card in d.defending_player.cards:
+                        if clone(d).defend(att, card):
+                            expected.append((UpdateAction.DEFEND, att, card))
+                if d.field:
+                    expected.append((UpdateAction.FINISH_TURN,))
+
+                actions = d.legal_actions()
+                assert sorted(actions) == sorted(expected)
+
+                attacker_actions = d.legal_actions(d.attacker_index)
+                defender_actions = d.legal_actions(d.defending_player.index)
+                assert sorted(attacker_actions + defender_actions) == sorted(actions)
+                assert all(a[0] != UpdateAction.DEFEND for a in attacker_actions)
+
+                d.apply(rng.choice(actions))
+
+    def test_undo(self):
+        def snapshot(game):
+            assert game.state_hash == game.compute_hash()
+            return copy.deepcopy((DurakSerialized.serialized(game), sorted(game.legal_actions()), game.state_hash))
+
+        for seed in range(50):
+            rng = random.Random(seed)
+            d = Durak(rng=random.Random(seed))
+            history = [snapshot(d)]
+            while d.winner is None:
+                if len(history) > 1 and rng.random() < 0.2:
+                    assert d.undo()
+                    history.pop()
+                    assert snapshot(d) == history[-1]
+                else:
+                    d.apply(rng.choice(d.legal_actions()))
+                    history.append(snapshot(d))
+
+            while d.undo():
+                history.pop()
+                assert snapshot(d) == history[-1]
+            assert len(history) == 1
+
+    def test_field_indexes(self):
+        def indexes(game):
+            return (game.attacking_cards, game.defending_cards, game.unbeaten_cards,
+                    [game.can_add_to_field(card) for card in DECK], bool(game.possible_to_beat))
+
+        for seed in range(50):
+            rng = random.Random(seed)
+            d = Durak(rng=random.Random(seed))
+            while d.winner is None:
+                if d.journal and rng.random() < 0.2:
+                    assert d.undo()
+                else:
+                    d.apply(rng.choice(d.legal_actions()))
+                # индексы, обновленные по месту, совпадают с посчитанными заново
+                fresh = DurakSerialized(DurakSerialized.serialized(d))
+                assert indexes(d) == indexes(fresh)
+                assert list(d.field) == d.attacking_cards
+                assert d.defending_cards == [c for c in d.field.values() if c is not None]
+
+    def test_hand_index(self):
+        def key(c):
+            return NAME_TO_VALUE[c[0]], c[1]
+
+        rng = random.Random(0)
+        game = Durak(rng=random.Random(0))
+        for _ in range(200):
+            deck = list(DECK)
+            rng.shuffle(deck)
+            p = Player(0, deck[:rng.randrange(13)])
+            for card in deck[13:13 + rng.randrange(13)]:
+                if rng.random() < 0.5:
+                    p.add_card(card)
+                else:
+                    p.add_cards([card, deck[-1]])
+                    p.take_card(deck[-1])
+                if p.cards and rng.random() < 0.3:
+                    card = rng.choice(p.cards)
+                    p.take_card(card)
+                    assert card not in p.cards
+                assert p.cards == sorted(p.cards, key=key)
+
+                trump = rng.choice(SUITS)
+                game.trump = (ACE, trump)
+                for att in DECK:
+                    variants = [c for c in p.cards if c[1] == att[1] and key(c) > key(att)]
+                    assert p.lowest(att[1], att[0]) == (variants[0] if variants else None)
+                    assert p.beating(att, trump) == [c for c in p.cards if game.can_beat(att, c)]
+                trumps = [c for c in p.cards if c[1] == trump]
+                assert p.lowest_trump(trump) == (trumps[0] if trumps else None)
+
+    def test_hash(self):
+        a = Durak(rng=random.Random(4))
+        b = DurakSerialized(DurakSerialized.serialized(a))
+        assert a.state_hash == b.state_hash
+
+        card = a.attacking_player[0]
+        a.attack(card)
+        assert a.state_hash != b.state_hash
+        b.attack(card)
+        assert a.state_hash == b.state_hash
+
+        a.finish_turn()
+        c = Durak(rng=random.Random(4))
+        c.finish_turn()
+        assert a.state_hash != c.state_hash
+
+
+class TestTranspositionTable(unittest.TestCase):
+    def test_replacement(self):
+        tt = TranspositionTable(size_log2=2)
+        tt.put(1, 'deep', depth=5)
+        tt.put(5, 'shallow', depth=1)
+        assert tt.get(1) == ('deep', 5, None)
+        assert tt.get(5) == ('shallow', 1, None)
+
+        tt.put(9, 'other', depth=2)
+        assert tt.get(1) == ('deep', 5, None)
+        assert tt.get(5) is None
+        assert tt.get(9) == ('other', 2, None)
+
+        tt.new_search()
+        tt.put(13, 'new', depth=0, move='m')
+        assert tt.get(13) == ('new', 0, 'm')
+        assert tt.get(1) == ('deep', 5, None)
+        assert len(tt) == 2
+        assert tt.hits and tt.misses
+
 
 class TestSerialization(unittest.TestCase):
     def test_ser1(self):
@@ -45,6 +226,1147 @@ class TestSerialization(unittest.TestCase):
             assert p1.index == p2.index
             assert p1.cards == p2.cards
 
+        assert sorted(g.legal_actions()) == sorted(g2.legal_actions())
+
+
+class TestBitboard(unittest.TestCase):
+    def test_can_beat_table(self):
+        d = Durak()
+        for trump_suit in SUITS:
+            d.trump = ('6', trump_suit)
+            t = SUITS.index(trump_suit)
+            for att in DECK:
+                for dfn in DECK:
+                    expected = d.can_beat(att, dfn)
+                    assert bitboard.can_beat(t, bitboard.card_to_int(att), bitboard.card_to_int(dfn)) == expected
+
+    def test_hand_order(self):
+        for _ in range(100):
+            cards = random.sample(DECK, 12)
+            mask = bitboard.mask_of(cards)
+            p = Player(0, [])
+            assert bitboard.cards_of(mask) == p.add_cards(cards).cards
+
+    def test_same_game(self):
+        for seed in range(200):
+            d = Durak(rng=random.Random(seed))
+            b = BitDurak(rng=random.Random(seed))
+            rng = random.Random(seed)
+            assert b.serialized() == DurakSerialized.serialized(d)
+            while d.winner is None:
+                if d.unbeaten_cards and rng.random() < 0.8:
+                    for att in d.unbeaten_cards:
+                        variants = [c for c in d.defending_player.cards if d.can_beat(att, c)]
+                        if variants:
+                            dfn = rng.choice(variants)
+                            assert d.defend(att, dfn)
+                            assert b.defend(bitboard.card_to_int(att), bitboard.card_to_int(dfn))
+                            break
+                    else:
+                        assert d.finish_turn() == b.finish_turn()
+                else:
+                    options = [c for c in d.attacking_player.cards if d.can_add_to_field(c)]
+                    assert bitboard.cards_of(b.attack_mask()) == options
+                    if options and (not d.field or rng.random() < 0.5):
+                        card = rng.choice(options)
+                        assert d.attack(card)
+                        assert b.attack(bitboard.card_to_int(card))
+                    elif d.field:
+                        assert d.finish_turn() == b.finish_turn()
+                    else:
+                        break
+                assert b.serialized() == DurakSerialized.serialized(d)
+                assert bool(b.possible_to_beat) == bool(d.possible_to_beat)
+
+    def test_to_durak(self):
+        b = BitDurak(rng=random.Random(1))
+        b.attack(bitboard.ints_of(b.hands[0])[0])
+        d = b.to_durak()
+        assert BitDurak.from_durak(d).serialized() == b.serialized()
+        assert d.field == {bitboard.int_to_card(c): None for c in b.field}
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class TestBatch(unittest.TestCase):
+    def test_same_as_durak(self):
+        seeds = list(range(64))
+        decks = []
+        for seed in seeds:
+            deck = list(range(36))
+            random.Random(seed).shuffle(deck)
+            decks.append(deck)
+        games = [Durak(rng=random.Random(seed)) for seed in seeds]
+        b = batch.BatchDurak(len(seeds), rng=np.random.default_rng(0), decks=decks)
+
+        for _ in range(2000):
+            if not b.active.any():
+                break
+            kind, card, target = b.random_actions()
+            ok, result = b.step(kind, card, target)
+            for i, g in enumerate(games):
+                if kind[i] == batch.ACTION_ATTACK:
+                    assert g.attack(bitboard.int_to_card(card[i])) == ok[i]
+                elif kind[i] == batch.ACTION_DEFEND:
+                    assert g.defend(bitboard.int_to_card(target[i]), bitboard.int_to_card(card[i])) == ok[i]
+                elif kind[i] == batch.ACTION_FINISH:
+                    assert g.finish_turn().value == result[i]
+                expected = DurakSerialized.serialized(g)
+                expected['last_update'] = {}
+                assert b.serialized(i) == expected
+        assert not b.active.any()
+
+    def test_invalid_moves(self):
+        b = batch.BatchDurak(2, rng=np.random.default_rng(1))
+        cards = [bitboard.ints_of(int(b.hands[i, 1]))[0] for i in range(2)]
+        ok, _ = b.step([batch.ACTION_ATTACK] * 2, cards)
+        assert not ok.any()
+        ok, result = b.step([batch.ACTION_FINISH, batch.ACTION_NONE], [batch.NO_CARD] * 2)
+        assert list(ok) == [True, False] and result[1] == batch.NO_RESULT
+
+
+class TestBot(unittest.TestCase):
+    def test_determinizer(self):
+        rng = random.Random(3)
+        d = Durak(rng=random.Random(3))
+        d.attack(d.attacking_player[0])
+        d.finish_turn()
+        taken = list(d.players[1].cards)
+
+        det = Determinizer(d, 0, known_opp_cards=taken[:2])
+        for _ in range(20):
+            g = det.resample(rng)
+            assert g.players[0].cards == d.players[0].cards
+            assert g.players[1].n_cards == d.players[1].n_cards
+            assert set(taken[:2]) <= set(g.players[1].cards)
+            assert len(g.deck) == len(d.deck) and g.deck[-1] == d.trump
+            assert sorted(g.deck + g.players[1].cards) == sorted(d.deck + d.players[1].cards)
+
+    def test_search_returns_legal_action(self):
+        d = Durak(rng=random.Random(5))
+        bot = ISMCTS(budget_ms=20, rng=random.Random(5))
+        action = bot.search(d, d.attacker_index)
+        assert action in d.legal_actions(d.attacker_index)
+        assert bot.iterations >= 1
+        assert DurakSerialized.serialized(d) == DurakSerialized.serialized(Durak(rng=random.Random(5)))
+
+    def test_transpositions_share_nodes(self):
+        # семерки можно подкинуть в любом порядке: обе ветки приходят в один узел
+        d = DurakSerialized({
+            'trump': ('9', HEARTS), 'attacker_index': 0, 'winner': None, 'field': [], 'last_update': {}, 'deck': [],
+            'players': [{'index': 0, 'cards': [('7', SPADES), ('7', CLUBS), ('K', DIAMS)]},
+                        {'index': 1, 'cards': [('8', SPADES), ('8', CLUBS), ('6', DIAMS)]}]})
+        bot = ISMCTS(budget_ms=50, rng=random.Random(2))
+        assert bot.search(d, 0) in d.legal_actions(0)
+        assert bot.table.hits > 0
+
+    def test_forced_reply_keeps_both_updates(self):
+        game = DurakBotGame(my_index=0, budget_ms=50, rng=random.Random(1))
+        states = []
+        # как @mainthread в приложении: сохраняем, разбираем потом
+        game.on_state_updated = states.append
+        game.start()
+        self.addCleanup(game.stop)
+        with game._lock:
+            # боту нечем бить туза пик и нечего подкинуть: единственный ответ - взять
+            game.state = DurakSerialized({
+                'trump': ('9', HEARTS), 'attacker_index': 0, 'winner': None, 'field': [], 'last_update': {},
+                'deck': [('10', CLUBS), ('9', HEARTS)],
+                'players': [{'index': 0, 'cards': [('7', CLUBS), ('A', SPADES)]},
+                            {'index': 1, 'cards': [('6', DIAMS), ('7', DIAMS)]}]})
+            game._version += 1
+            states.clear()
+
+        assert game.attack(('A', SPADES))
+        assert wait_for(lambda: len(states) == 2)
+        attack, take = [s.last_update for s in states]
+        assert attack['action'] == UpdateAction.ATTACK and attack['card'] == ('A', SPADES)
+        assert take['action'] == UpdateAction.FINISH_TURN and take['take_cards']['player'] == 1
+        assert states[0].field == {('A', SPADES): None} and not states[1].field
+        assert ('A', SPADES) in states[1].players[1].cards
+
+    def test_game_must_override(self):
+        # без _state_changed партию нельзя даже создать
+        partial = type('Partial', (DurakGame,), {'start': lambda self: None, 'stop': lambda self: None})
+        with self.assertRaises(TypeError):
+            partial(0)
+
+    def test_bot_game(self):
+        game = DurakBotGame(my_index=0, budget_ms=2, rng=random.Random(1))
+        updated = threading.Event()
+        game.on_state_updated = lambda _: updated.set()
+        game.start()
+        rng = random.Random(1)
+        for _ in range(2000):
+            if game.state.winner is not None:
+                break
+            with game._lock:
+                if game.state.acting_player_index == game.my_index:
+                    actions = game.state.legal_actions(game.my_index)
+                    action = greedy_policy(game.state, actions, rng)
+                    game.state.apply(action)
+                    game._state_changed(action)
+                    continue
+            updated.wait(1.0)
+            updated.clear()
+        game.stop()
+        assert game.state.winner is not None
+
+
+def free_ports(n):
+    import socket
+    socks = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(n)]
+    for sock in socks:
+        sock.bind(('127.0.0.1', 0))
+    ports = [sock.getsockname()[1] for sock in socks]
+    for sock in socks:
+        sock.close()
+    return ports
+
+
+def wait_for(predicate, timeout=5.0):
+    import time
+    t0 = time.monotonic()
+    while time.monotonic() < t0 + timeout:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestNetGame(unittest.TestCase):
+    network_cls = Networking
+
+    def make_games(self):
+        ports = free_ports(2)
+        a = DurakNetGame(1, 2, '127.0.0.1', ports, network_cls=self.network_cls)
+        b = DurakNetGame(2, 1, '127.0.0.1', ports, network_cls=self.network_cls)
+        return a, b
+
+    def make_pair(self):
+        a, b = self.make_games()
+        b.start()
+        a.start()
+        self.addCleanup(a.stop)
+        self.addCleanup(b.stop)
+        assert wait_for(lambda: b.state.state_hash == a.state.state_hash)
+        return a, b
+
+    def test_moves_are_deltas(self):
+        a, b = self.make_pair()
+        sent = []
+        send_bytes = a._channel.send_bytes
+        a._channel.send_bytes = lambda data: sent.append(codec.loads(data)) or send_bytes(data)
+
+        rng = random.Random(0)
+        for _ in range(30):
+            if a.state.winner is not None:
+                break
+            game = a if a.state.acting_player_index == a.my_index else b
+            with game._lock:
+                action = greedy_policy(game.state, game.state.legal_actions(game.my_index), rng)
+            if action[0] == UpdateAction.ATTACK:
+                assert game.attack(action[1])
+            elif action[0] == UpdateAction.DEFEND:
+                assert game.defend(action[2], action[1])
+            else:
+                game.finish_turn()
+            assert wait_for(lambda: a._seq == b._seq and a.state.state_hash == b.state.state_hash)
+
+        assert sent and all(j['action'] == 'move' for j in sent)
+        assert a._binary and b._binary
+
+    def test_resync_on_checksum_mismatch(self):
+        a, b = self.make_pair()
+        b.state.players[0].cards.pop()
+        b.state._init_derived()
+        card = a.state.attacking_player[0]
+        a.attack(card)
+        assert wait_for(lambda: b.state.state_hash == a.state.state_hash and b._seq == a._seq)
+        assert b.state.players[0].cards == a.state.players[0].cards
+
+    def test_resume_after_roaming(self):
+        a, b = self.make_games()
+        # для roamed сосед сменил сеть: его пакеты приходят с 127.0.0.2, а старый адрес больше не отвечает
+        roamed = set()
+        for game in (a, b):
+            game._channel.keepalive = 0.1
+            on_frame = game._channel._on_frame
+            send_bytes = game._sender.send_bytes
+
+            def moved_on_frame(data, addr, game=game, on_frame=on_frame):
+                on_frame(data, ('127.0.0.2', addr[1]) if game in roamed else addr)
+
+            def moved_send_bytes(data, to, game=game, send_bytes=send_bytes):
+                if game in roamed:
+                    host = to if isinstance(to, str) else to[0]
+                    if host != '127.0.0.2':
+                        return 0
+                    to = '127.0.0.1' if isinstance(to, str) else ('127.0.0.1', to[1])
+                return send_bytes(data, to)
+
+            game._channel._on_frame = moved_on_frame
+            game._sender.send_bytes = moved_send_bytes
+        b.start()
+        a.start()
+        self.addCleanup(a.stop)
+        self.addCleanup(b.stop)
+        assert wait_for(lambda: b.state.state_hash == a.state.state_hash)
+
+        mover = a if a.state.acting_player_index == a.my_index else b
+        other = b if mover is a else a
+        connected = []
+        other.on_connection_changed = connected.append
+        sent = []
+        send_json = mover._channel.send_json
+        mover._channel.send_json = lambda j, binary=False: sent.append(j['action']) or send_json(j, binary)
+
+        roamed.add(mover)
+        assert mover.attack(mover.state.attacking_player[0])
+        time.sleep(0.2)
+        assert other._seq == mover._seq - 1
+
+        # оба канала замечают обрыв сами (у other - по heartbeat), 'resume' приходит с нового адреса
+        assert wait_for(lambda: other._seq == mover._seq and other.state.state_hash == mover.state.state_hash
+                        and other._resuming is None and mover._resuming is None, timeout=15.0)
+        assert connected == [False, True] and other._channel.heartbeats > 0
+        remote = mover._channel._remote_addr
+        assert (remote if isinstance(remote, str) else remote[0]) == '127.0.0.2'
+        # дослан только недостающий ход
+        assert sent.count('move') == 2 and 'state' not in sent
+
+        # после переподключения канал работает как обычно
+        game = a if a.state.acting_player_index == a.my_index else b
+        action = game.state.legal_actions(game.my_index)[0]
+        if action[0] == UpdateAction.DEFEND:
+            assert game.defend(action[2], action[1])
+        else:
+            game.finish_turn()
+        assert wait_for(lambda: a._seq == b._seq and a.state.state_hash == b.state.state_hash)
+
+
+class TestAsyncNetGame(TestNetGame):
+    network_cls = AsyncNetworking
+
+    def test_no_reader_threads_and_instant_close(self):
+        event_loop()
+        threads = threading.active_count()
+        a, b = self.make_pair()
+        # ни читающих потоков, ни потоков повторной отправки: все ведет цикл событий
+        assert threading.active_count() <= threads
+
+        t0 = time.monotonic()
+        a.stop()
+        b.stop()
+        assert time.monotonic() - t0 < 0.1
+        assert wait_for(lambda: a._receiver._transport.is_closing() and b._receiver._transport.is_closing())
+
+
+class TestMuxNetGame(TestNetGame):
+    def make_games(self):
+        ports = free_ports(2)
+        mux_a = Multiplexer(ports, network_cls=self.network_cls, host='127.0.0.1')
+        mux_b = Multiplexer(ports, network_cls=self.network_cls, host='127.0.0.1')
+        self.addCleanup(mux_a.close)
+        self.addCleanup(mux_b.close)
+        assert {mux_a.port_no, mux_b.port_no} == set(ports)
+        self.muxes = mux_a, mux_b
+        a = DurakNetGame(1, 2, ('127.0.0.1', mux_b.port_no), mux=mux_a)
+        b = DurakNetGame(2, 1, ('127.0.0.1', mux_a.port_no), mux=mux_b)
+        return a, b
+
+    def test_sessions_share_socket(self):
+        a, b = self.make_pair()
+        mux_a, mux_b = self.muxes
+        assert a._receiver is a._sender and a._receiver.session_id == b._receiver.session_id
+
+        # служебные сообщения идут мимо игровой сессии
+        mux_a.session(CONTROL).send_json({'action': 'discovery', 'sender': 1}, ('127.0.0.1', mux_b.port_no))
+        data, addr = mux_b.session(CONTROL).recv_json_until(lambda d: d and d.get('sender') == 1, 2.0)
+        assert data and addr[1] == mux_a.port_no
+
+        # чужая сессия никуда не попадает
+        mux_a.send(12345, b'{}', ('127.0.0.1', mux_b.port_no))
+        assert wait_for(lambda: mux_b.unrouted == 1)
+
+        # пустая датаграмма отбрасывается, прием продолжается
+        mux_b._on_datagram(b'', ('127.0.0.1', mux_a.port_no))
+        assert mux_b.unrouted == 2
+        mux_a.send(CONTROL, b'', ('127.0.0.1', mux_b.port_no))
+        mux_a.session(CONTROL).send_json({'action': 'discovery', 'sender': 3}, ('127.0.0.1', mux_b.port_no))
+        assert mux_b.session(CONTROL).recv_json_until(lambda d: d and d.get('sender') == 3, 2.0)[0]
+
+        a.stop()
+        assert a._receiver.session_id not in mux_a._sessions
+
+
+class TestAsyncMuxNetGame(TestMuxNetGame):
+    network_cls = AsyncNetworking
+
+
+class TestServer(unittest.TestCase):
+    def test_match_validation(self):
+        match = Match(1, ['a', 'b'])
+        g = match.state
+        attack = encode_move(g.legal_actions(g.attacker_index)[0])
+        defender = 1 - g.attacker_index
+
+        assert match.move(defender, 1, attack) == REJECTED
+        assert match.move(g.attacker_index, 2, attack) == EARLY
+        assert match.move(g.attacker_index, 1, attack) == APPLIED
+        assert match.move(g.attacker_index, 1, attack) == DUPLICATE
+        assert match.seq == 1 and len(g.field) == 1
+
+    def test_router_keeps_pairs_together(self):
+        router = Router([1001, 1002])
+        first = router.pick_shard('a')
+        assert router.pick_shard('a') == first
+        assert router.pick_shard('b') == first
+        assert router.pick_shard('c') != first
+
+    def start_shard(self):
+        port = free_ports(1)[0]
+        started = threading.Event()
+        loads = []
+        future = asyncio.run_coroutine_threadsafe(run_shard('127.0.0.1', port, on_report=loads.append,
+                                                            interval=0.05, started=started), event_loop())
+        self.addCleanup(future.cancel)
+        assert started.wait(2.0)
+        return port, loads
+
+    @staticmethod
+    def agree(a, b):
+        """
+        Клиенты видят одно и то же: руку соперника каждый раскладывает по-своему
+        """
+        with a._lock, b._lock:
+            x, y = a.state, b.state
+            return (list(x.field.items()) == list(y.field.items()) and x.attacker_index == y.attacker_index
+                    and len(x.deck) == len(y.deck) and x.winner == y.winner
+                    and all(x.players[i].n_cards == y.players[i].n_cards for i in (0, 1)))
+
+    def test_views_are_redacted(self):
+        match = Match(1, ['a', 'b'])
+        for index in 0, 1:
+            msg = match.state_message(index)
+            v = msg['state']
+            assert msg['action'] == 'view' and v['index'] == index
+            assert 'players' not in v and 'deck' in v and isinstance(v['deck'], int)
+            assert v['cards'] == match.state.players[index].cards and v['opp_cards'] == 6
+            game = from_view(codec.loads(codec.dumps(msg, binary=True))['state'], random.Random(index))
+            assert game.players[index].cards == match.state.players[index].cards
+            assert view_hash(game, index) == view_hash(match.state, index)
+
+        rng = random.Random(3)
+        while not match.finished:
+            g = match.state
+            index = g.acting_player_index
+            assert match.move(index, match.seq + 1, encode_move(rng.choice(g.legal_actions(index)))) == APPLIED
+            for i in 0, 1:
+                msg = codec.loads(codec.dumps(match.move_message(i), binary=True))
+                assert msg['checksum'] == view_hash(g, i)
+                if g.last_update.get('action') == UpdateAction.FINISH_TURN:
+                    assert [tuple(c) for c in msg['drawn']] == [c for j, c in g.last_update['from_deck'] if j == i]
+                else:
+                    assert 'drawn' not in msg
+
+    def test_malformed_move(self):
+        match = Match(1, ['a', 'b'])
+        for move in ([], None, ['attack', 6]):
+            assert match.move(match.state.attacker_index, 1, move) == MALFORMED
+        assert match.move(match.state.attacker_index, 1, ['surrender']) == REJECTED
+        assert match.seq == 0
+
+    def test_clients_play(self):
+        port, loads = self.start_shard()
+        a = DurakServerGame(1, ('127.0.0.1', port))
+        b = DurakServerGame(2, ('127.0.0.1', port))
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        for game in a, b:
+            game.journal = gamelog.JournalWriter(os.path.join(tmp.name, f'{game._my_id}.log'))
+            game.start()
+            self.addCleanup(game.stop)
+        assert wait_for(lambda: a.joined and b.joined and a.seq == b.seq == 0 and self.agree(a, b))
+        assert {a.my_index, b.my_index} == {0, 1}
+
+        # ход не по правилам сервер отклоняет и присылает свое состояние
+        cheater = a if a.state.acting_player_index != a.my_index else b
+        card = cheater.my_cards[0]
+        with cheater._lock:
+            cheater.state.attack(card)
+            cheater._state_changed((UpdateAction.ATTACK, card))
+        assert wait_for(lambda: card in cheater.my_cards and cheater.seq == 0)
+
+        rng = random.Random(1)
+        for _ in range(300):
+            if a.state.winner is not None:
+                break
+            game = a if a.state.acting_player_index == a.my_index else b
+            with game._lock:
+                action = greedy_policy(game.state, game.state.legal_actions(game.my_index), rng)
+            if action[0] == UpdateAction.ATTACK:
+                assert game.attack(action[1])
+            elif action[0] == UpdateAction.DEFEND:
+                assert game.defend(action[2], action[1])
+            else:
+                game.finish_turn()
+            assert wait_for(lambda: a.seq == b.seq == game.seq and self.agree(a, b) and not game._pending)
+
+        assert a.state.winner is not None and a.state.winner == b.state.winner
+
+        # журнал клиента воспроизводится, хотя скрытые карты по ходу партии перекладывались
+        for game in a, b:
+            with game._lock:
+                game.journal.close()
+                reader = gamelog.JournalReader(game.journal.path)
+                game_id, = reader.games()
+                n_actions = len(list(reader.actions(game_id)))
+                assert all(reader.state_at(game_id, seq) for seq in range(n_actions + 1))
+                assert reader.state_at(game_id).state_hash == game.state.state_hash
+        assert wait_for(lambda: loads and loads[-1]['rejected'] == 1 and loads[-1]['actions'] == a.seq)
+
+    def test_lost_move_is_resent(self):
+        # атакующему нужны две карты одного достоинства, чтобы сходить дважды подряд
+        while True:
+            match = Match(1, ['a', 'b'])
+            index = match.state.attacker_index
+            cards = match.state.players[index].cards
+            pair = next(([c, d] for c in cards for d in cards if c != d and c[0] == d[0]), None)
+            if pair:
+                break
+
+        game = DurakServerGame(1, ('127.0.0.1', 1))
+        lost = []
+
+        def server(j):
+            # сервер прямо в тесте; первая датаграмма с ходом теряется
+            if j['action'] != 'move':
+                return
+            if not lost:
+                lost.append(j)
+                return
+            result = match.move(index, j['seq'], j['move'])
+            if result in (APPLIED, DUPLICATE):
+                game._on_message(codec.loads(codec.dumps(match.move_message(index), binary=True)))
+            elif result == REJECTED:
+                game._on_message(match.state_message(index))
+
+        game._send = server
+        game._on_message({'action': 'joined', 'index': index})
+        game._on_message(match.state_message(index))
+        assert game.attack(pair[0]) and game.attack(pair[1])
+        # второй ход пришел без первого: сервер его не принял, но и состояние не прислал
+        assert list(game._pending) == [1, 2] and match.seq == 0 and len(game.state.field) == 2
+
+        game._running = True
+        self.addCleanup(game.stop)
+        threading.Thread(target=game._retry_job, daemon=True).start()
+        assert wait_for(lambda: not game._pending and match.seq == game.seq == 2)
+        assert list(game.state.field) == pair and view_hash(game.state, index) == view_hash(match.state, index)
+
+    def test_malformed_move_is_counted(self):
+        port, loads = self.start_shard()
+        a = DurakServerGame(1, ('127.0.0.1', port))
+        b = DurakServerGame(2, ('127.0.0.1', port))
+        for game in a, b:
+            game.start()
+            self.addCleanup(game.stop)
+        assert wait_for(lambda: a.joined and b.joined)
+        a._network.send_bytes(codec.dumps({'action': 'move', 'seq': 1, 'move': [], 'checksum': 0}), a._server)
+        assert wait_for(lambda: loads and loads[-1]['bad'] == 1 and loads[-1]['rejected'] == 0)
+
+
+class TestDiscovery(unittest.TestCase):
+    def test_peer_cache(self):
+        cache = PeerCache(ttl=0.05)
+        cache.seen(1, ('127.0.0.1', 1))
+        cache.seen(2, ('127.0.0.1', 2))
+        assert [pid for pid, _ in cache.recent()] == [2, 1]
+        time.sleep(0.06)
+        assert cache.recent() == [] and len(cache) == 0
+
+    def test_pairs_are_mutual(self):
+        n = 8
+        ports = free_ports(n)
+        muxes = [Multiplexer(ports, host='127.0.0.1', broadcast_addr='127.0.0.1') for _ in range(n)]
+        for mux in muxes:
+            self.addCleanup(mux.close)
+
+        found = {}
+
+        def scan(i):
+            pid = 1000 + i
+            protocol = DiscoveryProtocol(pid, net=muxes[i].session(CONTROL), peers=PeerCache(),
+                                         rng=random.Random(i))
+            found[pid] = protocol.run(timeout=5.0)[1]
+
+        threads = [threading.Thread(target=scan, args=(i,)) for i in range(n)]
+        t0 = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert all(peer is not None and found[peer] == pid for pid, peer in found.items())
+        assert time.monotonic() - t0 < 3.0
+
+
+class TestLobby(unittest.TestCase):
+    def test_queue(self):
+        lobby = Lobby()
+        assert lobby.join(1, 'a') is None
+        assert lobby.join(1, 'a2') is None
+        assert lobby.join(2, 'b') == (1, 'a2')
+        assert lobby.join(3, 'c') is None
+        lobby.leave(3)
+        assert lobby.join(4, 'd') is None and len(lobby) == 1
+        assert lobby.join(5, 'e') == (4, 'd') and len(lobby) == 0
+
+    def test_queue_expiry(self):
+        lobby = Lobby(ttl=1.0)
+        assert lobby.join(1, 'a', now=0) is None
+        assert lobby.join(1, 'a', now=0.8) is None
+        # 1 не повторял join дольше ttl - в пару он не попадет
+        assert lobby.join(2, 'b', now=1.9) is None and len(lobby) == 1
+        assert lobby.join(3, 'c', now=2.5) == (2, 'b') and len(lobby) == 0
+        assert lobby.join(4, 'd', now=3.0) is None
+        assert lobby.expire(now=3.5) == 0 and lobby.expire(now=4.5) == 1 and len(lobby) == 0
+
+    def test_client_disappears(self):
+        ports = free_ports(2)
+        broker = LobbyBroker(1, BroadcastGroup(ports, broadcast_addr='127.0.0.1'))
+        broker.WAITING_TTL = broker.lobby.ttl = 0.3
+        broker.ANNOUNCE_INTERVAL = 0.05
+        broker.start()
+        self.addCleanup(broker.stop)
+        muxes = [Multiplexer(ports, host='127.0.0.1', broadcast_addr='127.0.0.1') for _ in range(2)]
+        for mux in muxes:
+            self.addCleanup(mux.close)
+
+        # один 'lobby_join' и тишина: клиент пропал, не попрощавшись
+        gone = muxes[0].session(CONTROL)
+        gone.send_json({'action': 'lobby_join', 'sender': 3001, 'port': gone.port_no}, ('127.0.0.1', broker.port))
+        assert wait_for(lambda: len(broker.lobby) == 1)
+        assert wait_for(lambda: len(broker.lobby) == 0)
+
+        # клиент по таймауту уходит сам, не дожидаясь, пока брокер его забудет
+        broker.lobby.ttl = 5.0
+        client = LobbyClient(3002, muxes[1].session(CONTROL), rng=random.Random(1))
+        found = []
+        threading.Thread(target=lambda: found.append(client.run(timeout=0.5)), daemon=True).start()
+        assert wait_for(lambda: len(broker.lobby) == 1)
+        assert wait_for(lambda: found == [(None, None)])
+        assert wait_for(lambda: len(broker.lobby) == 0, timeout=1.0)
+        assert broker.matches == 0
+
+    def scan(self, n, ports, base_pid):
+        muxes = [Multiplexer(ports, host='127.0.0.1', broadcast_addr='127.0.0.1') for _ in range(n)]
+        for mux in muxes:
+            self.addCleanup(mux.close)
+        found = {}
+
+        def scan(i):
+            pid = base_pid + i
+            client = LobbyClient(pid, muxes[i].session(CONTROL), rng=random.Random(i))
+            found[pid] = client.run(timeout=5.0)[1]
+
+        threads = [threading.Thread(target=scan, args=(i,)) for i in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert all(peer is not None and found[peer] == pid for pid, peer in found.items())
+        return muxes
+
+    def test_elected_broker(self):
+        ports = free_ports(6)
+        muxes = self.scan(6, ports, 1000)
+        brokers = [hosted_broker(1000 + i) for i in range(6)]
+        assert sum(b is not None for b in brokers) == 1
+        broker = next(b for b in brokers if b is not None)
+        self.addCleanup(broker.stop)
+        assert broker.matches == 3
+        # никакой рассылки всем: join, ответ и объявления брокера
+        assert sum(mux.sent for mux in muxes) < 30
+
+    def test_headless_broker(self):
+        ports = free_ports(4)
+        broker = LobbyBroker(1, BroadcastGroup(ports, broadcast_addr='127.0.0.1'))
+        broker.start()
+        self.addCleanup(broker.stop)
+        self.scan(4, ports, 2000)
+        assert broker.matches == 2
+        assert all(hosted_broker(2000 + i) is None for i in range(4))
+
+
+class TestReliableChannel(unittest.TestCase):
+    network_cls = Networking
+
+    def make_channel(self, ports, lossy_rng=None):
+        receiver = self.network_cls(ports[0])
+        receiver.bind('127.0.0.1')
+        sender = self.network_cls(ports[1])
+        if lossy_rng is not None:
+            send_bytes = sender.send_bytes
+
+            def lossy_send(data, to):
+                if lossy_rng.random() < 0.3:
+                    return 0
+                if lossy_rng.random() < 0.1:
+                    send_bytes(data, to)
+                return send_bytes(data, to)
+
+            sender.send_bytes = lossy_send
+        channel = ReliableChannel(sender, receiver, '127.0.0.1')
+        self.addCleanup(channel.close)
+        return channel
+
+    def test_lossy_link(self):
+        ports = free_ports(2)
+        rng = random.Random(0)
+        a = self.make_channel(ports, rng)
+        b = self.make_channel(ports[::-1], rng)
+        received_a, received_b = [], []
+        a.run_reader_thread(received_a.append)
+        b.run_reader_thread(received_b.append)
+
+        n = 100
+        for i in range(n):
+            a.send_json({'action': 'test', 'i': i})
+            b.send_json({'action': 'test', 'i': -i}, binary=False)
+
+        assert wait_for(lambda: len(received_a) == len(received_b) == n and not a.unacked and not b.unacked, 20)
+        assert [m['i'] for m in received_b] == list(range(n))
+        assert [m['i'] for m in received_a] == [-i for i in range(n)]
+        assert a.retransmissions and b.duplicates
+        assert a.srtt is not None and a.rto >= 0.03
+        # потерю видит получатель по пропускам в нумерации; повторы отправителя ее не заменяют
+        assert 0 < b.gaps < b.expected and b.expected >= n
+
+    def test_heartbeat_detects_silent_loss(self):
+        ports = free_ports(2)
+        a = self.make_channel(ports)
+        b = self.make_channel(ports[::-1])
+        a.keepalive = 0.05
+        stalls = []
+        a.on_stall = lambda: stalls.append(time.monotonic())
+        a.run_reader_thread(lambda _: ...)
+        b.run_reader_thread(lambda _: ...)
+        assert wait_for(lambda: a.heartbeats >= 2 and not a.unacked)
+        assert not stalls
+
+        # сосед пропал, а нам отправлять нечего - обрыв замечаем по heartbeat
+        b.close()
+        assert wait_for(lambda: stalls, timeout=10.0)
+
+
+class TestAsyncReliableChannel(TestReliableChannel):
+    network_cls = AsyncNetworking
+
+    def test_no_retransmit_threads(self):
+        event_loop()
+        threads = threading.active_count()
+        ports = free_ports(2)
+        a = self.make_channel(ports)
+        b = self.make_channel(ports[::-1])
+        a.run_reader_thread(lambda _: ...)
+        b.run_reader_thread(lambda _: ...)
+        assert threading.active_count() == threads
+
+
+class TestLoadGen(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(101))
+        assert percentile(values, 50) == 50 and percentile(values, 99) == 99
+        assert percentile([1.0, 2.0], 50) == 1.5
+        assert percentile([], 50) is None
+
+    def test_two_players(self):
+        stats = run_load(2, policy='greedy', port=free_ports(1)[0], network_cls=AsyncNetworking)
+        assert stats['games'] == stats['finished'] == 1 and stats['mismatched'] == 0
+        assert stats['latency_ms']['samples'] > 0 and stats['latency_ms']['p50'] <= stats['latency_ms']['p99']
+        assert stats['messages_per_sec'] > 0 and stats['cpu_ms_per_game'] is not None
+        # без --loss теряется разве что первый пакет, пока соперник еще не слушает
+        assert stats['dropped'] == 0 and stats['gaps'] <= stats['retransmissions']
+
+    def test_lossy_players(self):
+        stats = run_load(2, policy='greedy', port=free_ports(1)[0], loss=0.2)
+        assert stats['games'] == stats['finished'] == 1
+        assert stats['dropped'] > 0 and 0.1 < stats['injected_loss'] < 0.3
+        assert 0 < stats['loss'] < 0.5 and stats['retransmissions'] > 0
+
+
+class TestCodec(unittest.TestCase):
+    @staticmethod
+    def as_json(j):
+        return json.loads(json.dumps(j))
+
+    def test_state_round_trip(self):
+        for seed in range(20):
+            rng = random.Random(seed)
+            d = DurakSerialized(DurakSerialized.serialized(Durak(rng=random.Random(seed))))
+            while d.winner is None:
+                d.apply(rng.choice(d.legal_actions()))
+                msg = {'action': 'state', 'seq': 5, 'state': d.serialized()}
+                data = codec.encode(msg)
+                assert len(data) < 100
+                assert self.as_json(codec.loads(data)) == self.as_json(msg)
+                assert DurakSerialized(codec.loads(data)['state']).state_hash == d.state_hash
+
+    def test_messages(self):
+        for msg in [{'action': 'move', 'seq': 3, 'checksum': 2 ** 64 - 1, 'move': ['defend', ['6', '♠'], ['7', '♠']]},
+                    {'action': 'move', 'seq': 4, 'checksum': 1, 'move': ['finish_turn']},
+                    {'action': 'resync'}, {'action': 'quit'}]:
+            data = codec.dumps(msg, binary=True)
+            assert codec.is_binary(data)
+            assert codec.loads(data) == msg
+        hello = {'action': 'hello', 'codecs': [codec.VERSION]}
+        assert codec.loads(codec.dumps(hello, binary=True)) == hello
+
+    def test_corrupted(self):
+        data = bytearray(codec.encode({'action': 'move', 'seq': 1, 'checksum': 7, 'move': ['attack', ['A', '♥']]}))
+        data[-1] ^= 1
+        with self.assertRaises(codec.CodecError):
+            codec.decode(bytes(data))
+
+
+class TestSelfPlay(unittest.TestCase):
+    def test_reproducible(self):
+        a = play_range(['random', 'greedy'], 7, 0, 20)
+        b = simulate(['random', 'greedy'], 20, seed=7, workers=1, chunk=3)
+        assert a['games'] == b['games'] == 20
+        assert a['wins'] == b['wins'] and a['turns'] == b['turns']
+        assert a['unfinished'] == 0
+
+    def test_action_count(self):
+        calls = []
+
+        def counting(game, actions, rng):
+            calls.append(1)
+            return greedy_policy(game, actions, rng)
+
+        for max_actions in (10, 1000):
+            calls.clear()
+            winner, _, n_actions = play_game([counting, counting], random.Random(2), max_actions)
+            assert n_actions == len(calls) <= max_actions
+            assert (winner is None) == (max_actions == 10)
+
+
+class TestGameLog(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'games.log')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def record(self, n_games=3, snapshot_every=5):
+        """
+        :return: номер партии -> хэши состояний после каждого действия, начиная с нулевого
+        """
+        hashes = {}
+        with gamelog.JournalWriter(self.path, snapshot_every=snapshot_every) as journal:
+            for game_no in range(n_games):
+                game = Durak(rng=random.Random(game_no))
+                game_id = journal.new_game(game, game_no)
+                hashes[game_id] = [game.state_hash]
+                rng = random.Random(-game_no)
+                while game.winner is None:
+                    action = rng.choice(game.legal_actions(game.acting_player_index))
+                    game.apply(action)
+                    journal.action(game_id, action, game)
+                    hashes[game_id].append(game.state_hash)
+        return hashes
+
+    def test_replay_any_action(self):
+        hashes = self.record()
+        reader = gamelog.JournalReader(self.path)
+        assert reader.games() == list(hashes)
+        for game_id, game_hashes in hashes.items():
+            assert len(list(reader.actions(game_id))) == len(game_hashes) - 1
+            for seq in [0, 1, 4, 5, 6, len(game_hashes) // 2, len(game_hashes) - 1]:
+                assert reader.state_at(game_id, seq).state_hash == game_hashes[seq]
+            assert reader.state_at(game_id).winner is not None
+        with self.assertRaises(KeyError):
+            reader.state_at(0, len(hashes[0]))
+
+    def test_match_journal(self):
+        with gamelog.JournalWriter(self.path) as journal:
+            match = Match(1, ['a', 'b'], journal)
+            rng = random.Random(4)
+            while not match.finished:
+                index = match.state.acting_player_index
+                action = rng.choice(match.state.legal_actions(index))
+                assert match.move(index, match.seq + 1, encode_move(action)) == APPLIED
+        reader = gamelog.JournalReader(self.path)
+        assert reader.games() == [match.journal_id]
+        assert len(list(reader.actions(match.journal_id))) == match.seq
+        assert reader.state_at(match.journal_id).state_hash == match.state.state_hash
+
+    def test_bot_game_journal(self):
+        journal = gamelog.JournalWriter(self.path, snapshot_every=7)
+        game = DurakBotGame(my_index=0, budget_ms=2, rng=random.Random(2))
+        game.journal = journal
+        hashes = []
+        updated = threading.Event()
+
+        def on_state_updated(state):
+            hashes.append(state.state_hash)
+            updated.set()
+
+        game.on_state_updated = on_state_updated
+        game.start()
+        rng = random.Random(2)
+        for _ in range(2000):
+            if game.state.winner is not None:
+                break
+            with game._lock:
+                if game.state.acting_player_index == game.my_index:
+                    action = greedy_policy(game.state, game.state.legal_actions(game.my_index), rng)
+                    game.state.apply(action)
+                    game._state_changed(action)
+                    continue
+            updated.wait(1.0)
+            updated.clear()
+        game.stop()
+        journal.close()
+
+        # ходы игрока и бота записаны по порядку, с первого состояния
+        reader = gamelog.JournalReader(self.path)
+        game_id, = reader.games()
+        assert [reader.state_at(game_id, seq).state_hash for seq in range(len(hashes))] == hashes
+        assert reader.state_at(game_id).winner is not None
+
+    def test_index_rebuild_and_torn_tail(self):
+        hashes = self.record(n_games=2)
+        with open(gamelog.index_path(self.path), 'rb') as f:
+            index = f.read()
+        os.remove(gamelog.index_path(self.path))
+        reader = gamelog.JournalReader(self.path)
+        with open(gamelog.index_path(self.path), 'rb') as f:
+            assert f.read() == index
+
+        # последняя запись оборвана на середине
+        size = os.path.getsize(self.path)
+        with open(self.path, 'r+b') as f:
+            f.truncate(size - 3)
+        last = len(hashes[1]) - 1
+        assert reader.state_at(1, last - 1).state_hash == hashes[1][last - 1]
+        with self.assertRaises(KeyError):
+            reader.state_at(1, last)
+
+    def test_selfplay_journal(self):
+        with gamelog.JournalWriter(self.path) as journal:
+            winner, _, n_actions = play_game([greedy_policy, greedy_policy], random.Random(3), journal=journal,
+                                             game_id=42)
+        state = gamelog.JournalReader(self.path).state_at(42)
+        assert state.winner == winner
+        assert state.state_hash == gamelog.JournalReader(self.path).state_at(42, n_actions).state_hash
+
+    def test_reused_game_id(self):
+        # play_range дописывает в тот же файл с теми же номерами партий
+        results = []
+        for seed in [1, 2]:
+            with gamelog.JournalWriter(self.path, snapshot_every=5) as journal:
+                results.append(play_game([greedy_policy, random_policy], random.Random(seed), journal=journal,
+                                         game_id=0))
+        reader = gamelog.JournalReader(self.path)
+        starts = reader.starts(0)
+        assert len(starts) == 2 and reader.games() == [0]
+        for start, (winner, _, n_actions) in zip(starts, results):
+            actions = list(reader.actions(0, start))
+            assert len(actions) == n_actions
+            assert reader.state_at(0, start=start).winner == winner
+            # ходы из actions() доигрываются от начала той же партии, что читает state_at()
+            state = reader.state_at(0, 0, start)
+            for seq, action in enumerate(actions, 1):
+                assert state.apply(action)
+                if seq % 7 == 0:
+                    assert state.state_hash == reader.state_at(0, seq, start).state_hash
+            assert state.state_hash == reader.state_at(0, start=start).state_hash
+        assert list(reader.actions(0)) == list(reader.actions(0, starts[-1]))
+        with self.assertRaises(KeyError):
+            reader.state_at(0, start=starts[0] + 1)
+
+
+
+class TestMetrics(unittest.TestCase):
+    def test_disabled_is_free(self):
+        def f():
+            pass
+        assert not metrics.ENABLED
+        assert metrics.timed('f')(f) is f
+
+    def test_registry(self):
+        registry = metrics.Registry()
+        for us in [0.5, 3, 3, 100, 5000]:
+            registry.observe('op', us)
+        registry.count('bytes', 10)
+        registry.count('bytes', 5)
+        snapshot = json.loads(registry.to_json())
+        assert snapshot['counters'] == {'bytes': 15}
+        op = snapshot['histograms']['op']
+        assert op['count'] == 5 and op['max_us'] == 5000
+        assert op['p50_us'] == 4 and op['p99_us'] == 5000
+        assert 'op.p95_us' in registry.to_text()
+
+    def test_endpoint(self):
+        metrics.REGISTRY.count('test.endpoint', 3)
+        self.addCleanup(metrics.REGISTRY.reset)
+        server = metrics.serve(0)
+        self.addCleanup(server.shutdown)
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+        with urllib.request.urlopen(url) as r:
+            assert 'test.endpoint 3' in r.read().decode()
+        with urllib.request.urlopen(url + '/json') as r:
+            assert json.load(r)['counters']['test.endpoint'] == 3
+
+    def test_enabled_by_env(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'metrics.json')
+            code = ('import random; from src.sim.selfplay import play_game; from src.sim.policies import POLICIES; '
+                    'play_game([POLICIES["random"]] * 2, random.Random(0))')
+            subprocess.run([sys.executable, '-c', code], check=True, timeout=60,
+                           env={**os.environ, 'metrics': '1', 'metrics_file': path})
+            with open(path) as f:
+                snapshot = json.load(f)
+        histograms = snapshot['histograms']
+        assert histograms['durak.attack']['count'] > 0 and histograms['durak.finish_turn']['count'] > 0
+
+    def test_network_timings(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'metrics.json')
+            code = ('import time; from src.network.aio import AsyncNetworking; '
+                    'a = AsyncNetworking(0); a.bind("127.0.0.1"); got = []; a.run_reader_thread(got.append); '
+                    'b = AsyncNetworking(a.port_no); b.send_json({"action": "x"}, "127.0.0.1"); '
+                    'b.send_bytes(b"{}", "127.0.0.1"); time.sleep(0.5); assert got')
+            subprocess.run([sys.executable, '-c', code], check=True, timeout=60,
+                           env={**os.environ, 'metrics': '1', 'metrics_file': path})
+            with open(path) as f:
+                histograms = json.load(f)['histograms']
+        # отправка меряется по send_bytes, куда сходятся все пути, прием - по callback на датаграмму
+        assert histograms['net.send_bytes']['count'] == 2 and 'net.send_json' not in histograms
+        assert histograms['net.reader_callback']['count'] >= 1
+
+
+
+class TestAnimation(unittest.TestCase):
+    def make_cards(self, n, capacity=None):
+        from kivy.uix.widget import Widget
+        from ..gui.animation import AnimationSystem
+        from ..gui.card import Card
+
+        root = Widget()
+        cls = AnimationSystem if capacity is None else type('Small', (AnimationSystem,), {'CAPACITY': capacity})
+        system = cls(root)
+        self.addCleanup(system.stop)
+        cards = []
+        for i in range(n):
+            card = Card.make(DECK[i])
+            card.animator = system
+            root.add_widget(card)
+            cards.append(card)
+        return system, cards
+
+    def test_idle_until_target_changes(self):
+        system, cards = self.make_cards(3)
+        assert not system.running
+
+        cards[0].set_animated_targets(200, 300, 45)
+        assert system.running and len(system) == 1
+        for _ in range(12):
+            system.update(system.duration / 10)
+        # движение заканчивается точно в цели, после чего кадры больше не нужны
+        assert tuple(cards[0].center) == (200, 300) and cards[0].rotation == 45
+        assert not system.running and len(system) == 0
+
+        # цель совпадает с текущим местом - будить незачем
+        cards[1].set_animated_targets(*cards[1].center, 0)
+        assert not system.running
+
+    def test_immediate_move_restarts_tween(self):
+        system, cards = self.make_cards(1)
+        card = cards[0]
+        card.set_animated_targets(100, 100, 0)
+        system.update(system.duration / 2)
+        card.set_immeditate_attr(500, 500, 0)
+        system.update(system.duration / 2)
+        x, y = card.center
+        assert 100 < x < 500 and 100 < y < 500
+        system.update(system.duration)
+        assert tuple(card.center) == (100, 100) and not system.running
+
+    def test_resize_during_tween(self):
+        system, cards = self.make_cards(1)
+        card = cards[0]
+        card.set_animated_targets(200, 300, 0)
+        system.update(system.duration / 2)
+        card.size = (card.width * 2, card.height * 2)
+        system.update(system.duration)
+        assert tuple(card.center) == (200, 300) and not system.running
+
+    def test_writes_only_moving_widgets(self):
+        # слотов на старте меньше, чем карт
+        system, cards = self.make_cards(len(DECK), capacity=8)
+        writes = [0] * len(cards)
+        for i, card in enumerate(cards):
+            card.bind(pos=lambda *_, i=i: writes.__setitem__(i, writes[i] + 1))
+
+        for card in cards[::2]:
+            card.set_animated_targets(300, 300, 10)
+        assert len(system) == len(cards) // 2
+        for _ in range(40):
+            system.update(1 / 60)
+        assert not system.running
+        assert all(writes[i] > 0 for i in range(0, len(cards), 2))
+        assert not any(writes[i] for i in range(1, len(cards), 2))
+        assert all(tuple(c.center) == (300, 300) and c.rotation == 10 for c in cards[::2])
+
+
+class TestAtlas(unittest.TestCase):
+    def test_build_and_use(self):
+        from kivy.atlas import Atlas
+        from ..gui import atlas
+        from ..gui.card import Card
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'cards')
+            atlas.build(path)
+            loaded = atlas.load(path)
+            assert loaded == path
+            textures = Atlas(f'{path}.atlas').textures
+            assert set(textures) == {atlas.face_id(c) for c in DECK} | {atlas.BACK, atlas.BLANK}
+            assert all(t.size == atlas.FACE_SIZE for t in textures.values())
+            # грани разные
+            assert textures['card0'].pixels != textures['card1'].pixels
+
+            self.addCleanup(setattr, Card, 'face_atlas', None)
+            Card.face_atlas = loaded
+            card = Card.make(('Q', HEARTS))
+            assert card.text == '' and card.background_normal == f'atlas://{path}/{atlas.face_id(("Q", HEARTS))}'
+            card.opened = False
+            assert card.background_normal.endswith('/back')
+
+            deck = Card.make(('', ''))
+            deck.counter = 24
+            assert deck.background_normal.endswith('/blank') and deck._glyph.size[0] > 0
+            # одинаковые надписи не верстаются заново
+            other = Card.make(('', ''))
+            other.counter = 24
+            assert other._glyph.texture is deck._glyph.texture
+
+
+class TestBench(unittest.TestCase):
+    def test_all_benchmarks_run(self):
+        report = bench.run(min_time=0.001, repeat=1)
+        assert set(report['results']) == set(bench.BENCHMARKS)
+        assert all(ns > 0 for ns in report['results'].values())
+
+    def test_regressions(self):
+        baseline = {'results': {'a': 100.0, 'b': 100.0, 'c': 100.0}}
+        report = {'results': {'a': 120.0, 'b': 150.0, 'd': 1000.0}}
+        assert bench.compare(report, baseline, threshold=0.25) == {'b': 1.5}
+
 
 if __name__ == '__main__':
     unittest.main()